@@ -0,0 +1,121 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Union
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+CALC_CACHE_ALIAS = 'calcs'
+
+
+def get_catalog_version(app_label: str) -> int:
+    '''
+    version of the catalog (materials, diameters, fittings...) of the app.
+
+    The version is kept in a stamp file, so every process reads the same version
+    with one small read, and a change in the catalog invalidates everything
+    calculated from it before.
+    '''
+    try:
+        return int(Path(settings.CALC_CACHE_VERSION_DIR, f'{app_label}.version').read_text() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def bump_catalog_version(app_label: str) -> int:
+    '''
+    increments the version of the catalog of the app, returns the new version
+    '''
+    directory = Path(settings.CALC_CACHE_VERSION_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    # the lock keeps the version increasing when many processes bump it at once
+    with open(directory / f'{app_label}.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        version = get_catalog_version(app_label) + 1
+        temporary = directory / f'{app_label}.version.tmp'
+        temporary.write_text(str(version))
+        os.replace(temporary, directory / f'{app_label}.version')
+    logger.debug(f'Catalog version of {app_label}: {version}')
+    return version
+
+
+class CatalogBump():
+    '''
+    bump of the catalog version of an app, queued to run on commit
+    '''
+
+    def __init__(self, app_label: str):
+        self.app_label = app_label
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        bump_catalog_version(self.app_label)
+
+
+def bump_catalog_version_on_commit(app_label: str, using: str = None):
+    '''
+    bumps the version after the running transaction is committed, only once however
+    many rows of the catalog it changes, so a cache never rebuilds from rows that may
+    be rolled back and a bulk load doesn't bump it for every row
+    '''
+    connection = transaction.get_connection(using)
+    # a pending bump runs whenever this change is committed, the callbacks of a savepoint
+    # rolled back are dropped with it
+    for (_, callback, *_) in connection.run_on_commit:
+        if isinstance(callback, CatalogBump) and callback.app_label == app_label and not callback.done:
+            return
+    transaction.on_commit(CatalogBump(app_label), using=using)
+
+
+def get_canonical_data(data: Any) -> Any:
+    '''
+    same data for the same input, with the numbers as floats and without the empty fields
+    '''
+    kind = type(data)
+    if kind is dict:
+        return {field: get_canonical_data(value) for (field, value) in data.items() if value is not None}
+    if kind is list:
+        return [get_canonical_data(value) for value in data]
+    if kind is int:
+        return float(data)
+    if isinstance(data, dict):
+        return get_canonical_data(dict(data))
+    if isinstance(data, (list, tuple)):
+        return get_canonical_data(list(data))
+    return data
+
+
+def get_calc_cache_key(app_label: str, data: dict) -> str:
+    '''
+    sha256 of the canonical json of the normalized input of a calc and the catalog version
+    '''
+    payload = json.dumps(
+        get_canonical_data(data), sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str
+    )
+    digest = hashlib.sha256(f'{get_catalog_version(app_label)}:{payload}'.encode()).hexdigest()
+    return f'{app_label}:{digest}'
+
+
+def get_cached_result(key: str, fileinfo: dict = None) -> Union[dict, None]:
+    '''
+    returns the stored result, with the dates of `fileinfo`, which are left out of the key
+    '''
+    result = caches[CALC_CACHE_ALIAS].get(key)
+    if result is not None and fileinfo:
+        result['fileinfo'] = {
+            **(result.get('fileinfo') or {}),
+            **{field: value for (field, value) in fileinfo.items() if field in ('created', 'updated')},
+        }
+    return result
+
+
+def set_cached_result(key: str, result: dict):
+    caches[CALC_CACHE_ALIAS].set(key, dict(result))
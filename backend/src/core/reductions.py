@@ -0,0 +1,163 @@
+import heapq
+from collections import deque
+from threading import Lock
+from typing import Dict, Iterable, List, Tuple
+
+from django.apps import apps
+from django.db.models import Model
+
+from .cache import get_catalog_version
+
+
+class ReductionGraph():
+    '''
+    Reductions (and enlargements) between the diameters of one material of the
+    catalog of an app, `shp` or `igc`.
+
+    The chains between every pair of diameters are computed once, always going
+    in the same direction, the shortest by count of reductions and the shortest
+    by equivalent length. After that every lookup is a dict hit.
+
+    The graphs are cached by app and material in each process and rebuilt lazily
+    when the catalog version of the app changes.
+    '''
+
+    material_id: int = None
+    by_count: Dict[Tuple[int, int], List[Model]] = None
+    by_length: Dict[Tuple[int, int], List[Model]] = None
+
+    __caches: Dict[str, Dict[int, 'ReductionGraph']] = {}
+    __versions: Dict[str, int] = {}
+    __lock = Lock()
+
+    def __init__(self, material_id: int, diameters: Iterable[Model], reductions: Iterable[Model]):
+        self.material_id = material_id
+        internal_diameters: Dict[int, float] = {}
+        reductions_by_inlet: Dict[int, List[Model]] = {}
+        reductions_by_pair: Dict[Tuple[int, int], Model] = {}
+        for diameter in diameters:
+            internal_diameters[diameter.id] = float(diameter.internal_diameter)
+        for reduction in reductions:
+            internal_diameters.setdefault(reduction.outlet_diameter_id,
+                                          float(reduction.outlet_diameter.internal_diameter))
+            reductions_by_inlet.setdefault(reduction.inlet_diameter_id, []).append(reduction)
+            reductions_by_pair.setdefault((reduction.inlet_diameter_id, reduction.outlet_diameter_id), reduction)
+
+        self.by_count = {}
+        self.by_length = {}
+        for reduce in (True, False):
+            edges = self.__get_edges(internal_diameters, reductions_by_inlet, reduce)
+            for diameter_id in internal_diameters:
+                self.__add_chains(self.by_count, diameter_id, self.__search_by_count(diameter_id, edges))
+                self.__add_chains(self.by_length, diameter_id, self.__search_by_length(diameter_id, edges))
+
+        # a single reduction between the diameters is always the best chain
+        for (pair, reduction) in reductions_by_pair.items():
+            self.by_count[pair] = [reduction]
+            self.by_length.setdefault(pair, [reduction])
+
+    @staticmethod
+    def __get_edges(internal_diameters: Dict[int, float],
+                    reductions_by_inlet: Dict[int, List[Model]],
+                    reduce: bool) -> Dict[int, List[Model]]:
+        edges = {}
+        for (diameter_id, reductions) in reductions_by_inlet.items():
+            internal_diameter = internal_diameters[diameter_id]
+            if reduce:
+                edges[diameter_id] = [
+                    reduction for reduction in reductions
+                    if internal_diameters[reduction.outlet_diameter_id] < internal_diameter
+                ]
+            else:
+                edges[diameter_id] = [
+                    reduction for reduction in reductions
+                    if internal_diameters[reduction.outlet_diameter_id] > internal_diameter
+                ]
+        return edges
+
+    @staticmethod
+    def __search_by_count(diameter_id: int, edges: Dict[int, List[Model]]) -> Dict[int, Model]:
+        '''
+        breadth first search, returns the last reduction of the chain to every diameter reached
+        '''
+        previous: Dict[int, Model] = {}
+        queue = deque([diameter_id])
+        while queue:
+            inlet_diameter_id = queue.popleft()
+            for reduction in edges.get(inlet_diameter_id, []):
+                outlet_diameter_id = reduction.outlet_diameter_id
+                if outlet_diameter_id == diameter_id or outlet_diameter_id in previous:
+                    continue
+                previous[outlet_diameter_id] = reduction
+                queue.append(outlet_diameter_id)
+        return previous
+
+    @staticmethod
+    def __search_by_length(diameter_id: int, edges: Dict[int, List[Model]]) -> Dict[int, Model]:
+        '''
+        Dijkstra by equivalent length, returns the last reduction of the chain to every diameter reached
+        '''
+        previous: Dict[int, Model] = {}
+        lengths = {diameter_id: 0}
+        count = 0
+        heap = [(0, count, diameter_id)]
+        while heap:
+            length, _, inlet_diameter_id = heapq.heappop(heap)
+            if length > lengths[inlet_diameter_id]:
+                continue
+            for reduction in edges.get(inlet_diameter_id, []):
+                outlet_diameter_id = reduction.outlet_diameter_id
+                outlet_length = length + float(reduction.equivalent_length or 0)
+                if outlet_diameter_id in lengths and outlet_length >= lengths[outlet_diameter_id]:
+                    continue
+                lengths[outlet_diameter_id] = outlet_length
+                previous[outlet_diameter_id] = reduction
+                count += 1
+                heapq.heappush(heap, (outlet_length, count, outlet_diameter_id))
+        return previous
+
+    @staticmethod
+    def __add_chains(chains: Dict[Tuple[int, int], List[Model]],
+                     diameter_id: int,
+                     previous: Dict[int, Model]):
+        for outlet_diameter_id in previous:
+            chain = []
+            current_diameter_id = outlet_diameter_id
+            while current_diameter_id != diameter_id:
+                reduction = previous[current_diameter_id]
+                chain.append(reduction)
+                current_diameter_id = reduction.inlet_diameter_id
+            chain.reverse()
+            chains.setdefault((diameter_id, outlet_diameter_id), chain)
+
+    @classmethod
+    def for_material(cls, app_label: str, material_id: int) -> 'ReductionGraph':
+        version = get_catalog_version(app_label)
+        with cls.__lock:
+            if version != cls.__versions.get(app_label):
+                cls.__caches[app_label] = {}
+                cls.__versions[app_label] = version
+            graph = cls.__caches[app_label].get(material_id)
+        if graph is None:
+            diameters = apps.get_model(app_label, 'Diameter').objects.filter(material_id=material_id)
+            reductions = apps.get_model(app_label, 'Reduction').objects.filter(
+                inlet_diameter__material_id=material_id
+            ).select_related('outlet_diameter')
+            graph = cls(material_id, diameters, reductions)
+            with cls.__lock:
+                # a graph built while the version changed may be outdated
+                if version == cls.__versions.get(app_label):
+                    cls.__caches[app_label][material_id] = graph
+        return graph
+
+    def get_best_reduction(self, inlet_diameter_id: int, outlet_diameter_id: int) -> List[Model]:
+        '''
+        returns the chain with less reductions from the inlet to the outlet diameter
+        '''
+        return list(self.by_count.get((inlet_diameter_id, outlet_diameter_id), []))
+
+    def get_shortest_reduction(self, inlet_diameter_id: int, outlet_diameter_id: int) -> List[Model]:
+        '''
+        returns the chain with less equivalent length from the inlet to the outlet diameter
+        '''
+        return list(self.by_length.get((inlet_diameter_id, outlet_diameter_id), []))
@@ -0,0 +1,31 @@
+import os
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    '''
+    runs the tests with the catalog versions in a temporary directory, the catalogs
+    created by the tests never bump the versions of the project
+    '''
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.calc_cache_version_dir = tempfile.mkdtemp(prefix='calccache-')
+        self.calc_cache_version_settings = override_settings(CALC_CACHE_VERSION_DIR=self.calc_cache_version_dir)
+        self.calc_cache_version_settings.enable()
+        # the workers of the calcs load the settings again
+        self.calc_cache_version_environ = os.environ.get('CALC_CACHE_VERSION_DIR')
+        os.environ['CALC_CACHE_VERSION_DIR'] = self.calc_cache_version_dir
+
+    def teardown_test_environment(self, **kwargs):
+        if self.calc_cache_version_environ is None:
+            os.environ.pop('CALC_CACHE_VERSION_DIR', None)
+        else:
+            os.environ['CALC_CACHE_VERSION_DIR'] = self.calc_cache_version_environ
+        self.calc_cache_version_settings.disable()
+        shutil.rmtree(self.calc_cache_version_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -32,7 +32,9 @@ CORS_ALLOW_ALL_ORIGINS = True
 CORS_EXPOSE_HEADERS = (
     'content-length',
     'content-count',
-    'Content-Disposition'
+    'Content-Disposition',
+    'X-Calc-Cache',
+    'X-Calc-Cache-Key',
 )
 
 LOCAL_INSTALLED_APPS = [
@@ -220,3 +222,31 @@ LOGGING = {
 }
 
 CALC_LOGGING_DETAIL = env('CALC_LOGGING_DETAIL', default=True)
+
+# ########## CALC ##########
+# processes used by the jobs with independent calcs, lower than 2 runs them in the request process
+CALC_WORKERS = env.int('CALC_WORKERS', default=0)
+# python of the processes of CALC_WORKERS, by default the one of the running prefix, since under
+# uwsgi sys.executable is the uwsgi binary, see shp.executor.get_worker_executable
+CALC_PYTHON = env('CALC_PYTHON', default=None)
+# seconds a job with independent calcs may take
+CALC_TIMEOUT = env.float('CALC_TIMEOUT', default=300)
+# results of the calcs, keyed by the input and the catalog version, see core.cache
+CALC_CACHE_VERSION_DIR = env('CALC_CACHE_VERSION_DIR', default=os.path.join(BASE_DIR, '.calccache'))
+# the tests keep the versions in a temporary directory
+TEST_RUNNER = 'core.runner.TestRunner'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'calcs': {
+        # the local memory backend evicts the least recently used results
+        'BACKEND': env('CALC_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': env('CALC_CACHE_LOCATION', default='calcs'),
+        'TIMEOUT': env.int('CALC_CACHE_TIMEOUT', default=24 * 60 * 60),
+        'OPTIONS': {
+            'MAX_ENTRIES': env.int('CALC_CACHE_MAX_ENTRIES', default=500),
+        },
+    },
+}
@@ -0,0 +1,73 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.test import TestCase
+
+from igc import models as igc_models
+from shp import models as shp_models
+
+from .cache import CatalogBump, get_catalog_version
+from .reductions import ReductionGraph
+
+
+class ReductionGraphTest(TestCase):
+
+    @staticmethod
+    def create_material(models, internal_diameters: list[float], **fields) -> tuple:
+        '''
+        material with a reduction from every diameter to the next smaller one
+        '''
+        material = models.Material.objects.create(name='Material', **fields)
+        diameters = [
+            models.Diameter.objects.create(material=material, name=str(internal_diameter),
+                                           internal_diameter=internal_diameter)
+            for internal_diameter in internal_diameters
+        ]
+        for (inlet, outlet) in zip(diameters, diameters[1:]):
+            models.Reduction.objects.create(inlet_diameter=inlet, outlet_diameter=outlet,
+                                            name=f'{inlet.name} > {outlet.name}', equivalent_length=1)
+        return material, diameters
+
+    def test_chains_by_app(self):
+        # the catalog versions are bumped on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            shp_material, shp_diameters = self.create_material(shp_models, [65, 52, 40],
+                                                               hazen_williams_coefficient=120)
+            igc_material, igc_diameters = self.create_material(igc_models, [28, 22, 15, 10])
+
+        shp_graph = ReductionGraph.for_material('shp', shp_material.id)
+        igc_graph = ReductionGraph.for_material('igc', igc_material.id)
+        self.assertIsNot(shp_graph, igc_graph)
+        self.assertIs(shp_graph, ReductionGraph.for_material('shp', shp_material.id))
+        self.assertEqual(len(shp_graph.get_best_reduction(shp_diameters[0].id, shp_diameters[-1].id)), 2)
+        self.assertEqual(len(igc_graph.get_best_reduction(igc_diameters[0].id, igc_diameters[-1].id)), 3)
+        self.assertEqual(igc_graph.get_shortest_reduction(igc_diameters[-1].id, igc_diameters[0].id), [])
+
+
+class CatalogVersionTest(TestCase):
+
+    def test_temporary_directory(self):
+        self.assertNotEqual(Path(settings.CALC_CACHE_VERSION_DIR), Path(settings.BASE_DIR, '.calccache'))
+
+    def test_one_bump_per_transaction(self):
+        versions = {app_label: get_catalog_version(app_label) for app_label in ('shp', 'igc')}
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            ReductionGraphTest.create_material(shp_models, [65, 52, 40], hazen_williams_coefficient=120)
+            ReductionGraphTest.create_material(igc_models, [28, 22, 15, 10])
+        self.assertEqual(sorted(callback.app_label for callback in callbacks), ['igc', 'shp'])
+        self.assertTrue(all(isinstance(callback, CatalogBump) for callback in callbacks))
+        for (app_label, version) in versions.items():
+            self.assertEqual(get_catalog_version(app_label), version + 1)
+
+    def test_rolled_back_savepoint(self):
+        version = get_catalog_version('shp')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    shp_models.Material.objects.create(name='Desfeito', hazen_williams_coefficient=120)
+                    raise ValueError()
+            # the bump of the savepoint is dropped with it, the next change queues another one
+            ReductionGraphTest.create_material(shp_models, [65, 52], hazen_williams_coefficient=120)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(get_catalog_version('shp'), version + 1)
@@ -1,19 +1,26 @@
+import copy
 import logging
 from dataclasses import asdict
-from typing import List, Tuple, Union
+from typing import Dict, List, Union
 
+import numpy as np
 from django.conf import settings
 from django.utils import timezone
 
+from core.cache import get_calc_cache_key
 from core.models import Signatory
 
-from .dataclasses import IGCCalc, IGCCalcPath
+from .catalog import CatalogSnapshot
+from .constants import MAX_SPEED
+from .dataclasses import IGCCalc, IGCCalcPath, IGCCalcPathAlternative
 from .exceptions import (MoreThenOneReservoir, NoGasError, NoInitialDataError,
                          NoReservoir)
-from .models import (GAS, Config, Diameter, Fitting, FittingDiameter, Material,
-                     MaterialConnection)
+from .models import GAS, FittingDiameter, MaterialConnection
+from .network import IGCNetwork
 from .serializers import IGCCalcSerializer
-from .utils import format_decimal, get_best_reduction
+from .topology import IGCTopology
+from .utils import (format_decimal, get_end_pressures, get_pressure_drop_limit,
+                    get_pressure_drops, get_speeds)
 
 logger = logging.getLogger(__name__)
 
@@ -29,8 +36,23 @@ class IGC():
 
     igcCalc: IGCCalc = None
     serializer_class = IGCCalcSerializer
-
-    def __pre_init__(self, data):
+    topology: IGCTopology = None
+    order: List[IGCCalcPath] = None
+    network: IGCNetwork = None
+    catalog: CatalogSnapshot = None
+
+    # fields of the input overwritten by the calc, left out of the cache key
+    result_fields = ['error', 'calculated_at', 'max_fail_level']
+    sizing_result_fields = ['pressure_drop_margin', 'speed_margin', 'evaluations']
+    path_result_fields = [
+        'material', 'diameter', 'fittings', 'connection_names', 'equivalent_length', 'total_length',
+        'power_rating_accumulated', 'power_rating_adopted', 'concurrency_factor', 'flow', 'speed',
+        'start_pressure', 'end_pressure', 'pressure_drop', 'pressure_drop_color', 'pressure_drop_accumulated',
+        'pressure_drop_accumulated_color', 'fail', 'fail_level', 'diameter_alternatives',
+    ]
+
+    @staticmethod
+    def __pre_init__(data):
         paths = data.get('paths')
         attrToZero = [
             'power_rating_added',
@@ -49,12 +71,34 @@ class IGC():
                 path['fittings_ids'] = []
         return data
 
-    def __init__(self, data):
+    def __init__(self, data, catalog: CatalogSnapshot = None):
         if not data:
             raise NoInitialDataError()
         serializer = self.serializer_class(data=self.__pre_init__(data))
         serializer.is_valid(raise_exception=True)
         self.igcCalc = IGCCalc(**serializer.data)
+        self.catalog = catalog
+
+    @classmethod
+    def get_cache_key(cls, data: dict) -> str:
+        '''
+        key of the result of `data` in the calc cache, made from the normalized input,
+        without the volatile fields and the results of a previous calc. `data` is left unchanged
+        '''
+        data = cls.__pre_init__(copy.deepcopy(data))
+        data = {field: value for (field, value) in data.items() if field not in cls.result_fields}
+        data['fileinfo'] = {
+            field: value for (field, value) in (data.get('fileinfo') or {}).items() if field in ('type', 'version')
+        }
+        if data.get('sizing'):
+            data['sizing'] = {
+                field: value for (field, value) in data['sizing'].items() if field not in cls.sizing_result_fields
+            }
+        data['paths'] = [
+            {field: value for (field, value) in path.items() if field not in cls.path_result_fields}
+            for path in data.get('paths')
+        ]
+        return get_calc_cache_key('igc', data)
 
     def __getValue(self, obj, attr, empty='-'):
         value = getattr(obj, attr)
@@ -79,40 +123,107 @@ class IGC():
                   f'{" | ".join(map(lambda attr: "{:^15}".format(self.__trunk_string(attr,15)), fields))}')
             print('{:^8} | '.format('-----'),  f'{" | ".join(map(lambda attr: "{:^15}".format("----------"), fields))}')
 
-        print(
-            '{:<8} | '.format(f'{self.__getValue(p,"start")}-{self.__getValue(p,"end", "")}'),
-            f'{" | ".join(map(lambda attr: "{:>15}".format(self.__getValue(p,attr)), fields))}'
-        )
-        paths_after: list[IGCCalcPath] = self.get_paths_after(p)
-        for next_path in paths_after:
-            self.print_paths(next_path, False)
+        for path in self.topology.get_order(p):
+            print(
+                '{:<8} | '.format(f'{self.__getValue(path,"start")}-{self.__getValue(path,"end", "")}'),
+                f'{" | ".join(map(lambda attr: "{:>15}".format(self.__getValue(path,attr)), fields))}'
+            )
 
     def calculate(self) -> IGCCalcSerializer:
+        self.solve()
+        return self.get_serializer()
 
+    def solve(self):
+        '''
+        calculates the network and writes the results on the calc, without serializing them
+        '''
         self.__prepare_calc()
+        network = self.network
 
         # Calculate
         logger.debug('Calculating')
-        self.__sum_paths_power_rating_accumulated(self.igcCalc.reservoir_path)
-        self.__calculate_paths_power_rating_adopted()
-        self.__calculate_paths_flow()
-        self.__calculate_paths_pressure_drop()
-        self.__calculate_paths_pressure(self.igcCalc.reservoir_path)
+        self.__calculate_flows()
+        network.calculate_pressure_drops(self.igcCalc.gas, self.igcCalc.calc_type)
+        network.calculate_pressures(float(self.igcCalc.start_pressure), self.igcCalc.calc_type)
 
         # Finish calculation
         logger.debug('Finishing calculation')
-        self.__calculate_paths_speed()
-        self.__calculate_paths_pressure_drop_accumulated()
-        self.__sum_paths_fail_level(self.igcCalc.reservoir_path)
-        self.__calculate_paths_pressure_drop_color()
+        network.calculate_speeds()
+        network.calculate_pressure_drops_accumulated(
+            float(self.igcCalc.start_pressure), get_pressure_drop_limit(self.igcCalc.calc_type)
+        )
+        network.sum_fail_levels()
+        network.write_back()
+        if self.igcCalc.diameter_alternatives:
+            self.__calculate_paths_diameter_alternatives()
 
         logger.debug('Finished calculate')
 
+    def get_serializer(self) -> IGCCalcSerializer:
         self.igcCalc.calculated_at = timezone.now()
         return self.serializer_class(data=asdict(self.igcCalc))
 
+    def get_flows(self) -> List[IGCCalcPath]:
+        '''
+        prepares the calc and the flows of every path, without the pressures, the flows don't depend on the diameters
+
+        returns the paths of the network in pre-order from the reservoir
+        '''
+        self.__prepare_calc()
+        self.__calculate_flows()
+        self.network.write_back()
+        return self.order
+
+    def calculate_matrix(self, gas_ids: List[int], start_pressures: List[float], calc_types: List[str]) -> List[dict]:
+        '''
+        margins of the network with every combination of gas, start pressure and calc type, by calc type, gas
+        and start pressure. The network and its equivalent lengths are prepared once, and the gases are
+        loaded in one query.
+        '''
+        self.__prepare_calc()
+        network = self.network
+        gases = GAS.objects.in_bulk(gas_ids)
+        for gas_id in gas_ids:
+            if gas_id not in gases:
+                raise NoGasError()
+
+        network.sum_power_ratings()
+        results = []
+        for calc_type in calc_types:
+            pressure_drop_limit = get_pressure_drop_limit(calc_type)
+            network.calculate_power_ratings_adopted(calc_type)
+            for gas_id in gas_ids:
+                network.calculate_flows(gases[gas_id])
+                network.calculate_pressure_drops(gases[gas_id], calc_type)
+                for start_pressure in start_pressures:
+                    network.calculate_pressures(float(start_pressure), calc_type)
+                    network.calculate_speeds()
+                    network.calculate_pressure_drops_accumulated(float(start_pressure), pressure_drop_limit)
+                    network.sum_fail_levels()
+                    pressure_drop_margin = pressure_drop_limit - float(network.pressure_drop_accumulated.max())
+                    speed_margin = MAX_SPEED - float(network.speed.max())
+                    results.append({
+                        'gas_id': gas_id,
+                        'start_pressure': start_pressure,
+                        'calc_type': calc_type,
+                        'pressure_drop_margin': pressure_drop_margin,
+                        'speed_margin': speed_margin,
+                        'min_end_pressure': float(network.end_pressure.min()),
+                        'max_fail_level': network.max_fail_level,
+                        'accepted': pressure_drop_margin > 0 and speed_margin > 0,
+                    })
+        return results
+
+    def __calculate_flows(self):
+        network = self.network
+        network.sum_power_ratings()
+        network.calculate_power_ratings_adopted(self.igcCalc.calc_type)
+        network.calculate_flows(self.igcCalc.gas)
+
     def __prepare_calc(self):
-        self.igcCalc.gas: GAS = GAS.objects.get(id=self.igcCalc.gas_id)
+        if self.catalog is None:
+            self.catalog = CatalogSnapshot.for_calcs([self.igcCalc])
+        self.igcCalc.gas: GAS = self.catalog.get_gas(self.igcCalc.gas_id)
         if not self.igcCalc.gas:
             raise NoGasError()
         if self.igcCalc.signatory_id and self.igcCalc.signatory_id > 0:
@@ -124,10 +235,11 @@ class IGC():
         self.igcCalc.error = None
         self.igcCalc.calculated_at = None
         self.igcCalc.max_fail_level = 0
+        self.topology = IGCTopology(self.igcCalc.paths)
 
         for path in self.igcCalc.paths:
-            path.material = Material.objects.get(id=path.material_id)
-            path.diameter = Diameter.objects.get(id=path.diameter_id)
+            path.material = self.catalog.get_material(path.material_id)
+            path.diameter = self.catalog.get_diameter(path.diameter_id)
 
             if path.start == 'CG':
                 if self.igcCalc.reservoir_path:
@@ -149,6 +261,7 @@ class IGC():
             path.pressure_drop_accumulated_color = None
             path.fail = False
             path.fail_level = 0
+            path.diameter_alternatives = []
 
             path.connection_names = [
                 f'Comprimento extra: {format_decimal(path.equivalent_length)} m'
@@ -158,25 +271,9 @@ class IGC():
             previous_path = self.get_path_before(path)
 
             if previous_path and previous_path.material_id != path.material_id:
-                material_connections = (
-                    MaterialConnection.objects
-                    .filter(inlet_material=previous_path.material_id, outlet_material=path.material_id)
+                current_material_connection: MaterialConnection = self.catalog.get_material_connection(
+                    previous_path.material_id, previous_path.diameter_id, path.material_id, path.diameter_id
                 )
-                current_material_connection: MaterialConnection = None
-                for material_connection in material_connections.all():
-                    if (
-                        material_connection.inlet_diameter == previous_path.diameter_id
-                        and material_connection.outlet_diameter == path.diameter_id
-                    ):
-                        current_material_connection = material_connection
-                        break
-                    if (material_connection.inlet_diameter == previous_path.diameter_id):
-                        current_material_connection = material_connection
-                    elif (material_connection.outlet_diameter == path.diameter_id):
-                        current_material_connection = material_connection
-                    if not current_material_connection:
-                        current_material_connection = material_connection
-
                 if (current_material_connection and current_material_connection.equivalent_length):
                     path.equivalent_length += float(current_material_connection.equivalent_length)
                     path.connection_names.append(
@@ -184,7 +281,7 @@ class IGC():
                         f'{format_decimal(current_material_connection.equivalent_length)} m'
                     )
                     if current_material_connection.inlet_diameter_id != previous_path.diameter_id:
-                        inlet_reductions = get_best_reduction(
+                        inlet_reductions = self.catalog.get_best_reduction(
                             previous_path.diameter_id, current_material_connection.inlet_diameter_id)
                         for reduction in inlet_reductions:
                             if (reduction and reduction.equivalent_length):
@@ -193,7 +290,7 @@ class IGC():
                                     f'{reduction.name}: {format_decimal(reduction.equivalent_length)} m'
                                 )
                     if current_material_connection.outlet_diameter_id != path.diameter_id:
-                        outlet_reductions = get_best_reduction(
+                        outlet_reductions = self.catalog.get_best_reduction(
                             current_material_connection.outlet_diameter_id, path.diameter_id)
                         for reduction in outlet_reductions:
                             if (reduction and reduction.equivalent_length):
@@ -203,7 +300,7 @@ class IGC():
                                 )
 
             elif previous_path and previous_path.diameter_id != path.diameter_id:
-                inlet_reductions = get_best_reduction(previous_path.diameter_id, path.diameter_id)
+                inlet_reductions = self.catalog.get_best_reduction(previous_path.diameter_id, path.diameter_id)
                 for reduction in inlet_reductions:
                     if (reduction and reduction.equivalent_length):
                         path.equivalent_length += float(reduction.equivalent_length)
@@ -213,14 +310,9 @@ class IGC():
 
             # Get connections in the path
             if path.fittings_ids:
-                path.fittings = Fitting.objects.filter(id__in=path.fittings_ids)
+                path.fittings = self.catalog.get_fittings(path.fittings_ids)
                 for fitting_id in path.fittings_ids:
-                    fitting_diameter: FittingDiameter = (
-                        FittingDiameter.objects
-                        .filter(diameter_id=path.diameter_id, fitting=fitting_id)
-                        .prefetch_related('fitting')
-                        .first()
-                    )
+                    fitting_diameter: FittingDiameter = self.catalog.get_fitting_diameter(path.diameter_id, fitting_id)
                     if (fitting_diameter and fitting_diameter.equivalent_length):
                         path.equivalent_length += float(fitting_diameter.equivalent_length)
                         path.connection_names.append(
@@ -239,11 +331,8 @@ class IGC():
             if count_paths_after == 3:
                 connection_fitting_id = path.material.three_outlet_connection_id
             if connection_fitting_id:
-                fitting_diameter: FittingDiameter = (
-                    FittingDiameter.objects
-                    .filter(diameter_id=path.diameter_id, fitting=connection_fitting_id)
-                    .prefetch_related('fitting')
-                    .first()
+                fitting_diameter: FittingDiameter = self.catalog.get_fitting_diameter(
+                    path.diameter_id, connection_fitting_id
                 )
                 if (fitting_diameter and fitting_diameter.equivalent_length):
                     path.equivalent_length += float(fitting_diameter.equivalent_length)
@@ -255,70 +344,87 @@ class IGC():
 
         if not self.igcCalc.reservoir_path:
             raise NoReservoir()
-
-    def __sum_paths_power_rating_accumulated(self, path: IGCCalcPath):
-        paths_after: list[IGCCalcPath] = self.get_paths_after(path)
-        path.power_rating_accumulated = path.power_rating_added
-        for next_path in paths_after:
-            path.power_rating_accumulated += self.__sum_paths_power_rating_accumulated(next_path)
-        return path.power_rating_accumulated
-
-    def __calculate_paths_power_rating_adopted(self):
-        for path in self.igcCalc.paths:
-            path.calculate_power_rating_adopted(self.igcCalc.calc_type)
-
-    def __calculate_paths_flow(self):
-        for path in self.igcCalc.paths:
-            path.calculate_flow(self.igcCalc.gas)
-
-    def __calculate_paths_pressure_drop(self):
+        self.order = self.topology.get_order(self.igcCalc.reservoir_path)
+        self.network = IGCNetwork(self.igcCalc, self.order, self.topology)
+
+    def __calculate_paths_diameter_alternatives(self):
+        '''
+        pressure drop, end pressure and speed of every path with every diameter of its material,
+        with the start pressure and the flow of the calc, in one broadcast by material
+        '''
+        calc_type = self.igcCalc.calc_type
+        start_pressure = float(self.igcCalc.start_pressure)
+        pressure_drop_limit = get_pressure_drop_limit(calc_type)
+        paths_by_material: Dict[int, List[IGCCalcPath]] = {}
         for path in self.igcCalc.paths:
-            path.calculate_pressure_drop(self.igcCalc.gas, self.igcCalc.calc_type)
-
-    def __calculate_paths_pressure(self, path: IGCCalcPath):
-        if path == self.igcCalc.reservoir_path:
-            path.calculate_end_pressure(float(self.igcCalc.start_pressure), self.igcCalc.calc_type)
-        else:
-            path.calculate_end_pressure(path.start_pressure, self.igcCalc.calc_type)
-        paths_after: list[IGCCalcPath] = self.get_paths_after(path)
-        for next_path in paths_after:
-            next_path.start_pressure = path.end_pressure
-            self.__calculate_paths_pressure(next_path)
+            paths_by_material.setdefault(path.material_id, []).append(path)
+
+        for (material_id, paths) in paths_by_material.items():
+            diameters = self.catalog.get_material_diameters(material_id)
+            if not diameters:
+                continue
+            sizes = np.array([diameter.internal_diameter for diameter in diameters], dtype=float)
+            fittings_lengths = self.get_fittings_lengths(paths, [diameter.id for diameter in diameters])
+            total_lengths = (
+                np.array([path.total_length for path in paths])[:, np.newaxis] +
+                fittings_lengths[:, 1:] - fittings_lengths[:, :1]
+            )
+            flows = np.array([path.flow for path in paths], dtype=float)[:, np.newaxis]
+            start_pressures = np.array([path.start_pressure for path in paths], dtype=float)[:, np.newaxis]
+            pressure_drops = get_pressure_drops(
+                flows, total_lengths,
+                np.array([path.length_up for path in paths], dtype=float)[:, np.newaxis],
+                np.array([path.length_down for path in paths], dtype=float)[:, np.newaxis],
+                sizes, self.igcCalc.gas, calc_type,
+            )
+            end_pressures = get_end_pressures(start_pressures, pressure_drops, calc_type)
+            speeds = get_speeds(flows, start_pressures, sizes)
+            pressure_drops_accumulated = (start_pressure - end_pressures) / start_pressure
+
+            for (row, path) in enumerate(paths):
+                path.diameter_alternatives = [
+                    IGCCalcPathAlternative(
+                        diameter_id=diameter.id,
+                        pressure_drop=float(pressure_drops[row, column]),
+                        end_pressure=float(end_pressures[row, column]),
+                        speed=float(speeds[row, column]),
+                        pressure_drop_accumulated=float(pressure_drops_accumulated[row, column]),
+                        fail=bool(pressure_drops_accumulated[row, column] > pressure_drop_limit),
+                    )
+                    for (column, diameter) in enumerate(diameters)
+                ]
+
+    def get_fittings_lengths(self, paths: List[IGCCalcPath], diameters_ids: List[int]) -> np.ndarray:
+        '''
+        by path, equivalent length of the fittings of the path and of the connection to the paths after,
+        with the diameter of the path (first column) and with every diameter of `diameters_ids`
+        '''
+        fittings: List[List[int]] = []
+        for path in paths:
+            fittings_ids = list(path.fittings_ids or [])
+            connection_fitting_id = {
+                1: path.material.one_outlet_connection_id,
+                2: path.material.two_outlet_connection_id,
+                3: path.material.three_outlet_connection_id,
+            }.get(len(self.get_paths_after(path)))
+            if connection_fitting_id:
+                fittings_ids.append(connection_fitting_id)
+            fittings.append(fittings_ids)
 
-    def __calculate_paths_speed(self):
-        for path in self.igcCalc.paths:
-            path.calculate_speed()
+        def get_equivalent_length(diameter_id: int, fitting_id: int) -> float:
+            fitting_diameter = self.catalog.get_fitting_diameter(diameter_id, fitting_id)
+            return float(fitting_diameter.equivalent_length or 0) if fitting_diameter else 0
 
-    def __calculate_paths_pressure_drop_accumulated(self):
-        pressure_drop_limit = 0.3
-        if (self.igcCalc.calc_type == Config.CalcType.SECONDARY):
-            pressure_drop_limit = 0.1
-        for path in self.igcCalc.paths:
-            path.calculate_pressure_drop_accumulated(self.igcCalc.start_pressure, pressure_drop_limit)
-
-    def __sum_paths_fail_level(self, path: IGCCalcPath):
-        paths_after: list[IGCCalcPath] = self.get_paths_after(path)
-        path.fail_level = 1 if path.fail else 0
-        for next_path in paths_after:
-            path.fail_level += self.__sum_paths_fail_level(next_path)
-        if path.fail_level > self.igcCalc.max_fail_level:
-            self.igcCalc.max_fail_level = path.fail_level
-        return path.fail_level
-
-    def __calculate_paths_pressure_drop_color(self):
-        for path in self.igcCalc.paths:
-            path.calculate_paths_pressure_drop_color(self.igcCalc.max_fail_level)
+        return np.array([
+            [
+                sum(get_equivalent_length(diameter_id, fitting_id) for fitting_id in fittings_ids)
+                for diameter_id in [path.diameter_id] + list(diameters_ids)
+            ]
+            for (path, fittings_ids) in zip(paths, fittings)
+        ], dtype=float).reshape(len(paths), len(diameters_ids) + 1)
 
     def get_path_before(self, actual_path: IGCCalcPath) -> Union[IGCCalcPath, None]:
-        for path in self.igcCalc.paths:
-            if path.end == actual_path.start:
-                return path
-        return None
+        return self.topology.get_path_before(actual_path)
 
     def get_paths_after(self, actual_path: IGCCalcPath, exclude_path: IGCCalcPath = None) -> List[IGCCalcPath]:
-        paths = []
-        if actual_path and actual_path.end:
-            for path in self.igcCalc.paths:
-                if path.start == actual_path.end and path != exclude_path:
-                    paths.append(path)
-        return paths
+        return self.topology.get_paths_after(actual_path, exclude_path)
@@ -1 +1,10 @@
 GRAVITY: float = (9.80665)
+
+# Limits of the network
+MAX_SPEED: float = (20)  # m/s
+
+# Sizing of the diameters of the paths
+SIZING_MAX_CORRECTIONS: int = (3)  # searches again with the limits corrected by the difference of the last calc
+
+# Scenario matrix
+CALC_MATRIX_MAX_SIZE: int = (200)  # combinations of gas, start pressure and calc type
@@ -0,0 +1,167 @@
+from typing import List
+
+import numpy as np
+
+from .dataclasses import IGCCalc, IGCCalcPath
+from .models import GAS, Config
+from .topology import IGCTopology
+from .utils import (get_concurrency_factors, get_end_pressures, get_pressure_drops,
+                    get_speeds, rgb2hex)
+
+
+class IGCNetwork():
+    '''
+    Compiled representation of an IGCCalc, where every path is an index (its
+    position in `igcCalc.paths`), with the parameters and the results of the
+    paths in NumPy arrays.
+
+    Every pass of the calc is vectorized over all the paths. The ones that follow
+    the tree, the sums from the ends of the network and the pressures from the
+    reservoir, go one level of depth at a time, every level in one operation over
+    its paths. The dataclasses only receive the results in `write_back`, before
+    the serialization.
+
+    Only the paths reachable from the reservoir are summed and have pressures.
+    '''
+
+    count: int = None
+    reservoir: int = None
+    order: np.ndarray = None
+    parents: np.ndarray = None
+    levels: List[np.ndarray] = None
+    reachable: np.ndarray = None
+
+    def __init__(self, igcCalc: IGCCalc, order: List[IGCCalcPath], topology: IGCTopology):
+        paths = igcCalc.paths
+        self.igcCalc = igcCalc
+        self.count = len(paths)
+        self.reservoir = topology.position(igcCalc.reservoir_path)
+
+        # topology, the paths of every depth from the reservoir
+        self.order = np.array([topology.position(path) for path in order], dtype=int)
+        self.parents = np.array(
+            [topology.position(parent) if parent is not None else -1 for parent in topology.parents], dtype=int
+        )
+        self.parents[self.reservoir] = -1
+        depths = np.zeros(self.count, dtype=int)
+        parents = self.parents.tolist()
+        for index in self.order.tolist()[1:]:
+            depths[index] = depths[parents[index]] + 1
+        self.reachable = np.zeros(self.count, dtype=bool)
+        self.reachable[self.order] = True
+        self.levels = [
+            self.order[depths[self.order] == depth] for depth in range(int(depths[self.order].max()) + 1)
+        ]
+
+        # paths
+        self.power_rating_added = np.array([path.power_rating_added for path in paths], dtype=float)
+        self.length_up = np.array([path.length_up for path in paths], dtype=float)
+        self.length_down = np.array([path.length_down for path in paths], dtype=float)
+        self.total_length = np.array([path.total_length for path in paths], dtype=float)
+        self.diameters = np.array([path.diameter.internal_diameter for path in paths], dtype=float)
+
+        # solution
+        self.power_rating_accumulated = np.zeros(self.count)
+        self.power_rating_adopted = np.zeros(self.count)
+        self.concurrency_factor = np.zeros(self.count)
+        self.flow = np.zeros(self.count)
+        self.pressure_drop = np.zeros(self.count)
+        self.start_pressure = np.zeros(self.count)
+        self.end_pressure = np.zeros(self.count)
+        self.speed = np.zeros(self.count)
+        self.pressure_drop_accumulated = np.zeros(self.count)
+        self.fail = np.zeros(self.count, dtype=bool)
+        self.fail_level = np.zeros(self.count, dtype=int)
+        self.max_fail_level = 0
+
+    def __sum_from_ends(self, values: np.ndarray) -> np.ndarray:
+        '''
+        sum of `values` of every reachable path and of the paths after it, from the deepest level
+        '''
+        values = np.where(self.reachable, values, 0)
+        for level in reversed(self.levels[1:]):
+            np.add.at(values, self.parents[level], values[level])
+        return values
+
+    def sum_power_ratings(self):
+        self.power_rating_accumulated = self.__sum_from_ends(self.power_rating_added)
+
+    def calculate_power_ratings_adopted(self, calc_type: str):
+        if calc_type == Config.CalcType.SECONDARY:
+            self.concurrency_factor = np.ones(self.count)
+        else:
+            self.concurrency_factor = get_concurrency_factors(self.power_rating_accumulated)
+        self.power_rating_adopted = self.power_rating_accumulated * self.concurrency_factor
+
+    def calculate_flows(self, gas: GAS):
+        # the power ratings in kcal/h
+        self.flow = self.power_rating_adopted * 60 / gas.pci
+
+    def calculate_pressure_drops(self, gas: GAS, calc_type: str):
+        self.pressure_drop = get_pressure_drops(
+            self.flow, self.total_length, self.length_up, self.length_down, self.diameters, gas, calc_type
+        )
+
+    def calculate_pressures(self, start_pressure: float, calc_type: str):
+        '''
+        pressures of every path reachable from the reservoir, one level at a time
+        '''
+        self.start_pressure = np.zeros(self.count)
+        self.end_pressure = np.zeros(self.count)
+        self.start_pressure[self.reservoir] = start_pressure
+        for (depth, level) in enumerate(self.levels):
+            if depth:
+                self.start_pressure[level] = self.end_pressure[self.parents[level]]
+            self.end_pressure[level] = get_end_pressures(self.start_pressure[level], self.pressure_drop[level],
+                                                         calc_type)
+
+    def calculate_speeds(self):
+        self.speed = get_speeds(self.flow, self.start_pressure, self.diameters)
+
+    def calculate_pressure_drops_accumulated(self, start_pressure: float, pressure_drop_limit: float):
+        self.pressure_drop_accumulated = (start_pressure - self.end_pressure) / start_pressure
+        self.fail = self.pressure_drop_accumulated > pressure_drop_limit
+
+    def sum_fail_levels(self):
+        self.fail_level = self.__sum_from_ends(self.fail.astype(int))
+        self.max_fail_level = max(int(self.fail_level.max()), 0)
+
+    def write_back(self):
+        '''
+        copies the solution to the dataclasses of the calc, with the colors of the pressure drops
+        '''
+        max_fail_level = self.max_fail_level
+        if max_fail_level:
+            greens = np.clip((200 * ((max_fail_level - self.fail_level) / max_fail_level)).astype(int), 0, 200)
+        else:
+            greens = np.zeros(self.count, dtype=int)
+        red = rgb2hex(244, 67, 54)
+        green = rgb2hex(76, 175, 80)
+
+        power_rating_accumulated = self.power_rating_accumulated.tolist()
+        power_rating_adopted = self.power_rating_adopted.tolist()
+        concurrency_factor = self.concurrency_factor.tolist()
+        flow = self.flow.tolist()
+        pressure_drop = self.pressure_drop.tolist()
+        start_pressure = self.start_pressure.tolist()
+        end_pressure = self.end_pressure.tolist()
+        speed = self.speed.tolist()
+        pressure_drop_accumulated = self.pressure_drop_accumulated.tolist()
+        fail = self.fail.tolist()
+        fail_level = self.fail_level.tolist()
+        greens = greens.tolist()
+        for index, path in enumerate(self.igcCalc.paths):
+            path.power_rating_accumulated = power_rating_accumulated[index]
+            path.power_rating_adopted = power_rating_adopted[index]
+            path.concurrency_factor = concurrency_factor[index]
+            path.flow = flow[index]
+            path.pressure_drop = pressure_drop[index]
+            path.start_pressure = start_pressure[index]
+            path.end_pressure = end_pressure[index]
+            path.speed = speed[index]
+            path.pressure_drop_accumulated = pressure_drop_accumulated[index]
+            path.fail = fail[index]
+            path.pressure_drop_accumulated_color = red if fail[index] else green
+            path.fail_level = fail_level[index]
+            path.pressure_drop_color = rgb2hex(255, greens[index], 0) if fail_level[index] > 0 else None
+        self.igcCalc.max_fail_level = self.max_fail_level
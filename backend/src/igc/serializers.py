@@ -139,6 +139,16 @@ class MaterialFileSerializer(serializers.Serializer):
     fittingdiameters = FittingDiameterResponseSerializer()
 
 
+@ts_interface('igc')
+class IGCCalcPathAlternativeSerializer(serializers.Serializer):
+    diameter_id = serializers.IntegerField(required=True)
+    pressure_drop = serializers.FloatField(default=0, **custom_not_required)
+    end_pressure = serializers.FloatField(default=0, **custom_not_required)
+    speed = serializers.FloatField(default=0, **custom_not_required)
+    pressure_drop_accumulated = serializers.FloatField(default=0, **custom_not_required)
+    fail = serializers.BooleanField(default=False, **custom_not_required)
+
+
 @ts_interface('igc')
 class IGCCalcPathSerializer(serializers.Serializer):
     start = serializers.CharField(required=True)
@@ -167,6 +177,17 @@ class IGCCalcPathSerializer(serializers.Serializer):
     pressure_drop_accumulated_color = serializers.CharField(default=None, **custom_not_required)
     fail = serializers.BooleanField(default=False, **custom_not_required)
     fail_level = serializers.IntegerField(default=0, **custom_not_required)
+    diameter_alternatives = IGCCalcPathAlternativeSerializer(many=True, **custom_not_required)
+
+
+@ts_interface('igc')
+class IGCCalcSizingSerializer(serializers.Serializer):
+
+    material_id = serializers.IntegerField(required=True)
+    diameters_ids = serializers.ListField(child=serializers.IntegerField(), default=[], **custom_not_required)
+    pressure_drop_margin = serializers.FloatField(**custom_not_required)
+    speed_margin = serializers.FloatField(**custom_not_required)
+    evaluations = serializers.IntegerField(**custom_not_required)
 
 
 @ts_interface('igc')
@@ -181,10 +202,39 @@ class IGCCalcSerializer(serializers.Serializer):
     gas_id = serializers.IntegerField(required=True)
     signatory_id = serializers.IntegerField(**custom_not_required)
     start_pressure = serializers.FloatField(required=True)
+    diameter_alternatives = serializers.BooleanField(default=False, **custom_not_required)
+    sizing = IGCCalcSizingSerializer(**custom_not_required)
     paths = IGCCalcPathSerializer(required=True, many=True)
     error = serializers.CharField(default=None, **custom_not_required_blank)
     calculated_at = serializers.DateTimeField(**custom_not_required)
     max_fail_level = serializers.IntegerField(default=0, **custom_not_required)
 
 
+@ts_interface('igc')
+class IGCCalcMatrixSerializer(serializers.Serializer):
+
+    calc = IGCCalcSerializer(required=True)
+    gas_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+    start_pressures = serializers.ListField(child=serializers.FloatField(), allow_empty=False)
+    calc_types = serializers.ListField(child=serializers.ChoiceField(choices=Config.CalcType), allow_empty=False)
+
+    def validate_start_pressures(self, data):
+        if any(start_pressure <= 0 for start_pressure in data):
+            raise serializers.ValidationError('As pressões iniciais devem ser maiores que zero')
+        return data
+
+
+@ts_interface('igc')
+class IGCCalcMatrixResultSerializer(serializers.Serializer):
+
+    gas_id = serializers.IntegerField()
+    start_pressure = serializers.FloatField()
+    calc_type = serializers.CharField()
+    pressure_drop_margin = serializers.FloatField()
+    speed_margin = serializers.FloatField()
+    min_end_pressure = serializers.FloatField()
+    max_fail_level = serializers.IntegerField()
+    accepted = serializers.BooleanField()
+
+
 # generate_ts('./igcTypes.ts', 'igc')
@@ -0,0 +1,283 @@
+import copy
+import logging
+from typing import List, Tuple, Union
+
+import numpy as np
+
+from .calculate import IGC
+from .catalog import CatalogSnapshot
+from .constants import MAX_SPEED, SIZING_MAX_CORRECTIONS
+from .dataclasses import IGCCalcPath, IGCCalcSizing
+from .exceptions import CouldNotFinishCalculate, NoInitialDataError
+from .models import GAS, Config, Diameter
+from .serializers import IGCCalcSerializer
+from .utils import get_end_pressures, get_pressure_drop_limit, get_pressure_drops, get_speeds
+
+logger = logging.getLogger(__name__)
+
+
+class DiameterSizing():
+    '''
+    Smallest diameters, from the diameters of the `sizing` material, for the paths
+    of that material, with no path over the accumulated pressure drop allowed for
+    the calc type or over MAX_SPEED. Between two assignments that fit, the one with
+    the lowest cost, the length of the paths by their internal diameter, is kept.
+
+    The flows of IGC don't depend on the diameters, so the pressure drop of every
+    sized path with every diameter is computed once. The drops add up along the
+    route from the reservoir (the squares of the pressures in the primary calc),
+    and every candidate is checked in bulk against the accumulated drops of all
+    the paths after it.
+
+    Every path starts with the largest diameter and goes down one diameter at a
+    time, the ones that save the most cost for the drop they add first. A path
+    that goes over the limits stays with its diameter, the drops after it only grow.
+
+    The fittings and the connections to the paths after follow the diameter of the
+    path. The reductions and the connections to the path before are the ones of the
+    diameters sent, the calc of the assignment has the right ones, and the search
+    runs again with the limit of every route corrected by the difference between
+    the calc and its sum of the drops. The cheapest assignment inside the limits in
+    the calc is kept, with the largest diameters as the last try.
+    '''
+
+    data: dict = None
+    sizing: IGCCalcSizing = None
+    gas: GAS = None
+    catalog: CatalogSnapshot = None
+    calc_type: str = None
+    start_pressure: float = None
+    diameters: List[Diameter] = None
+    evaluations: int = None
+
+    # paths of the network in pre-order, with the index of the path before (-1 for the reservoir)
+    order: List[IGCCalcPath] = None
+    parents: np.ndarray = None
+    # 1 for the paths (rows) on the route from the reservoir to every path (columns), the path included
+    routes: np.ndarray = None
+    flows: np.ndarray = None
+    drops: np.ndarray = None
+    sizes: np.ndarray = None
+    # indexes of the sized paths, their positions in the calc, the sizes of the diameters of the sizing
+    # and by sized path (rows) and diameter (columns) their drop and cost
+    rows: np.ndarray = None
+    positions: List[int] = None
+    row_sizes: np.ndarray = None
+    row_drops: np.ndarray = None
+    row_costs: np.ndarray = None
+
+    def __init__(self, data):
+        if not data:
+            raise NoInitialDataError()
+        self.data = copy.deepcopy(data)
+
+    def calculate(self) -> IGCCalcSerializer:
+        igc = IGC(copy.deepcopy(self.data))
+        self.sizing = igc.igcCalc.sizing
+        self.calc_type = igc.igcCalc.calc_type
+        self.start_pressure = float(igc.igcCalc.start_pressure)
+        if self.start_pressure <= 0:
+            message = 'Informe a pressão inicial para o dimensionamento dos diâmetros.'
+            logger.error(message)
+            raise CouldNotFinishCalculate(message)
+
+        self.order = igc.get_flows()
+        self.gas = igc.igcCalc.gas
+        self.catalog = igc.catalog
+        self.diameters = [
+            diameter for diameter in self.catalog.get_material_diameters(self.sizing.material_id)
+            if not self.sizing.diameters_ids or diameter.id in self.sizing.diameters_ids
+        ]
+        if not self.diameters:
+            message = 'Nenhum diâmetro do material escolhido para o dimensionamento.'
+            logger.error(message)
+            raise CouldNotFinishCalculate(message)
+        self.__prepare(igc)
+        if not len(self.rows):
+            message = 'Nenhum trecho do material escolhido para o dimensionamento.'
+            logger.error(message)
+            raise CouldNotFinishCalculate(message)
+        self.evaluations = 0
+
+        pressure_drop_limit = get_pressure_drop_limit(self.calc_type)
+        limit = self.__get_drop(pressure_drop_limit)
+        budget = np.full(len(self.order), limit)
+        speed_limit = MAX_SPEED
+        largest = np.full(len(self.rows), len(self.diameters) - 1)
+        calculated = set()
+        sized: IGC = None
+        sized_cost: float = None
+        for _ in range(SIZING_MAX_CORRECTIONS + 1):
+            choice = self.__search(budget, speed_limit)
+            if tuple(choice.tolist()) in calculated:
+                break
+            calculated.add(tuple(choice.tolist()))
+            (igc, accumulated, speed) = self.__calculate(choice)
+            if accumulated.max() <= pressure_drop_limit and speed <= MAX_SPEED:
+                cost = float(self.row_costs[np.arange(len(choice)), choice].sum())
+                if sized is None or cost < sized_cost:
+                    (sized, sized_cost) = (igc, cost)
+            elif sized is not None:
+                break
+            # the difference between the calc and the drops of the search, by route, are the
+            # reductions and the connections to the paths before
+            budget = limit - (self.__get_drop(accumulated) - self.__get_accumulated(choice))
+            if speed > MAX_SPEED:
+                speed_limit *= MAX_SPEED / speed
+
+        if sized is None and tuple(largest.tolist()) not in calculated:
+            # the corrections ran out, the largest diameters are the last try
+            (igc, accumulated, speed) = self.__calculate(largest)
+            if accumulated.max() <= pressure_drop_limit and speed <= MAX_SPEED:
+                sized = igc
+        if sized is None:
+            message = 'Nem com o maior diâmetro em todos os trechos a rede fica dentro dos limites.'
+            logger.error(message)
+            raise CouldNotFinishCalculate(message)
+
+        network = sized.network
+        sized.igcCalc.sizing.pressure_drop_margin = (
+            pressure_drop_limit - float(network.pressure_drop_accumulated[network.order].max())
+        )
+        sized.igcCalc.sizing.speed_margin = MAX_SPEED - float(network.speed.max())
+        sized.igcCalc.sizing.evaluations = self.evaluations
+        return sized.get_serializer()
+
+    def get_data(self, choice: np.ndarray) -> dict:
+        '''
+        input of the calc with the diameters of `choice` in the sized paths
+        '''
+        data = copy.deepcopy(self.data)
+        for (position, column) in zip(self.positions, choice.tolist()):
+            data['paths'][position]['diameter_id'] = self.diameters[column].id
+        return data
+
+    def __prepare(self, igc: IGC):
+        '''
+        the routes of the network and the drops of the sized paths with every diameter
+        '''
+        order = self.order
+        count = len(order)
+        indexes = {id(path): index for (index, path) in enumerate(order)}
+        self.parents = np.full(count, -1, dtype=int)
+        self.routes = np.zeros((count, count), dtype=bool)
+        for (index, path) in enumerate(order):
+            path_before = igc.get_path_before(path)
+            if path_before is not None and id(path_before) in indexes:
+                self.parents[index] = parent = indexes[id(path_before)]
+                self.routes[:, index] = self.routes[:, parent]
+            self.routes[index, index] = True
+
+        self.flows = np.array([path.flow for path in order], dtype=float)
+        self.sizes = np.array([path.diameter.internal_diameter for path in order], dtype=float)
+        lengths_up = np.array([path.length_up for path in order], dtype=float)
+        lengths_down = np.array([path.length_down for path in order], dtype=float)
+        total_lengths = np.array([path.total_length for path in order], dtype=float)
+        self.drops = get_pressure_drops(
+            self.flows, total_lengths, lengths_up, lengths_down, self.sizes, self.gas, self.calc_type
+        )
+
+        self.rows = rows = np.array(
+            [index for (index, path) in enumerate(order) if path.material_id == self.sizing.material_id], dtype=int
+        )
+        self.positions = [igc.topology.position(order[row]) for row in rows.tolist()]
+        self.row_sizes = sizes = np.array([diameter.internal_diameter for diameter in self.diameters], dtype=float)
+        fittings_lengths = igc.get_fittings_lengths(
+            [order[row] for row in rows.tolist()], [diameter.id for diameter in self.diameters]
+        )
+        row_total_lengths = total_lengths[rows][:, np.newaxis] + fittings_lengths[:, 1:] - fittings_lengths[:, :1]
+        self.row_drops = get_pressure_drops(
+            self.flows[rows][:, np.newaxis], row_total_lengths, lengths_up[rows][:, np.newaxis],
+            lengths_down[rows][:, np.newaxis], sizes, self.gas, self.calc_type,
+        )
+        lengths = np.array([
+            order[row].length + order[row].length_up + order[row].length_down for row in rows.tolist()
+        ])
+        self.row_costs = lengths[:, np.newaxis] * sizes
+
+    def __calculate(self, choice: np.ndarray) -> Tuple[IGC, np.ndarray, float]:
+        '''
+        calc with the diameters of `choice`, with the accumulated pressure drop of the paths in `order`
+        and the highest speed
+        '''
+        igc = IGC(self.get_data(choice), self.catalog)
+        igc.solve()
+        accumulated = igc.network.pressure_drop_accumulated[igc.network.order]
+        speed = float(igc.network.speed.max())
+        logger.info(f'Sized {len(self.rows)} paths: pressure drop {accumulated.max()}, speed {speed} m/s')
+        return (igc, accumulated, speed)
+
+    def __get_accumulated(self, choice: np.ndarray) -> np.ndarray:
+        '''
+        sum of the drops along the route to every path, with the diameters of `choice` in the sized paths
+        '''
+        drops = self.drops.copy()
+        drops[self.rows] = self.row_drops[np.arange(len(choice)), choice]
+        return drops @ self.routes
+
+    def __get_drop(self, pressure_drop_accumulated: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        '''
+        sum of the drops along a route for `pressure_drop_accumulated` of the start pressure
+        '''
+        end_pressure = self.start_pressure * (1 - pressure_drop_accumulated)
+        if self.calc_type == Config.CalcType.SECONDARY:
+            return self.start_pressure - end_pressure
+        return self.start_pressure ** 2 - end_pressure ** 2
+
+    def __get_speeds(self, accumulated: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+        '''
+        speeds of every path, with the accumulated drops at the end of every path in the last axis
+        '''
+        starts = np.concatenate([accumulated, np.zeros(accumulated.shape[:-1] + (1,))], axis=-1)[..., self.parents]
+        return get_speeds(self.flows, get_end_pressures(self.start_pressure, starts, self.calc_type), sizes)
+
+    def __search(self, budget: np.ndarray, speed_limit: float) -> np.ndarray:
+        '''
+        diameters of the sized paths inside the limits, from the largest ones,
+        with the limit of the sum of the drops along the route to every path in `budget`
+        '''
+        rows = self.rows
+        choice = np.full(len(rows), len(self.diameters) - 1)
+        sizes = self.sizes.copy()
+        sizes[rows] = self.row_sizes[-1]
+        accumulated = self.__get_accumulated(choice)
+        if (accumulated > budget).any() or self.__get_speeds(accumulated, sizes).max() > speed_limit:
+            # the calc decides if the largest diameters are inside the limits
+            return choice
+
+        blocked = np.zeros(len(rows), dtype=bool)
+        while True:
+            candidates = np.flatnonzero((choice > 0) & ~blocked)
+            if not len(candidates):
+                return choice
+            smaller = choice[candidates] - 1
+            added = self.row_drops[candidates, smaller] - self.row_drops[candidates, choice[candidates]]
+            savings = self.row_costs[candidates, choice[candidates]] - self.row_costs[candidates, smaller]
+
+            # every candidate alone, in bulk, the ones over the limits stay blocked
+            trial_accumulated = accumulated + added[:, np.newaxis] * self.routes[rows[candidates]]
+            trial_sizes = np.tile(sizes, (len(candidates), 1))
+            trial_sizes[np.arange(len(candidates)), rows[candidates]] = self.row_sizes[smaller]
+            fit = (
+                (trial_accumulated <= budget).all(axis=1) &
+                (self.__get_speeds(trial_accumulated, trial_sizes).max(axis=1) <= speed_limit)
+            )
+            self.evaluations += len(candidates)
+            blocked[candidates[~fit]] = True
+            if not fit.any():
+                return choice
+
+            # the ones that fit, together, in the order of their ratio
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ratios = np.where(added > 0, savings / added, np.inf)
+            for candidate in np.flatnonzero(fit)[np.argsort(-ratios[fit], kind='stable')].tolist():
+                row = rows[candidates[candidate]]
+                trial_accumulated = accumulated + added[candidate] * self.routes[row]
+                trial_sizes = sizes.copy()
+                trial_sizes[row] = self.row_sizes[smaller[candidate]]
+                self.evaluations += 1
+                if ((trial_accumulated > budget).any() or
+                        self.__get_speeds(trial_accumulated, trial_sizes).max() > speed_limit):
+                    continue
+                (accumulated, sizes) = (trial_accumulated, trial_sizes)
+                choice[candidates[candidate]] -= 1
@@ -0,0 +1,152 @@
+import copy
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from .calculate import IGC
+from .constants import MAX_SPEED
+from .exceptions import CouldNotFinishCalculate
+from .models import GAS, Config, Diameter, Fitting, FittingDiameter, Material, Reduction
+from .sizing import DiameterSizing
+from .utils import get_pressure_drop_limit
+
+
+class IGCCalcTestCase(TestCase):
+    '''
+    catalog of copper and natural gas, and the calc of a building, a riser from
+    the meter with two apartments on every floor
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        # the catalog version is bumped on commit
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.create_catalog()
+
+    @classmethod
+    def create_catalog(cls):
+        cls.gas = GAS.objects.create(name='GN', pci=8600, pck=11900, relative_density=0.6)
+        elbow = Fitting.objects.create(name='Cotovelo')
+        tee = Fitting.objects.create(name='Te')
+        cls.material = Material.objects.create(name='Cobre', one_outlet_connection=elbow, two_outlet_connection=tee)
+        cls.diameters = [
+            Diameter.objects.create(material=cls.material, name=name, internal_diameter=internal_diameter)
+            for (name, internal_diameter) in (('15', 13.4), ('22', 20.2), ('28', 26.2), ('35', 32.6))
+        ]
+        for (diameter, equivalent_length) in zip(cls.diameters, (1.1, 1.2, 1.5, 2.0)):
+            FittingDiameter.objects.create(fitting=elbow, diameter=diameter, equivalent_length=equivalent_length)
+            FittingDiameter.objects.create(fitting=tee, diameter=diameter, equivalent_length=2 * equivalent_length)
+        for (inlet, outlet) in zip(cls.diameters[1:], cls.diameters):
+            Reduction.objects.create(inlet_diameter=inlet, outlet_diameter=outlet,
+                                     name=f'Redução {inlet.name} x {outlet.name}', equivalent_length=6)
+
+    def get_calc(self, floors: int, start_pressure: float, calc_type: str = Config.CalcType.SECONDARY,
+                 power_rating: float = 250, diameter: Diameter = None) -> dict:
+        '''
+        input of a building with `floors` floors above the meter, with two apartments
+        of `power_rating` kcal/min on every floor
+        '''
+        diameter = diameter or self.diameters[-1]
+
+        def get_path(start: str, end: str, length: float, length_up: float = 0, power_rating: float = 0) -> dict:
+            return {
+                'start': start, 'end': end, 'material_id': self.material.id, 'diameter_id': diameter.id,
+                'length': length, 'length_up': length_up, 'power_rating_added': power_rating, 'fittings_ids': [],
+            }
+
+        paths = [get_path('CG', 'R0', 8)]
+        for floor in range(floors):
+            for apartment in ('A', 'B'):
+                paths.append(get_path(f'R{floor}', f'{apartment}{floor}', 7, 0, power_rating))
+            if floor < floors - 1:
+                paths.append(get_path(f'R{floor}', f'R{floor + 1}', 0, 3))
+        return {
+            'fileinfo': {'type': 'igc_calc', 'version': '1.0.0', 'created': '2022-08-21T18:39:21Z',
+                         'updated': '2022-08-29 20:16:10-03:00'},
+            'name': '', 'calc_type': calc_type, 'material_id': self.material.id, 'diameter_id': diameter.id,
+            'gas_id': self.gas.id, 'start_pressure': start_pressure, 'paths': paths,
+        }
+
+
+class IGCTest(IGCCalcTestCase):
+
+    def test_catalog_queries(self):
+        '''
+        the catalog is loaded in bulk, the queries don't grow with the network
+        '''
+        # the reductions are cached by material after the first calc
+        IGC(self.get_calc(1, 2.8)).calculate()
+        counts = []
+        for floors in (2, 8):
+            with CaptureQueriesContext(connection) as queries:
+                IGC(self.get_calc(floors, 2.8, diameter=self.diameters[1])).calculate()
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_cache_key_input_unchanged(self):
+        data = self.get_calc(2, 2.8)
+        data['paths'][0]['length_down'] = None
+        sent = copy.deepcopy(data)
+        IGC.get_cache_key(data)
+        self.assertEqual(data, sent)
+
+    def test_matrix(self):
+        data = self.get_calc(3, 2.8, diameter=self.diameters[1])
+        start_pressures = [1.5, 2.8, 35]
+        calc_types = [Config.CalcType.SECONDARY, Config.CalcType.PRIMARY]
+        results = IGC(data).calculate_matrix([self.gas.id], start_pressures, calc_types)
+        self.assertEqual(len(results), len(start_pressures) * len(calc_types))
+        for result in results:
+            calc = IGC(dict(data, start_pressure=result['start_pressure'], calc_type=result['calc_type']))
+            calc.solve()
+            network = calc.network
+            pressure_drop_margin = (
+                get_pressure_drop_limit(result['calc_type']) - float(network.pressure_drop_accumulated.max())
+            )
+            self.assertAlmostEqual(result['pressure_drop_margin'], pressure_drop_margin)
+            self.assertEqual(result['accepted'], pressure_drop_margin > 0 and result['speed_margin'] > 0)
+
+
+class DiameterSizingTest(IGCCalcTestCase):
+
+    def assertInsideLimits(self, data: dict, serializer):
+        self.assertTrue(serializer.is_valid())
+        sized = IGC(serializer.data)
+        sized.solve()
+        network = sized.network
+        pressure_drop_limit = get_pressure_drop_limit(data['calc_type'])
+        accumulated = float(network.pressure_drop_accumulated[network.order].max())
+        self.assertLessEqual(accumulated, pressure_drop_limit)
+        self.assertLessEqual(float(network.speed.max()), MAX_SPEED)
+        self.assertAlmostEqual(serializer.data['sizing']['pressure_drop_margin'], pressure_drop_limit - accumulated)
+        self.assertGreater(serializer.data['sizing']['evaluations'], 0)
+
+    def test_limits(self):
+        cases = (
+            (Config.CalcType.SECONDARY, 3, 2.8, 250),
+            (Config.CalcType.SECONDARY, 6, 2.8, 150),
+            (Config.CalcType.PRIMARY, 6, 35, 250),
+        )
+        for (calc_type, floors, start_pressure, power_rating) in cases:
+            with self.subTest(calc_type=calc_type, floors=floors, start_pressure=start_pressure):
+                data = self.get_calc(floors, start_pressure, calc_type, power_rating)
+                data['sizing'] = {'material_id': self.material.id}
+                self.assertInsideLimits(data, DiameterSizing(data).calculate())
+
+    def test_largest_diameters(self):
+        '''
+        the search leaves out the reductions, the sizing has a result whenever the largest
+        diameters are inside the limits, even close to them
+        '''
+        for power_rating in (400, 550):
+            with self.subTest(power_rating=power_rating):
+                data = self.get_calc(3, 2.8, power_rating=power_rating)
+                data['sizing'] = {'material_id': self.material.id}
+                self.assertInsideLimits(data, DiameterSizing(data).calculate())
+
+    def test_over_limits(self):
+        data = self.get_calc(6, 2.8)
+        data['sizing'] = {'material_id': self.material.id}
+        with self.assertRaises(CouldNotFinishCalculate):
+            DiameterSizing(data).calculate()
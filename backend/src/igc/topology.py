@@ -0,0 +1,70 @@
+from typing import Dict, List, Union
+
+from .dataclasses import IGCCalcPath
+
+
+class IGCTopology():
+    '''
+    Index of the network, built once per calculation.
+
+    Maps every node to the paths that start and end on it, and keeps the list of
+    paths after (children) and the path before (parent) of every path, so the
+    traversals don't need to scan all the paths of the calc on every step.
+    '''
+
+    paths: List[IGCCalcPath] = None
+    paths_by_start: Dict[str, List[IGCCalcPath]] = None
+    paths_by_end: Dict[str, List[IGCCalcPath]] = None
+    children: List[List[IGCCalcPath]] = None
+    parents: List[Union[IGCCalcPath, None]] = None
+
+    def __init__(self, paths: List[IGCCalcPath]):
+        self.paths = paths
+        self.__positions: Dict[int, int] = {}
+        self.paths_by_start = {}
+        self.paths_by_end = {}
+        for position, path in enumerate(paths):
+            self.__positions[id(path)] = position
+            self.paths_by_start.setdefault(path.start, []).append(path)
+            if path.end:
+                self.paths_by_end.setdefault(path.end, []).append(path)
+
+        self.children = []
+        self.parents = []
+        for path in paths:
+            self.children.append(self.paths_by_start.get(path.end, []) if path.end else [])
+            paths_before = self.paths_by_end.get(path.start)
+            self.parents.append(paths_before[0] if paths_before else None)
+
+    def position(self, path: IGCCalcPath) -> int:
+        return self.__positions[id(path)]
+
+    def get_path_before(self, actual_path: IGCCalcPath) -> Union[IGCCalcPath, None]:
+        return self.parents[self.position(actual_path)]
+
+    def get_paths_after(self, actual_path: IGCCalcPath, exclude_path: IGCCalcPath = None) -> List[IGCCalcPath]:
+        if not actual_path:
+            return []
+        paths = self.children[self.position(actual_path)]
+        if exclude_path is None:
+            return paths
+        return [path for path in paths if path is not exclude_path]
+
+    def get_order(self, root: IGCCalcPath) -> List[IGCCalcPath]:
+        '''
+        paths of the branch that starts in `root` in pre-order, every path before the paths after it.
+
+        The passes that propagate from the reservoir follow this order, the ones that
+        accumulate from the ends of the network follow it reversed (post-order).
+        '''
+        order = []
+        visited = {id(root)}
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            order.append(path)
+            for path_after in reversed(self.children[self.position(path)]):
+                if id(path_after) not in visited:
+                    visited.add(id(path_after))
+                    stack.append(path_after)
+        return order
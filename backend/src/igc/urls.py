@@ -1,9 +1,9 @@
 from django.urls import path
 from rest_framework import routers
 
-from .views import (Calculate, CilinderViewSet, ConfigViewSet, DiameterViewSet,
-                    FittingDiameterViewSet, FittingViewSet, GASViewSet,
-                    LoadMaterialBackup, MaterialConnectionViewSet,
+from .views import (Calculate, CalculateMatrix, CilinderViewSet, ConfigViewSet,
+                    DiameterViewSet, FittingDiameterViewSet, FittingViewSet,
+                    GASViewSet, LoadMaterialBackup, MaterialConnectionViewSet,
                     MaterialViewSet, MeterViewSet, ReductionViewSet, test)
 
 app_name = 'igc'
@@ -23,6 +23,7 @@ router.register(r'meters', MeterViewSet, 'meters')
 urlpatterns = [
     path(r'loadmaterialbackup/', LoadMaterialBackup.as_view(), name='loadmaterialbackup'),
     path(r'calculate/', Calculate.as_view(), name='calculate'),
+    path(r'calculate/matrix/', CalculateMatrix.as_view(), name='calculate-matrix'),
     # path(r'test/', test, name='test'),
 ]
 
@@ -1,7 +1,10 @@
 import math
 from typing import Union
 
-from .models import Config, Diameter, Reduction
+import numpy as np
+
+from .constants import MAX_SPEED
+from .models import GAS, Config
 
 
 def format_decimal(number: Union[int, float], decimals=2):
@@ -10,47 +13,6 @@ def format_decimal(number: Union[int, float], decimals=2):
     return '0,00'
 
 
-def get_reduction_path(inlet_diameter: Diameter, final_diameter_id: int, reduce: bool) -> list[list[Reduction]]:
-    reduction_paths = []
-    queryset = inlet_diameter.inlet_reductions
-    if reduce:
-        queryset = queryset.filter(outlet_diameter__internal_diameter__lt=inlet_diameter.internal_diameter)
-    else:
-        queryset = queryset.filter(outlet_diameter__internal_diameter__gt=inlet_diameter.internal_diameter)
-    for reduction in queryset.all():
-        if reduction.outlet_diameter_id == final_diameter_id:
-            reduction_paths.append([reduction])
-        else:
-            reduction_paths = get_reduction_path(reduction.outlet_diameter, final_diameter_id, reduce)
-            for reduction_path in reduction_paths:
-                if len(reduction_path):
-                    reduction_path.append(reduction)
-    return reduction_paths
-
-
-def get_best_reduction(inlet_diameter_id: int, outlet_diameter_id: int) -> list[Reduction]:
-    reduction: Reduction = (
-        Reduction.objects.filter(
-            inlet_diameter=inlet_diameter_id,
-            outlet_diameter=outlet_diameter_id
-        )
-        .first())
-    if reduction:
-        return [reduction]
-    inlet_diameter: Diameter = Diameter.objects.get(id=inlet_diameter_id)
-    outlet_diameter: Diameter = Diameter.objects.get(id=outlet_diameter_id)
-    reduce = True
-    if inlet_diameter.internal_diameter < outlet_diameter.internal_diameter:
-        reduce = False
-    reduction_paths = get_reduction_path(inlet_diameter, outlet_diameter_id, reduce)
-    reductions = []
-    for reduction_path in reduction_paths:
-        if len(reductions) == 0 or len(reduction_path) < len(reductions):
-            reductions = reduction_path
-    reductions.reverse()
-    return reductions
-
-
 def kcal_p_min_to_kcal_p_h(power_rating: float):
     if power_rating:
         return power_rating * 60
@@ -73,6 +35,94 @@ def calculate_concurrency_factor(power_rating: float):
     return 0.23
 
 
+def get_pressure_drop_limit(calc_type: str) -> float:
+    '''
+    largest accumulated pressure drop allowed, as a fraction of the start pressure
+    '''
+    if calc_type == Config.CalcType.SECONDARY:
+        return 0.1
+    return 0.3
+
+
+def get_pressure_drops(flows: np.ndarray,
+                       total_lengths: np.ndarray,
+                       lengths_up: np.ndarray,
+                       lengths_down: np.ndarray,
+                       diameters: np.ndarray,
+                       gas: GAS,
+                       calc_type: str) -> np.ndarray:
+    '''
+    pressure drops of the paths, in kPa for the secondary calc and kPa² for the primary
+    args={
+        flows: flows in m³/h
+        total_lengths, lengths_up, lengths_down: lengths in m
+        diameters: internal diameters in mm
+    }
+    '''
+    relative_density = float(gas.relative_density)
+    flows = np.asarray(flows, dtype=float)
+    total_lengths = np.asarray(total_lengths, dtype=float)
+    diameters = np.asarray(diameters, dtype=float)
+    if calc_type == Config.CalcType.SECONDARY:
+        if 'GN' in gas.name:
+            drops = (np.power(flows, 1.8) * math.pow(relative_density, 0.8) * total_lengths) / \
+                (0.00049284 * np.power(diameters, 4.8))
+        else:
+            drops = (2273 * relative_density * total_lengths * np.power(flows, 1.82)) / np.power(diameters, 4.82)
+    else:
+        drops = (467000 * relative_density * total_lengths * np.power(flows, 1.82)) / np.power(diameters, 4.82)
+    drops_up = 0.01318 * np.asarray(lengths_up, dtype=float) * (relative_density - 1)
+    drops_down = 0.01318 * np.asarray(lengths_down, dtype=float) * (relative_density - 1)
+    return drops - drops_up + drops_down
+
+
+def get_end_pressures(start_pressures: np.ndarray, pressure_drops: np.ndarray, calc_type: str) -> np.ndarray:
+    '''
+    end pressures of the paths, returns pressures in kPa
+    args={
+        start_pressures: pressures in kPa
+        pressure_drops: drops in kPa for the secondary calc and kPa² for the primary
+    }
+    '''
+    start_pressures = np.asarray(start_pressures, dtype=float)
+    if calc_type == Config.CalcType.SECONDARY:
+        return np.maximum(start_pressures - pressure_drops, 0)
+    return np.sqrt(np.maximum(np.power(start_pressures, 2) - pressure_drops, 0))
+
+
+def get_speeds(flows: np.ndarray, start_pressures: np.ndarray, diameters: np.ndarray) -> np.ndarray:
+    '''
+    speeds of the gas at the start of the paths, returns speeds in m/s
+    args={
+        flows: flows in m³/h
+        start_pressures: pressures in kPa
+        diameters: internal diameters in mm
+    }
+    '''
+    return 354 * np.asarray(flows, dtype=float) / (kpa_to_kgf_p_cm2(np.asarray(start_pressures, dtype=float)) + 1.033) \
+        / np.power(np.asarray(diameters, dtype=float), 2)
+
+
+def get_concurrency_factors(power_ratings: np.ndarray) -> np.ndarray:
+    '''
+    vectorized `calculate_concurrency_factor`
+    args={
+        power_ratings: power ratings in kcal/min
+    }
+    '''
+    power_ratings = np.asarray(power_ratings, dtype=float) * 60
+    with np.errstate(invalid='ignore'):
+        return np.select(
+            [power_ratings < 21000, power_ratings < 576720, power_ratings < 1200000],
+            [
+                1,
+                1 / (1 + 0.001 * np.power((power_ratings / 60) - 349, 0.8712)),
+                1 / (1 + 0.4705 * np.power((power_ratings / 60) - 1055, 0.19931)),
+            ],
+            0.23,
+        )
+
+
 def rgb2hex(r, g, b):
     return '#{:02x}{:02x}{:02x}'.format(r, g, b)
 
@@ -93,7 +143,7 @@ def get_result(data):
     allowed_pressure_drop = start_pressure * allowed_percentagem / 100
     calculated_pressure_drop = start_pressure - calculated_end_pressure
     allowed_end_pressure = start_pressure - allowed_pressure_drop
-    allowed_speed = 20
+    allowed_speed = MAX_SPEED
 
     return {
         'pressure_drop': {
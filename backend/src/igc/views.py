@@ -10,10 +10,12 @@ from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from weasyprint import CSS, HTML
 
+from core.cache import get_cached_result, set_cached_result
 from core.models import Signatory
 
 from .utils import get_result
 from .calculate import IGC
+from .constants import CALC_MATRIX_MAX_SIZE
 from .models import (Cilinder, Config, Diameter, Fitting, FittingDiameter, GAS,
                      Material, MaterialConnection, Meter, Reduction)
 from .serializers import (CilinderSerializer, ConfigSerializer, DiameterSerializer,
@@ -21,7 +23,9 @@ from .serializers import (CilinderSerializer, ConfigSerializer, DiameterSerializ
                           FittingDiameterSerializer, FittingSerializer,
                           GASSerializer, MaterialConnectionSerializer,
                           MaterialFileSerializer, MaterialSerializer, MeterSerializer,
-                          ReductionSerializer, IGCCalcSerializer)
+                          ReductionSerializer, IGCCalcSerializer,
+                          IGCCalcMatrixSerializer, IGCCalcMatrixResultSerializer)
+from .sizing import DiameterSizing
 
 logger = logging.getLogger(__name__)
 
@@ -110,19 +114,21 @@ class FittingDiameterViewSet(viewsets.ViewSet):
         if len(errors):
             raise ValidationError(errors)
 
-        for item in fitting_diameter_array:
-            id = item.pop('id', None)
-            instance = None
-            if id:
-                instance = FittingDiameter.objects.filter(id=id).first()
-                if instance:
-                    serializer = FittingDiameterSerializer(instance, data=item, partial=True)
+        # one transaction, the catalog version is bumped once for the whole array
+        with transaction.atomic():
+            for item in fitting_diameter_array:
+                id = item.pop('id', None)
+                instance = None
+                if id:
+                    instance = FittingDiameter.objects.filter(id=id).first()
+                    if instance:
+                        serializer = FittingDiameterSerializer(instance, data=item, partial=True)
+                        serializer.is_valid(raise_exception=True)
+                        serializer.save()
+                else:
+                    serializer = FittingDiameterSerializer(data=item)
                     serializer.is_valid(raise_exception=True)
                     serializer.save()
-            else:
-                serializer = FittingDiameterSerializer(data=item)
-                serializer.is_valid(raise_exception=True)
-                serializer.save()
         serializer = FittingDiameterResponseSerializer(self.get_object_by_material_id(material))
         return Response(serializer.data)
 
@@ -288,16 +294,43 @@ class Calculate(views.APIView):
                     {'detail': 'Problemas ao imprimir o cálculo enviado'},
                     status=status.HTTP_400_BAD_REQUEST)
         else:
-            serializer = IGC(request.data).calculate()
+            cache_key = IGC.get_cache_key(request.data)
+            result = get_cached_result(cache_key, request.data.get('fileinfo'))
+            if result is not None:
+                return Response(result, headers={'X-Calc-Cache': 'HIT', 'X-Calc-Cache-Key': cache_key})
+            if request.data.get('sizing'):
+                serializer = DiameterSizing(request.data).calculate()
+            else:
+                serializer = IGC(request.data).calculate()
             if serializer.is_valid():
                 error = serializer.data.pop('error', None)
                 if error:
                     return Response({'detail': error}, status=status.HTTP_400_BAD_REQUEST)
                 else:
-                    return Response(serializer.data)
+                    set_cached_result(cache_key, serializer.data)
+                    return Response(serializer.data, headers={'X-Calc-Cache': 'MISS', 'X-Calc-Cache-Key': cache_key})
             return Response({'detail': 'Problemas ao calcular os dados enviados'}, status=status.HTTP_400_BAD_REQUEST)
 
 
+class CalculateMatrix(views.APIView):
+
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request, format=None) -> Response:
+        serializer = IGCCalcMatrixSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        gas_ids = serializer.validated_data.get('gas_ids')
+        start_pressures = serializer.validated_data.get('start_pressures')
+        calc_types = serializer.validated_data.get('calc_types')
+        if len(gas_ids) * len(start_pressures) * len(calc_types) > CALC_MATRIX_MAX_SIZE:
+            return Response(
+                {'detail': f'Envie no máximo {CALC_MATRIX_MAX_SIZE} combinações por vez.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        results = IGC(request.data.get('calc')).calculate_matrix(gas_ids, start_pressures, calc_types)
+        return Response(IGCCalcMatrixResultSerializer(results, many=True).data)
+
+
 def test(request):
     from django.shortcuts import render
 
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ShpConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shp'
+
+    def ready(self):
+        from . import signals  # noqa: F401
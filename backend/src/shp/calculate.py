@@ -1,22 +1,32 @@
+import copy
 import logging
+import math
 from dataclasses import asdict
-from typing import List, Tuple, Union
+from typing import Generator, List, Tuple, Union
 
+import numpy as np
 from django.conf import settings
 from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
 
+from core.cache import get_calc_cache_key, get_catalog_version
 from core.models import Signatory
 
-from .dataclasses import SHPCalc, SHPCalcPath
-from .exceptions import (BifurcationBeforePump, CalculeNotImplemented, CouldNotFinishCalculate,
-                         MoreThenOnePump, MoreThenOneReservoir,
-                         NoActiveFixtureFound, NoFixtureError,
-                         NoInitialDataError, NoPumpFound, NoReservoir,
-                         PathNotLeadingToReservoir)
-from .models import (Config, Diameter, Fitting, FittingDiameter, Fixture,
-                     Material, MaterialConnection, Reduction)
+from .dataclasses import SHPCalc, SHPCalcPath, SolverPrecision
+from .exceptions import CalculeNotImplemented, CouldNotFinishCalculate, NoFixtureError, NoInitialDataError
+from .catalog import CatalogSnapshot
+from .constants import WARM_START_FLOW_MARGIN
+from .executor import CalculationExecutor
+from .gradient import GradientSolver
+from .incremental import PreviousCalc
+from .models import Config, FittingDiameter, Fixture, MaterialConnection, Reduction
+from .network import SHPNetwork
 from .serializers import SHPCalcSerializer
-from .utils import format_decimal, get_best_reduction, sortByEndPressure
+from .solvers import brent, newton_steps, safeguarded_newton
+from .topology import SHPTopology
+from .utils import format_decimal, sortByEndPressure
+from .validation import validate_network
 
 logger = logging.getLogger(__name__)
 
@@ -34,8 +44,33 @@ class SHP():
     serializer_class = SHPCalcSerializer
     fixture: Fixture = None
     minimum_flow: float = None
-
-    def __pre_init__(self, data):
+    topology: SHPTopology = None
+    network: SHPNetwork = None
+    paths_with_fixture: List[int] = None
+    catalog: CatalogSnapshot = None
+    precision: SolverPrecision = None
+    previous: PreviousCalc = None
+    previous_flows: np.ndarray = None
+    previous_less_favorable: int = None
+    branch_flows: List[float] = None
+
+    # fields of the input overwritten by the calc, left out of the cache key
+    result_fields = [
+        'error', 'less_favorable_path_fixture_index', 'calculated_at', 'catalog_version', 'accuracy',
+        'evaluated_scenarios', 'previous_cache_key', 'previous_result',
+    ]
+    path_result_fields = [
+        'material', 'diameter', 'fittings', 'connection_names', 'equivalent_length', 'total_length', 'head_lift',
+        'flow', 'speed', 'start_pressure', 'end_pressure', 'pressure_drop', 'unit_pressure_drop',
+    ]
+    fixture_result_fields = [
+        'inlet_material', 'inlet_diameter', 'connection_names', 'total_length', 'flow', 'start_pressure',
+        'middle_pressure', 'end_pressure', 'hose_pressure_drop', 'unit_hose_pressure_drop', 'pressure_drop',
+        'nozzle_pressure_drop', 'unit_pressure_drop',
+    ]
+
+    @staticmethod
+    def __pre_init__(data):
         paths = data.get('paths')
         if data.get('pressure_type') == 'GR':
             data['pump'] = {}
@@ -57,12 +92,52 @@ class SHP():
                 path['end'] = None
         return data
 
-    def __init__(self, data):
+    def __init__(self, data, catalog: CatalogSnapshot = None):
         if not data:
             raise NoInitialDataError()
         serializer = self.serializer_class(data=self.__pre_init__(data))
         serializer.is_valid(raise_exception=True)
         self.shpCalc = SHPCalc(**serializer.data)
+        self.catalog = catalog
+
+    @classmethod
+    def get_cache_key(cls, data: dict) -> str:
+        '''
+        key of the result of `data` in the calc cache, made from the normalized input,
+        without the volatile fields and the results of a previous calc. `data` is left unchanged
+        '''
+        data = cls.__pre_init__(copy.deepcopy(data))
+        calc_type = data.get('calc_type')
+        pressure_type = data.get('pressure_type')
+        data = {field: value for (field, value) in data.items() if field not in cls.result_fields}
+        data['fileinfo'] = {
+            field: value for (field, value) in (data.get('fileinfo') or {}).items() if field in ('type', 'version')
+        }
+        data['solver_type'] = data.get('solver_type') or Config.SolverType.ITERATIVO
+        data['precision'] = data.get('precision') or Config.PrecisionMode.FINAL
+        data['pump'] = {
+            field: value for (field, value) in (data.get('pump') or {}).items()
+            if field not in ('flow', 'NPSHd')
+            and not (field == 'head_lift' and calc_type == Config.CalcType.VAZAO_MINIMA)
+        }
+        if data.get('sizing'):
+            data['sizing'] = {
+                field: value for (field, value) in data['sizing'].items() if field not in ('cost', 'evaluations')
+            }
+        paths = []
+        for path in data.get('paths'):
+            path = {field: value for (field, value) in path.items() if field not in cls.path_result_fields}
+            if (path.get('start') == 'RES' and calc_type == Config.CalcType.VAZAO_MINIMA and
+                    pressure_type == Config.PressureType.GRAVITACIONAL):
+                path.pop('level_difference', None)
+            if path.get('fixture'):
+                path['fixture'] = {
+                    field: value for (field, value) in path['fixture'].items()
+                    if field not in cls.fixture_result_fields
+                }
+            paths.append(path)
+        data['paths'] = paths
+        return get_calc_cache_key('shp', data)
 
     def getValue(self, obj, attr, empty='-'):
         value = getattr(obj, attr)
@@ -93,75 +168,126 @@ class SHP():
 
     def __calculate_minimum_height(self):
         logger.debug('Calculating minimum height')
-        self.shpCalc.reservoir_path.level_difference = 0
-        self.__calculate_required_pressure(self.fixture.minimum_flow_rate_in_m3_p_s)
-        self.shpCalc.reservoir_path.level_difference = (
-            -(self.shpCalc.reservoir_path.start_pressure / (1 - self.shpCalc.reservoir_path.unit_pressure_drop))
-        )
-        self.shpCalc.reservoir_path.start_pressure = 0
-        self.shpCalc.reservoir_path.total_length = (
-            self.shpCalc.reservoir_path.length +
-            self.shpCalc.reservoir_path.equivalent_length +
-            abs(self.shpCalc.reservoir_path.level_difference)
-        )
+        network = self.network
+        network.set_level_difference(network.reservoir, 0)
+        self.__calculate_minimum_required_pressure()
+        network.set_level_difference(network.reservoir, (
+            -(network.start_pressure[network.reservoir] / (1 - network.unit_pressure_drop[network.reservoir]))
+        ))
+        network.start_pressure[network.reservoir] = 0
+        network.update_reservoir_total_length()
         logger.debug(
-            f'Finished calculate minimum height. level required: {self.shpCalc.reservoir_path.level_difference} m'
+            f'Finished calculate minimum height. level required: {network.level_difference[network.reservoir]} m'
         )
 
     def __calculate_residual_flow(self) -> SHPCalcSerializer:
         logger.debug('Calculating residual flow for gravity system')
 
+        if self.shpCalc.solver_type == Config.SolverType.GRADIENTE:
+            return self.__calculate_residual_flow_by_gradient()
+
+        network = self.network
         path_less_pressure, has_flow = self.__get_path_with_less_pressure_and_flow()
         if not has_flow:
             message = 'Nenhum hidrante com vazão com esta altura de reservatório.'
             logger.error(message)
             raise CouldNotFinishCalculate(message)
 
+        # the bracket starts at zero flow, where the reservoir start pressure was just calculated
         min_flow = 0
+        min_flow_pressure = network.start_pressure[network.reservoir]
         max_flow = self.fixture.minimum_flow_rate_in_m3_p_s
+        if self.previous_flows is not None and self.previous_flows[path_less_pressure] > 0:
+            # the residual flow of the previous calc is usually close, so the bracket ends right after it
+            max_flow = self.previous_flows[path_less_pressure] * (1 + WARM_START_FLOW_MARGIN)
         for i in range(50):
             self.__calculate_required_pressure(max_flow, [path_less_pressure])
-            if self.shpCalc.reservoir_path.start_pressure > 0:
+            if network.start_pressure[network.reservoir] > 0:
                 break
             else:
                 logger.debug(f'Found max flow: {max_flow}, in the {i} iteration')
+                (min_flow, min_flow_pressure) = (max_flow, network.start_pressure[network.reservoir])
                 max_flow *= 2
         else:
             message = f'Reservatório alto demais. Maior vazão usada para o calculo: {max_flow}'
             logger.error(message)
             raise CouldNotFinishCalculate(message)
 
-        flow = max_flow * 0.5
-
-        for i in range(50):
+        def reservoir_start_pressure(flow: float) -> float:
             self.__calculate_required_pressure(flow, [path_less_pressure])
-            if abs(self.shpCalc.reservoir_path.start_pressure) < 0.000001:
-                break
-            if self.shpCalc.reservoir_path.start_pressure > 0:
-                (max_flow, flow) = (flow, (flow + min_flow) * 0.5)
-            elif self.shpCalc.reservoir_path.start_pressure < 0:
-                (min_flow, flow) = (flow, (max_flow + flow) * 0.5)
-
-        else:
+            return network.start_pressure[network.reservoir]
+
+        flow, iterations = brent(
+            reservoir_start_pressure,
+            min_flow,
+            max_flow,
+            min_flow_pressure,
+            network.start_pressure[network.reservoir],
+            tolerance=self.precision.pressure_tolerance,
+            max_iterations=self.precision.max_iterations,
+            best_effort=self.precision.best_effort,
+        )
+        if flow is None:
             message = 'Não foi possivel calcular uma vazão residual.'
             logger.error(message)
             raise CouldNotFinishCalculate(message)
+        logger.debug(f'Found residual flow: {flow}, in the {iterations} iteration')
 
         logger.debug(f'Finished calculate residual flow. minimum non zero flow: {flow} m³s')
 
+    def __calculate_residual_flow_by_gradient(self):
+        solver = self.__get_gradient_solver()
+        iterations = solver.solve(0)
+        if not solver.has_flow():
+            message = 'Nenhum hidrante com vazão com esta altura de reservatório.'
+            logger.error(message)
+            raise CouldNotFinishCalculate(message)
+        self.__apply_gradient_solution(solver, 0)
+
+        logger.debug(f'Finished calculate residual flow by the gradient method, in {iterations} iterations')
+
+    def __calculate_minimum_required_pressure(self):
+        if self.shpCalc.solver_type != Config.SolverType.GRADIENTE:
+            self.__calculate_required_pressure(self.fixture.minimum_flow_rate_in_m3_p_s)
+            return
+
+        logger.debug('Calculating required pressure by the gradient method')
+        solver = self.__get_gradient_solver()
+        start_pressure = solver.solve_required_pressure(self.fixture.minimum_flow_rate_in_m3_p_s)
+        self.__apply_gradient_solution(solver, start_pressure)
+
+        logger.debug(f'Finished calculate required pressure: {start_pressure} m.c.a.')
+
+    def __get_gradient_solver(self) -> GradientSolver:
+        self.network.update_reservoir_total_length()
+        return GradientSolver(self.network, self.previous_flows, self.precision)
+
+    def __apply_gradient_solution(self, solver: GradientSolver, start_pressure: float):
+        '''
+        leaves the network as the iterative solver does, with the flows of the fixtures
+        found by the gradient method and `start_pressure` in the reservoir
+        '''
+        network = self.network
+        if network.looped:
+            solver.write_flows()
+        else:
+            solver.write_fixtures_flow()
+            network.sum_flows()
+        network.calculate_pressure_drops()
+        network.start_pressure[network.reservoir] = start_pressure
+        network.calculate_pressures()
+
     def __calculate_pump(self) -> SHPCalcSerializer:
 
         logger.debug('Calculating pump')
 
-        if not self.shpCalc.pump_path:
-            raise NoPumpFound()
+        self.__calculate_minimum_required_pressure()
 
-        self.__calculate_required_pressure(self.fixture.minimum_flow_rate_in_m3_p_s)
-
-        self.shpCalc.pump.head_lift = self.shpCalc.reservoir_path.start_pressure
-        self.shpCalc.reservoir_path.start_pressure = 0
-        self.shpCalc.pump.flow = self.shpCalc.reservoir_path.flow
-        RES_BOM_pressure_drop = self.shpCalc.pump.head_lift - self.shpCalc.pump_path.end_pressure
+        network = self.network
+        self.shpCalc.pump.head_lift = network.start_pressure[network.reservoir]
+        network.start_pressure[network.reservoir] = 0
+        self.shpCalc.pump.flow = network.flow[network.reservoir]
+        RES_BOM_pressure_drop = self.shpCalc.pump.head_lift - network.end_pressure[network.pump]
         self.shpCalc.pump.NPSHd = 10.33 - 0.238 - RES_BOM_pressure_drop
 
         logger.debug(
@@ -171,18 +297,24 @@ class SHP():
     def __calculate_pump_residual_flow(self) -> SHPCalcSerializer:
         logger.debug('Calculating residual flow for pump system')
 
-        self.shpCalc.pump_path.head_lift = self.shpCalc.pump.head_lift
+        network = self.network
+        network.set_head_lift(network.pump, self.shpCalc.pump.head_lift)
 
         self.__calculate_residual_flow()
 
-        self.shpCalc.pump.flow = self.shpCalc.reservoir_path.flow
-        RES_BOM_pressure_drop = self.shpCalc.pump.head_lift - self.shpCalc.pump_path.end_pressure
+        self.shpCalc.pump.flow = network.flow[network.reservoir]
+        RES_BOM_pressure_drop = self.shpCalc.pump.head_lift - network.end_pressure[network.pump]
         self.shpCalc.pump.NPSHd = 10.33 - 0.238 - RES_BOM_pressure_drop
 
     def calculate(self) -> SHPCalcSerializer:
+        self.solve()
+        return self.get_serializer()
+
+    def solve(self):
+        '''
+        calculates the network and writes the results on the calc, without serializing them
+        '''
         self.__prepare_calc()
-        if (self.shpCalc.pressure_type == Config.PressureType.BOMBA):
-            self.__validate_pump_calc()
 
         if (self.shpCalc.calc_type == Config.CalcType.VAZAO_MINIMA and
                 self.shpCalc.pressure_type == Config.PressureType.GRAVITACIONAL):
@@ -199,28 +331,69 @@ class SHP():
         else:
             raise CalculeNotImplemented()
 
-        self.shpCalc.reservoir_path.head_lift = 0
+        network = self.network
+        network.set_head_lift(network.reservoir, 0)
         if self.shpCalc.pump_path:
-            self.shpCalc.pump_path.head_lift = self.shpCalc.pump.head_lift
+            network.set_head_lift(network.pump, self.shpCalc.pump.head_lift)
 
-        self.__sum_paths_flow(self.shpCalc.reservoir_path)
-        self.__calculate_paths_pressure_drop()
-        self.__calculate_paths_pressure(self.shpCalc.reservoir_path)
+        if not network.looped:
+            network.sum_flows()
+        network.calculate_pressure_drops()
+        network.calculate_pressures()
+        network.calculate_speeds()
+        network.write_back()
+        self.shpCalc.accuracy = self.__get_accuracy()
 
-        self.__calculate_paths_speed()
         if self.shpCalc.pump.head_lift:
             self.shpCalc.pump.head_lift = '{:.3f}'.format(self.shpCalc.pump.head_lift)
         self.shpCalc.reservoir_path.level_difference = '{:.3f}'.format(self.shpCalc.reservoir_path.level_difference)
 
         self.shpCalc.paths_with_fixture.sort(key=sortByEndPressure)
-        self.shpCalc.less_favorable_path_fixture_index = self.shpCalc.paths.index(
+        self.shpCalc.less_favorable_path_fixture_index = self.topology.position(
             self.shpCalc.paths_with_fixture[0]
         )
+
+    def get_serializer(self) -> SHPCalcSerializer:
         self.shpCalc.calculated_at = timezone.now()
         return self.serializer_class(data=asdict(self.shpCalc))
 
+    def get_network(self) -> SHPNetwork:
+        '''
+        prepares the calc without solving it, the network has the equivalent lengths of every path
+        '''
+        self.__prepare_calc()
+        return self.network
+
+    def get_required_head(self) -> float:
+        '''
+        height of the reservoir, or head lift of the pump, found by the last calc of minimum flow
+        '''
+        network = self.network
+        if self.shpCalc.pressure_type == Config.PressureType.BOMBA:
+            return float(network.head_lift[network.pump])
+        return float(-network.level_difference[network.reservoir])
+
+    def __get_accuracy(self) -> float:
+        '''
+        largest difference, in m.c.a., between the pressure that reaches an active fixture with flow
+        and the pressure its flow needs, an estimate of the error of the solution
+        '''
+        network = self.network
+        accuracy = 0
+        for path in self.paths_with_fixture:
+            flow = network.fixture_flow[path]
+            if flow > 0:
+                pressure = self.fixture.flow_to_pressure(flow) or 0
+                accuracy = max(accuracy, abs(network.fixture_end_pressure[path] - pressure))
+        return accuracy
+
     def __prepare_calc(self):
-        self.fixture: Fixture = Fixture.objects.get(id=self.shpCalc.fixture_id)
+        validate_network(self.shpCalc)
+        self.shpCalc.catalog_version = get_catalog_version('shp')
+        self.precision = SolverPrecision.for_mode(self.shpCalc.precision)
+        if self.catalog is None:
+            self.catalog = CatalogSnapshot.for_calcs([self.shpCalc])
+        self.fixture: Fixture = self.catalog.get_fixture(self.shpCalc.fixture_id)
         if not self.fixture:
             raise NoFixtureError()
         if self.shpCalc.signatory_id and self.shpCalc.signatory_id > 0:
@@ -233,19 +406,19 @@ class SHP():
         self.shpCalc.error = None
         self.shpCalc.less_favorable_path_fixture_index = None
         self.shpCalc.calculated_at = None
+        self.topology = SHPTopology(self.shpCalc.paths)
+        self.previous = PreviousCalc.load(self.shpCalc)
+        self.shpCalc.previous_cache_key = None
+        self.shpCalc.previous_result = None
 
         for path in self.shpCalc.paths:
-            path.material = Material.objects.get(id=path.material_id)
-            path.diameter = Diameter.objects.get(id=path.diameter_id)
+            path.material = self.catalog.get_material(path.material_id)
+            path.diameter = self.catalog.get_diameter(path.diameter_id)
 
             if path.start == 'RES':
-                if self.shpCalc.reservoir_path:
-                    raise MoreThenOneReservoir()
                 self.shpCalc.reservoir_path = path
 
             if self.shpCalc.pressure_type == Config.PressureType.BOMBA and path.end == self.shpCalc.pump.node:
-                if self.shpCalc.pump_path:
-                    raise MoreThenOnePump()
                 self.shpCalc.pump_path = path
 
             path.flow = 0
@@ -258,106 +431,14 @@ class SHP():
             path.unit_pressure_drop = 0
             path.head_lift = 0
 
-            path.connection_names = [
-                f'Comprimento extra: {format_decimal(path.equivalent_length)} m'
-            ]
-
-            # Get connections to connect to the previous path
-            previous_path = self.get_path_before(path)
-
-            if previous_path and previous_path.material_id != path.material_id:
-                material_connections: MaterialConnection = (
-                    MaterialConnection.objects
-                    .filter(inlet_material=previous_path.material_id, outlet_material=path.material_id)
-                )
-                current_material_connection: MaterialConnection = None
-                for material_connection in material_connections.all():
-                    if (
-                        material_connection.inlet_diameter == previous_path.diameter_id
-                        and material_connection.outlet_diameter == path.diameter_id
-                    ):
-                        current_material_connection = material_connection
-                        break
-                    if (material_connection.inlet_diameter == previous_path.diameter_id):
-                        current_material_connection = material_connection
-                    elif (material_connection.outlet_diameter == path.diameter_id):
-                        current_material_connection = material_connection
-                    if not current_material_connection:
-                        current_material_connection = material_connection
-
-                if (current_material_connection and current_material_connection.equivalent_length):
-                    path.equivalent_length += float(current_material_connection.equivalent_length)
-                    path.connection_names.append(
-                        f'{current_material_connection.name}: '
-                        f'{format_decimal(current_material_connection.equivalent_length)} m'
-                    )
-                    if current_material_connection.inlet_diameter_id != previous_path.diameter_id:
-                        inlet_reductions = get_best_reduction(
-                            previous_path.diameter_id, current_material_connection.inlet_diameter_id)
-                        for reduction in inlet_reductions:
-                            if (reduction and reduction.equivalent_length):
-                                path.equivalent_length += float(reduction.equivalent_length)
-                                path.connection_names.append(
-                                    f'{reduction.name}: {format_decimal(reduction.equivalent_length)} m'
-                                )
-                    if current_material_connection.outlet_diameter_id != path.diameter_id:
-                        outlet_reductions = get_best_reduction(
-                            current_material_connection.outlet_diameter_id, path.diameter_id)
-                        for reduction in outlet_reductions:
-                            if (reduction and reduction.equivalent_length):
-                                path.equivalent_length += float(reduction.equivalent_length)
-                                path.connection_names.append(
-                                    f'{reduction.name}: {format_decimal(reduction.equivalent_length)} m'
-                                )
-
-            elif previous_path and previous_path.diameter_id != path.diameter_id:
-                inlet_reductions = get_best_reduction(previous_path.diameter_id, path.diameter_id)
-                for reduction in inlet_reductions:
-                    if (reduction and reduction.equivalent_length):
-                        path.equivalent_length += float(reduction.equivalent_length)
-                        path.connection_names.append(
-                            f'{reduction.name}: {format_decimal(reduction.equivalent_length)} m'
-                        )
-
-            # Get connections in the path
-            if path.fittings_ids:
-                path.fittings = Fitting.objects.filter(id__in=path.fittings_ids)
-                for fitting_id in path.fittings_ids:
-                    fitting_diameter: FittingDiameter = (
-                        FittingDiameter.objects
-                        .filter(diameter_id=path.diameter_id, fitting=fitting_id)
-                        .prefetch_related('fitting')
-                        .first()
-                    )
-                    if (fitting_diameter and fitting_diameter.equivalent_length):
-                        path.equivalent_length += float(fitting_diameter.equivalent_length)
-                        path.connection_names.append(
-                            f'{fitting_diameter.fitting.name}: {format_decimal(fitting_diameter.equivalent_length)} m'
-                        )
-            else:
-                path.fittings = []
-
-            # Get connections to connect to the next path
-            connection_fitting_id = None
+            path_before = self.get_path_before(path)
             count_paths_after = len(self.get_paths_after(path))
-            if count_paths_after == 1:
-                connection_fitting_id = path.material.one_outlet_connection_id
-            if count_paths_after == 2:
-                connection_fitting_id = path.material.two_outlet_connection_id
-            if count_paths_after == 3:
-                connection_fitting_id = path.material.three_outlet_connection_id
-            if connection_fitting_id:
-                fitting_diameter: FittingDiameter = (
-                    FittingDiameter.objects
-                    .filter(diameter_id=path.diameter_id, fitting=connection_fitting_id)
-                    .prefetch_related('fitting')
-                    .first()
-                )
-                if (fitting_diameter and fitting_diameter.equivalent_length):
-                    path.equivalent_length += float(fitting_diameter.equivalent_length)
-                    path.connection_names.append(
-                        f'{fitting_diameter.fitting.name}: {format_decimal(fitting_diameter.equivalent_length)} m'
-                    )
+            connections = self.previous.get_connections(path, path_before, count_paths_after) if self.previous else None
+            if connections:
+                (path.equivalent_length, path.connection_names) = connections
+                path.fittings = self.catalog.get_fittings(path.fittings_ids) if path.fittings_ids else []
+            else:
+                self.__calculate_connections(path, path_before, count_paths_after)
 
             path.total_length = path.equivalent_length + path.length
 
@@ -389,11 +470,8 @@ class SHP():
                 ]
                 for fitting_id in self.fixture.fittings_ids:
                     if path.fixture.inlet_diameter:
-                        fitting_diameter: FittingDiameter = (
-                            FittingDiameter.objects
-                            .filter(diameter_id=path.fixture.inlet_diameter.id, fitting=fitting_id)
-                            .prefetch_related('fitting')
-                            .first()
+                        fitting_diameter: FittingDiameter = self.catalog.get_fitting_diameter(
+                            path.fixture.inlet_diameter.id, fitting_id
                         )
                         if (fitting_diameter and fitting_diameter.equivalent_length):
                             path.fixture.total_length += float(fitting_diameter.equivalent_length)
@@ -402,239 +480,414 @@ class SHP():
                                 f'{format_decimal(fitting_diameter.equivalent_length)} m'
                             )
                 for reduction_id in self.fixture.reductions_ids:
-                    reduction: Reduction = (Reduction.objects.filter(id=reduction_id).first())
+                    reduction: Reduction = self.catalog.get_reduction(reduction_id)
                     if (reduction and reduction.equivalent_length):
                         path.fixture.total_length += float(reduction.equivalent_length)
                         path.fixture.connection_names.append(
                             f'{reduction.name}: {format_decimal(reduction.equivalent_length)} m'
                         )
                 self.shpCalc.paths_with_fixture.append(path)
-        if not self.shpCalc.paths_with_fixture:
-            raise NoActiveFixtureFound()
-        if not self.shpCalc.reservoir_path:
-            raise NoReservoir()
-
-    def __validate_pump_calc(self):
-        if not self.shpCalc.pump_path:
-            raise NoPumpFound()
-
-        path = self.shpCalc.reservoir_path
-        while path and path != self.shpCalc.pump_path:
-            paths_after = self.get_paths_after(path)
-            print([str(p) for p in paths_after])
-            if len(paths_after) == 0:
-                raise PathNotLeadingToReservoir()
-            elif (len(paths_after) > 1):
-                raise BifurcationBeforePump()
-            path = paths_after[0]
-        print(path)
-
-    def __sum_paths_flow(self, path: SHPCalcPath):
-        if path.has_active_fixture:
-            path.flow = path.fixture.flow
-            return path.flow
-        paths_after: list[SHPCalcPath] = self.get_paths_after(path)
-        path.flow = 0
-        for next_path in paths_after:
-            path.flow += self.__sum_paths_flow(next_path)
-        return path.flow
 
-    def __calculate_paths_speed(self):
-        for path in self.shpCalc.paths:
-            path.speed = path.get_speed()
+        self.network = SHPNetwork(self.shpCalc, self.fixture, self.topology)
+        if self.network.looped and self.shpCalc.solver_type != Config.SolverType.GRADIENTE:
+            # the iterative solver follows the tree from the fixtures to the reservoir
+            logger.info('Looped network, calculating by the gradient method')
+            self.shpCalc.solver_type = Config.SolverType.GRADIENTE
+        self.paths_with_fixture = [self.topology.position(path) for path in self.shpCalc.paths_with_fixture]
+        if self.previous:
+            self.previous_flows = self.previous.get_flows(self.shpCalc.paths)
+            self.previous_less_favorable = self.previous.get_less_favorable(self.shpCalc.paths)
+        # last solution of every branch, kept across the outer loops as the start of the next solve
+        if self.previous_flows is not None:
+            # the links of a looped network can have negative flows, the paths without a positive
+            # flow in the previous calc start without a last solution
+            previous_flows = self.previous_flows
+            self.branch_flows = np.where(np.isfinite(previous_flows) & (previous_flows > 0), previous_flows, 0).tolist()
+        else:
+            self.branch_flows = [0.0] * self.network.count
+
+    def __calculate_connections(self,
+                                path: SHPCalcPath,
+                                path_before: Union[SHPCalcPath, None],
+                                count_paths_after: int):
+        '''
+        equivalent length and names of the connections to the path before, of the fittings
+        and of the connection to the paths after
+        '''
+        path.connection_names = [
+            f'Comprimento extra: {format_decimal(path.equivalent_length)} m'
+        ]
+
+        # Get connections to connect to the previous path
+        if path_before and path_before.material_id != path.material_id:
+            current_material_connection: MaterialConnection = self.catalog.get_material_connection(
+                path_before.material_id, path_before.diameter_id, path.material_id, path.diameter_id
+            )
 
-    def __calculate_paths_pressure_drop(self):
-        for path in self.shpCalc.paths:
-            if path.has_fixture:
-                path.fixture.calculate_pressure_drop(path.fixture.flow, self.fixture)
-            path.calculate_pressure_drop(path.flow)
-
-    def __calculate_paths_pressure(self, path: SHPCalcPath):
-        path.calculate_end_pressure(path.start_pressure)
-        if path.has_fixture:
-            path.fixture.calculate_end_pressure(path.end_pressure)
-        paths_after: list[SHPCalcPath] = self.get_paths_after(path)
-        for next_path in paths_after:
-            next_path.start_pressure = path.end_pressure
-            self.__calculate_paths_pressure(next_path)
+            if (current_material_connection and current_material_connection.equivalent_length):
+                path.equivalent_length += float(current_material_connection.equivalent_length)
+                path.connection_names.append(
+                    f'{current_material_connection.name}: '
+                    f'{format_decimal(current_material_connection.equivalent_length)} m'
+                )
+                if current_material_connection.inlet_diameter_id != path_before.diameter_id:
+                    inlet_reductions = self.catalog.get_best_reduction(
+                        path_before.diameter_id, current_material_connection.inlet_diameter_id)
+                    for reduction in inlet_reductions:
+                        if (reduction and reduction.equivalent_length):
+                            path.equivalent_length += float(reduction.equivalent_length)
+                            path.connection_names.append(
+                                f'{reduction.name}: {format_decimal(reduction.equivalent_length)} m'
+                            )
+                if current_material_connection.outlet_diameter_id != path.diameter_id:
+                    outlet_reductions = self.catalog.get_best_reduction(
+                        current_material_connection.outlet_diameter_id, path.diameter_id)
+                    for reduction in outlet_reductions:
+                        if (reduction and reduction.equivalent_length):
+                            path.equivalent_length += float(reduction.equivalent_length)
+                            path.connection_names.append(
+                                f'{reduction.name}: {format_decimal(reduction.equivalent_length)} m'
+                            )
+
+        elif path_before and path_before.diameter_id != path.diameter_id:
+            inlet_reductions = self.catalog.get_best_reduction(path_before.diameter_id, path.diameter_id)
+            for reduction in inlet_reductions:
+                if (reduction and reduction.equivalent_length):
+                    path.equivalent_length += float(reduction.equivalent_length)
+                    path.connection_names.append(
+                        f'{reduction.name}: {format_decimal(reduction.equivalent_length)} m'
+                    )
+
+        # Get connections in the path
+        if path.fittings_ids:
+            path.fittings = self.catalog.get_fittings(path.fittings_ids)
+            for fitting_id in path.fittings_ids:
+                fitting_diameter: FittingDiameter = self.catalog.get_fitting_diameter(path.diameter_id, fitting_id)
+                if (fitting_diameter and fitting_diameter.equivalent_length):
+                    path.equivalent_length += float(fitting_diameter.equivalent_length)
+                    path.connection_names.append(
+                        f'{fitting_diameter.fitting.name}: {format_decimal(fitting_diameter.equivalent_length)} m'
+                    )
+        else:
+            path.fittings = []
+
+        # Get connections to connect to the next path
+        connection_fitting_id = None
+        if count_paths_after == 1:
+            connection_fitting_id = path.material.one_outlet_connection_id
+        if count_paths_after == 2:
+            connection_fitting_id = path.material.two_outlet_connection_id
+        if count_paths_after == 3:
+            connection_fitting_id = path.material.three_outlet_connection_id
+        if connection_fitting_id:
+            fitting_diameter: FittingDiameter = self.catalog.get_fitting_diameter(
+                path.diameter_id, connection_fitting_id
+            )
+            if (fitting_diameter and fitting_diameter.equivalent_length):
+                path.equivalent_length += float(fitting_diameter.equivalent_length)
+                path.connection_names.append(
+                    f'{fitting_diameter.fitting.name}: {format_decimal(fitting_diameter.equivalent_length)} m'
+                )
+
+    def __sort_by_end_pressure(self, paths_with_fixture: List[int]):
+        paths_with_fixture.sort(key=lambda path: self.network.fixture_end_pressure[path])
 
-    def __calculate_reservoir_start_pressure(self, path_less_pressure: SHPCalcPath):
+    def __calculate_reservoir_start_pressure(self, path_less_pressure: int):
 
         assert self.minimum_flow is not None, 'self.minimum_flow is required'
 
-        logger.debug(f'Calculating reservoir start pressure for path {str(path_less_pressure)}')
+        network = self.network
+        logger.debug(f'Calculating reservoir start pressure for path {network.path_name(path_less_pressure)}')
         # clean all
-        for path in self.shpCalc.paths:
-            path.start_pressure = 0
-            path.end_pressure = 0
-            path.flow = 0
-            path.pressure_drop = 0
-            if path.has_active_fixture:
-                path.fixture.start_pressure = 0
-                path.fixture.middle_pressure = 0
-                path.fixture.end_pressure = 0
-                path.fixture.flow = 0
-                path.fixture.nozzle_pressure_drop = 0
-                path.fixture.hose_pressure_drop = 0
+        network.clean()
 
         path_after = None
         path = path_less_pressure
-        path.fixture.calculate_pressure_drop(self.minimum_flow, self.fixture)
-        pressure = self.fixture.flow_to_pressure(path.fixture.flow) or 0
-        path.fixture.calculate_start_pressure(pressure)
-        path.calculate_pressure_drop(path.fixture.flow)
-        path.calculate_start_pressure(path.fixture.start_pressure)
-
-        count = 0
-        max_count = len(self.shpCalc.paths)*2
-        while path.start != 'RES':
-            count += 1
-            if count > max_count:
-                raise PathNotLeadingToReservoir()
-            (path_after, path) = (path, self.get_path_before(path))
-            if not path:
-                raise PathNotLeadingToReservoir()
-            flow = path_after.flow
-            paths_after = self.get_paths_after(path, path_after)
-            for _path_after in paths_after:
-                flow += self.__calculate_paths_flow(_path_after, path_after.start_pressure)
-            path.calculate_pressure_drop(flow)
-            path.calculate_start_pressure(path_after.start_pressure)
-
-        logger.debug(f'Calculated reservoir start pressure: {path.start_pressure}, for path {str(path_less_pressure)}')
+        network.calculate_fixture_pressure_drop(path, self.minimum_flow)
+        pressure = self.fixture.flow_to_pressure(network.fixture_flow[path]) or 0
+        network.calculate_fixture_start_pressure(path, pressure)
+        network.calculate_pressure_drop(path, network.fixture_flow[path])
+        network.calculate_start_pressure(path, network.fixture_start_pressure[path])
+
+        # every active fixture leads to the reservoir, see `validate_network`
+        while path != network.reservoir:
+            (path_after, path) = (path, network.get_path_before(path))
+            flow = network.flow[path_after]
+            for _path_after in network.get_paths_after(path):
+                if _path_after != path_after:
+                    flow += self.__calculate_paths_flow(_path_after, network.start_pressure[path_after])
+            network.calculate_pressure_drop(path, flow)
+            network.calculate_start_pressure(path, network.start_pressure[path_after])
+
+        logger.debug(
+            f'Calculated reservoir start pressure: {network.start_pressure[path]}, '
+            f'for path {network.path_name(path_less_pressure)}'
+        )
 
     def __calculate_required_pressure(self,
                                       minimum_flow: float,
-                                      paths_with_fixture: List[SHPCalcPath] = None) -> SHPCalcPath:
+                                      paths_with_fixture: List[int] = None) -> int:
         logger.debug('Calculating required pressure')
 
         if paths_with_fixture is None:
-            paths_with_fixture = self.shpCalc.paths_with_fixture
+            paths_with_fixture = self.paths_with_fixture
         elif not isinstance(paths_with_fixture, list):
             paths_with_fixture = [paths_with_fixture]
 
         self.minimum_flow = minimum_flow
         logger.debug(f'Minimum flow expected: {self.minimum_flow}')
 
-        self.shpCalc.reservoir_path.total_length = (
-            self.shpCalc.reservoir_path.length +
-            self.shpCalc.reservoir_path.equivalent_length +
-            abs(self.shpCalc.reservoir_path.level_difference)
-        )
+        network = self.network
+        network.update_reservoir_total_length()
 
-        self.__calculate_paths_pressure(self.shpCalc.reservoir_path)
-        paths_with_fixture.sort(key=sortByEndPressure)
-        path_less_pressure = paths_with_fixture[0]
-        logger.debug(f'Best starting path: {str(path_less_pressure)}')
-
-        while paths_with_fixture and path_less_pressure:
-            self.shpCalc.reservoir_path.start_pressure = 0
+        if self.previous_less_favorable in paths_with_fixture:
+            # the less favorable fixture rarely changes between two calcs of the network
+            path_less_pressure = self.previous_less_favorable
+        elif len(paths_with_fixture) == 1:
+            path_less_pressure = paths_with_fixture[0]
+        else:
+            # the fixture that needs the most pressure alone, by its height and the resistance
+            # of the paths from the reservoir, is usually the less favorable
+            demands = network.get_fixture_demands(minimum_flow)
+            path_less_pressure = max(paths_with_fixture, key=lambda path: demands[path])
+        logger.debug(f'Best starting path: {network.path_name(path_less_pressure)}')
+
+        while paths_with_fixture and path_less_pressure is not None:
+            network.start_pressure[network.reservoir] = 0
             self.__calculate_reservoir_start_pressure(path_less_pressure)
-            paths_with_fixture.sort(key=sortByEndPressure)
+            self.__sort_by_end_pressure(paths_with_fixture)
             if path_less_pressure == paths_with_fixture[0]:
                 break
             else:
                 paths_with_fixture = [path for path in paths_with_fixture if path != path_less_pressure]
                 path_less_pressure = paths_with_fixture[0]
 
-        logger.debug(f'Path with least pressure: {str(path_less_pressure)}')
+        logger.debug(f'Path with least pressure: {network.path_name(path_less_pressure)}')
 
-        logger.debug(f'Finished calculate required pressure: {self.shpCalc.reservoir_path.start_pressure} m.c.a.')
+        logger.debug(f'Finished calculate required pressure: {network.start_pressure[network.reservoir]} m.c.a.')
 
         return path_less_pressure
 
-    def __get_path_with_less_pressure_and_flow(self) -> Tuple[SHPCalcSerializer, bool]:
+    def __get_path_with_less_pressure_and_flow(self) -> Tuple[int, bool]:
+        '''
+        Finds the less favorable fixture among the fixtures with flow, with the
+        start pressure of the reservoir at zero.
+
+        A fixture without flow when it is alone in the network never has flow, so
+        it is left out before any solve. When a candidate has no flow, the start
+        pressure it requires is higher than the real one, where every pressure of
+        the network is lower, so the fixtures without flow in its solve are left
+        out too.
+        '''
         minimum_flow = self.fixture.minimum_flow_rate_in_m3_p_s
 
         logger.debug('Finding path with less pressure, with flow')
-        paths_with_fixture = self.shpCalc.paths_with_fixture
-        paths_with_fixture_count = len(paths_with_fixture)
+        network = self.network
+        demands = network.get_fixture_demands(0)
+        paths_with_fixture = [path for path in self.paths_with_fixture if demands[path] < 0]
         path_less_pressure = None
 
-        for i in range(paths_with_fixture_count):
-            paths_with_fixture = [path for path in paths_with_fixture if path != path_less_pressure]
+        while paths_with_fixture:
             path_less_pressure = self.__calculate_required_pressure(minimum_flow, paths_with_fixture)
             self.__calculate_required_pressure(0, [path_less_pressure])
-            if self.shpCalc.reservoir_path.start_pressure < 0:
-                logger.debug(f'Found {str(path_less_pressure)} as path with less pressure')
+            if network.start_pressure[network.reservoir] < 0:
+                logger.debug(f'Found {network.path_name(path_less_pressure)} as path with less pressure')
                 return path_less_pressure, True
-        else:
-            return path_less_pressure, False
-
-    def __calculate_paths_flow(self, path: SHPCalcPath, start_pressure: float):
-
-        if path.has_fixture:
-            if not path.has_active_fixture:
-                return 0
-
-            flow = min_flow = 0
-            path.calculate_pressure_drop(flow)
-            path.calculate_end_pressure(start_pressure)
-            path.fixture.calculate_pressure_drop(flow, self.fixture)
-            path.fixture.calculate_end_pressure(path.end_pressure)
-            flow = max_flow = self.fixture.pressure_to_flow(path.fixture.end_pressure)
-
-            if min_flow == max_flow:
-                return max_flow
-
-            for i in range(100):
-
-                path.fixture.calculate_pressure_drop(flow, self.fixture)
-                pressure = self.fixture.flow_to_pressure(path.fixture.flow) or start_pressure
-                path.fixture.calculate_start_pressure(pressure)
-                path.calculate_pressure_drop(path.fixture.flow)
-                path.calculate_start_pressure(path.fixture.start_pressure)
-
-                if (abs(start_pressure - path.start_pressure) < 0.000001):
-                    if CALC_LOGGING_DETAIL:
-                        logger.debug(f'Found {str(path)} fixture flow: {path.fixture.flow}, in the {i} iteration')
-                    return flow
-                if start_pressure > path.start_pressure:
-                    (min_flow, flow) = (flow, (max_flow + flow) * 0.5)
-                elif start_pressure < path.start_pressure:
-                    (max_flow, flow) = (flow, (flow + min_flow) * 0.5)
+            paths_with_fixture = [
+                path for path in paths_with_fixture
+                if path != path_less_pressure and self.fixture.pressure_to_flow(network.fixture_end_pressure[path])
+            ]
+        return path_less_pressure, False
+
+    def __calculate_paths_flow(self, path: int, start_pressure: float) -> float:
+        flow, _ = self.__solve_paths_flow(path, start_pressure)
+        return flow
+
+    def __solve_paths_flow(self, path: int, start_pressure: float) -> Tuple[float, float]:
+        '''
+        Solves the flow of the branch that starts in `path` with `start_pressure`.
+
+        The outer loops solve the same branches again and again with close start
+        pressures, so every solve starts from the last solution of the branch.
+
+        The solve of a branch waits for the solves of the branches after it, on
+        every Newton step. Instead of recursing once per level of the tree, every
+        branch being solved is a generator in an explicit stack, that yields the
+        branches it needs and receives their results, so the depth of the network
+        is not bounded by the recursion limit.
+
+        returns (flow, conductance), the conductance being the derivative of the
+        branch flow by its start pressure, used in the Newton step of the path before.
+        '''
+
+        network = self.network
+        if network.is_fixture(path):
+            return self.__solve_fixture_flow(path, start_pressure)
+
+        solvers = [self.__solve_branch_flow(path, start_pressure)]
+        result = None
+        while True:
+            try:
+                (branch, branch_start_pressure) = solvers[-1].send(result)
+            except StopIteration as stop:
+                solvers.pop()
+                if not solvers:
+                    return stop.value
+                result = stop.value
+                continue
+            if network.is_fixture(branch):
+                result = self.__solve_fixture_flow(branch, branch_start_pressure)
             else:
-                message = f'Não foi possivel calcular a vazão no trecho {str(path)}.'
-                logger.error(message)
-                raise CouldNotFinishCalculate(message)
-
-        else:
-            paths_after = self.get_paths_after(path)
-
+                solvers.append(self.__solve_branch_flow(branch, branch_start_pressure))
+                result = None
+
+    def __solve_fixture_flow(self, path: int, start_pressure: float) -> Tuple[float, float]:
+        '''
+        solves the flow of the fixture path `path` with `start_pressure`, returns (flow, conductance)
+        '''
+        network = self.network
+        if not network.is_active_fixture(path):
+            return 0, 0
+
+        flow = 0
+        network.calculate_pressure_drop(path, flow)
+        network.calculate_end_pressure(path, start_pressure)
+        network.calculate_fixture_pressure_drop(path, flow)
+        network.calculate_fixture_end_pressure(path, network.end_pressure[path])
+        max_flow = self.fixture.pressure_to_flow(network.fixture_end_pressure[path])
+
+        if not max_flow:
+            return 0, 0
+
+        def fixture_residual(flow: float) -> Tuple[float, float]:
+            network.calculate_fixture_pressure_drop(path, flow)
+            pressure = self.fixture.flow_to_pressure(network.fixture_flow[path]) or 0
+            network.calculate_fixture_start_pressure(path, pressure)
+            network.calculate_pressure_drop(path, network.fixture_flow[path])
+            network.calculate_start_pressure(path, network.fixture_start_pressure[path])
+            return network.start_pressure[path] - start_pressure, self.__get_fixture_branch_derivative(path)
+
+        flow, iterations = safeguarded_newton(
+            fixture_residual, 0, max_flow, initial=self.branch_flows[path],
+            tolerance=self.precision.pressure_tolerance, max_iterations=self.precision.max_iterations,
+            best_effort=self.precision.best_effort,
+        )
+        if flow is None:
+            message = f'Não foi possivel calcular a vazão no trecho {network.path_name(path)}.'
+            logger.error(message)
+            raise CouldNotFinishCalculate(message)
+        if CALC_LOGGING_DETAIL:
+            logger.debug(
+                f'Found {network.path_name(path)} fixture flow: {network.fixture_flow[path]}, '
+                f'in the {iterations} iteration'
+            )
+        self.branch_flows[path] = flow
+        derivative = self.__get_fixture_branch_derivative(path)
+        return flow, (1 / derivative if derivative else 0)
+
+    def __solve_branch_flow(self, path: int, start_pressure: float) -> Generator[Tuple[int, float], Tuple, Tuple]:
+        '''
+        Solves the flow of the path `path`, that isn't a fixture, with `start_pressure`.
+
+        Yields (path_after, start_pressure) for every solve of a branch after it
+        and receives its (flow, conductance), returns (flow, conductance) as the
+        value of the StopIteration.
+        '''
+        network = self.network
+        paths_after = network.get_paths_after(path)
+
+        # without a last solution, the flow without pressure drop in the path bounds the bracket
+        max_flow = math.inf
+        if not self.branch_flows[path] > 0:
             flow = 0
-            path.calculate_pressure_drop(flow)
-            path.calculate_end_pressure(start_pressure)
-            last_pressure = path.end_pressure
-            last_flow = path.flow
-
-            for i in range(100):
-                flow = 0
+            network.calculate_pressure_drop(path, flow)
+            network.calculate_end_pressure(path, start_pressure)
+            max_flow = 0
+            for _path in paths_after:
+                _flow, _ = yield _path, network.end_pressure[path]
+                max_flow += _flow
+
+            if not max_flow:
+                return 0, 0
+
+        paths_after_conductance = 0
+        steps = newton_steps(
+            0, max_flow, initial=self.branch_flows[path],
+            tolerance=self.precision.flow_tolerance, max_iterations=self.precision.max_iterations,
+            best_effort=self.precision.best_effort,
+        )
+        try:
+            flow = next(steps)
+            while True:
+                network.calculate_pressure_drop(path, flow)
+                network.calculate_end_pressure(path, start_pressure)
+                paths_after_flow = paths_after_conductance = 0
                 for _path in paths_after:
-                    flow += self.__calculate_paths_flow(_path, path.end_pressure)
-                path.calculate_pressure_drop(flow)
-                path.calculate_end_pressure(start_pressure)
-                if (abs(last_flow - path.flow) < 0.000001) and (abs(last_pressure - path.end_pressure) < 0.000001):
-                    if CALC_LOGGING_DETAIL:
-                        logger.debug(f'Found {str(path)} path flow: {path.flow}, in the {i} iteration')
-                    return path.flow
-                else:
-                    last_pressure = path.end_pressure
-                    last_flow = path.flow
-            else:
-                message = f'Não foi possivel calcular a vazão no trecho {str(path)}.'
-                logger.error(message)
-                raise CouldNotFinishCalculate(message)
+                    _flow, _conductance = yield _path, network.end_pressure[path]
+                    paths_after_flow += _flow
+                    paths_after_conductance += _conductance
+                flow = steps.send(
+                    (flow - paths_after_flow, 1 + paths_after_conductance * network.get_pressure_drop_derivative(path))
+                )
+        except StopIteration as stop:
+            flow, iterations = stop.value
+        if flow is None:
+            message = f'Não foi possivel calcular a vazão no trecho {network.path_name(path)}.'
+            logger.error(message)
+            raise CouldNotFinishCalculate(message)
+        if CALC_LOGGING_DETAIL:
+            logger.debug(
+                f'Found {network.path_name(path)} path flow: {network.flow[path]}, in the {iterations} iteration'
+            )
+        self.branch_flows[path] = flow
+        derivative = network.get_pressure_drop_derivative(path)
+        return flow, paths_after_conductance / (1 + paths_after_conductance * derivative)
+
+    def __get_fixture_branch_derivative(self, path: int) -> float:
+        '''
+        derivative of the start pressure required by an active fixture branch by its flow
+        '''
+        return (
+            self.fixture.flow_to_pressure_derivative(self.network.fixture_flow[path]) +
+            self.network.get_fixture_pressure_drop_derivative(path) +
+            self.network.get_pressure_drop_derivative(path)
+        )
 
     def get_path_before(self, actual_path: SHPCalcPath) -> Union[SHPCalcPath, None]:
-        for path in self.shpCalc.paths:
-            if path.end == actual_path.start:
-                return path
-        return None
+        return self.topology.get_path_before(actual_path)
 
     def get_paths_after(self, actual_path: SHPCalcPath, exclude_path: SHPCalcPath = None) -> List[SHPCalcPath]:
-        paths = []
-        if actual_path and actual_path.end and not actual_path.has_active_fixture:
-            for path in self.shpCalc.paths:
-                if path.start == actual_path.end and path != exclude_path:
-                    paths.append(path)
-        return paths
+        return self.topology.get_paths_after(actual_path, exclude_path)
+
+
+def calculate_item(catalog: CatalogSnapshot, data: dict) -> dict:
+    '''
+    calculates one SHP network of a batch.
+
+    returns the `status` and the calculated `data`, or the `detail` of the error
+    '''
+    try:
+        serializer = SHP(data, catalog).calculate()
+    except Exception as e:
+        return get_batch_error(e)
+    if serializer.is_valid():
+        return {'status': status.HTTP_200_OK, 'data': serializer.data}
+    return {'status': status.HTTP_400_BAD_REQUEST, 'detail': 'Problemas ao calcular os dados enviados'}
+
+
+def calculate_batch(data: List[dict]) -> List[dict]:
+    '''
+    calculates many SHP networks sharing one catalog snapshot, in parallel when
+    `CALC_WORKERS` is set.
+
+    returns one item for each calc, in the same order, see `calculate_item`
+    '''
+    catalog = CatalogSnapshot.for_data(data)
+    return CalculationExecutor(catalog).map(calculate_item, data)
+
+
+def get_batch_error(exception: Exception) -> dict:
+    if isinstance(exception, APIException):
+        return {'status': exception.status_code, 'detail': exception.detail}
+    logger.exception(exception)
+    return {'status': status.HTTP_400_BAD_REQUEST, 'detail': 'Problemas ao calcular os dados enviados'}
@@ -0,0 +1,198 @@
+from typing import Dict, Iterable, List, Tuple, Union
+
+from django.db.models import Q
+
+from core.reductions import ReductionGraph
+
+from .dataclasses import SHPCalc
+from .models import (Diameter, Fitting, FittingDiameter, Fixture, Material,
+                     MaterialConnection, Reduction)
+
+
+class CatalogSnapshot():
+    '''
+    Every catalog row referenced by one or more calcs, loaded with a fixed
+    number of bulk queries, independent of the size of the network.
+
+    The snapshot only holds dicts of model instances, the lookups never touch
+    the database.
+    '''
+
+    fixtures: Dict[int, Fixture] = None
+    materials: Dict[int, Material] = None
+    diameters: Dict[int, Diameter] = None
+    fittings: Dict[int, Fitting] = None
+    fitting_diameters: Dict[Tuple[int, int], FittingDiameter] = None
+    reductions: Dict[int, Reduction] = None
+    reduction_graphs: Dict[int, ReductionGraph] = None
+    material_connections: Dict[Tuple[int, int], List[MaterialConnection]] = None
+
+    def __init__(self,
+                 material_ids: Iterable[int],
+                 diameter_ids: Iterable[int] = (),
+                 fitting_ids: Iterable[int] = (),
+                 fixture_ids: Iterable[int] = ()):
+        self.fixtures = {
+            fixture.id: fixture for fixture in Fixture.objects.filter(id__in=set(fixture_ids))
+        }
+        diameter_ids = set(diameter_ids)
+        fitting_ids = set(fitting_ids)
+        reduction_ids = set()
+        for fixture in self.fixtures.values():
+            if fixture.inlet_diameter_id:
+                diameter_ids.add(fixture.inlet_diameter_id)
+            fitting_ids.update(fixture.fittings_ids or [])
+            reduction_ids.update(fixture.reductions_ids or [])
+
+        self.materials = {
+            material.id: material for material in (
+                Material.objects
+                .filter(Q(id__in=set(material_ids)) | Q(diameters__id__in=diameter_ids))
+                .distinct()
+            )
+        }
+        material_ids = list(self.materials.keys())
+
+        self.diameters = {
+            diameter.id: diameter for diameter in (
+                Diameter.objects.filter(Q(material_id__in=material_ids) | Q(id__in=diameter_ids))
+            )
+        }
+        for diameter in self.diameters.values():
+            if diameter.material_id in self.materials:
+                diameter.material = self.materials[diameter.material_id]
+        for fixture in self.fixtures.values():
+            if fixture.inlet_diameter_id in self.diameters:
+                fixture.inlet_diameter = self.diameters[fixture.inlet_diameter_id]
+
+        self.fitting_diameters = {}
+        self.fittings = {}
+        for fitting_diameter in (
+            FittingDiameter.objects
+            .filter(diameter__material_id__in=material_ids)
+            .select_related('fitting')
+        ):
+            self.fitting_diameters[(fitting_diameter.diameter_id, fitting_diameter.fitting_id)] = fitting_diameter
+            self.fittings[fitting_diameter.fitting_id] = fitting_diameter.fitting
+        missing_fitting_ids = fitting_ids - set(self.fittings.keys())
+        if missing_fitting_ids:
+            for fitting in Fitting.objects.filter(id__in=missing_fitting_ids):
+                self.fittings[fitting.id] = fitting
+
+        self.reductions = {
+            reduction.id: reduction for reduction in Reduction.objects.filter(id__in=reduction_ids)
+        }
+        self.reduction_graphs = {
+            material_id: ReductionGraph.for_material('shp', material_id) for material_id in material_ids
+        }
+
+        self.material_connections = {}
+        for material_connection in MaterialConnection.objects.filter(
+            inlet_material_id__in=material_ids, outlet_material_id__in=material_ids
+        ):
+            self.material_connections.setdefault(
+                (material_connection.inlet_material_id, material_connection.outlet_material_id), []
+            ).append(material_connection)
+
+    @classmethod
+    def for_calcs(cls, calcs: Iterable[SHPCalc]) -> 'CatalogSnapshot':
+        material_ids = set()
+        diameter_ids = set()
+        fitting_ids = set()
+        fixture_ids = set()
+        for calc in calcs:
+            material_ids.add(calc.material_id)
+            diameter_ids.add(calc.diameter_id)
+            fixture_ids.add(calc.fixture_id)
+            for path in calc.paths:
+                material_ids.add(path.material_id)
+                diameter_ids.add(path.diameter_id)
+                fitting_ids.update(path.fittings_ids or [])
+        return cls(material_ids, diameter_ids, fitting_ids, fixture_ids)
+
+    @classmethod
+    def for_data(cls, data: Iterable[dict]) -> 'CatalogSnapshot':
+        '''
+        same as `for_calcs`, reading the ids straight from the payloads, before they are validated
+        '''
+        material_ids = set()
+        diameter_ids = set()
+        fitting_ids = set()
+        fixture_ids = set()
+        for item in data:
+            if not isinstance(item, dict):
+                continue
+            material_ids.add(item.get('material_id'))
+            diameter_ids.add(item.get('diameter_id'))
+            fixture_ids.add(item.get('fixture_id'))
+            for path in item.get('paths') or []:
+                if not isinstance(path, dict):
+                    continue
+                material_ids.add(path.get('material_id'))
+                diameter_ids.add(path.get('diameter_id'))
+                fitting_ids.update(path.get('fittings_ids') or [])
+        return cls(*(
+            {value for value in ids if isinstance(value, int)}
+            for ids in (material_ids, diameter_ids, fitting_ids, fixture_ids)
+        ))
+
+    def get_fixture(self, fixture_id: int) -> Union[Fixture, None]:
+        return self.fixtures.get(fixture_id)
+
+    def get_material(self, material_id: int) -> Material:
+        try:
+            return self.materials[material_id]
+        except KeyError:
+            raise Material.DoesNotExist(f'Material {material_id} does not exist.')
+
+    def get_diameter(self, diameter_id: int) -> Diameter:
+        try:
+            return self.diameters[diameter_id]
+        except KeyError:
+            raise Diameter.DoesNotExist(f'Diameter {diameter_id} does not exist.')
+
+    def get_fittings(self, fitting_ids: Iterable[int]) -> List[Fitting]:
+        return [self.fittings[fitting_id] for fitting_id in fitting_ids if fitting_id in self.fittings]
+
+    def get_fitting_diameter(self, diameter_id: int, fitting_id: int) -> Union[FittingDiameter, None]:
+        return self.fitting_diameters.get((diameter_id, fitting_id))
+
+    def get_reduction(self, reduction_id: int) -> Union[Reduction, None]:
+        return self.reductions.get(reduction_id)
+
+    def get_material_connections(self, inlet_material_id: int, outlet_material_id: int) -> List[MaterialConnection]:
+        return self.material_connections.get((inlet_material_id, outlet_material_id), [])
+
+    def get_material_connection(self,
+                                inlet_material_id: int,
+                                inlet_diameter_id: int,
+                                outlet_material_id: int,
+                                outlet_diameter_id: int) -> Union[MaterialConnection, None]:
+        '''
+        returns the connection between the materials that matches both diameters,
+        or one of the diameters, or the first one available
+        '''
+        current_material_connection: MaterialConnection = None
+        for material_connection in self.get_material_connections(inlet_material_id, outlet_material_id):
+            if (
+                material_connection.inlet_diameter_id == inlet_diameter_id
+                and material_connection.outlet_diameter_id == outlet_diameter_id
+            ):
+                return material_connection
+            if (material_connection.inlet_diameter_id == inlet_diameter_id):
+                current_material_connection = material_connection
+            elif (material_connection.outlet_diameter_id == outlet_diameter_id):
+                current_material_connection = material_connection
+            if not current_material_connection:
+                current_material_connection = material_connection
+        return current_material_connection
+
+    def get_best_reduction(self, inlet_diameter_id: int, outlet_diameter_id: int) -> List[Reduction]:
+        '''
+        returns the shortest chain of reductions (or enlargements) from the inlet
+        to the outlet diameter, always going in the same direction
+        '''
+        inlet_diameter = self.get_diameter(inlet_diameter_id)
+        return self.reduction_graphs[inlet_diameter.material_id].get_best_reduction(
+            inlet_diameter_id, outlet_diameter_id
+        )
@@ -1 +1,27 @@
 GRAVITY: float = (9.80665)
+
+# Convergence of the iterative solvers
+PRESSURE_TOLERANCE: float = (0.000001)  # m.c.a.
+FLOW_TOLERANCE: float = (0.000000001)  # m³/s
+MAX_ITERATIONS: int = (100)
+
+# Preview precision, for a quick recalculation on every edit
+PREVIEW_PRESSURE_TOLERANCE: float = (0.001)  # m.c.a.
+PREVIEW_FLOW_TOLERANCE: float = (0.000001)  # m³/s
+PREVIEW_MAX_ITERATIONS: int = (20)
+
+# Global gradient solver
+GRADIENT_MINIMUM_FLOW: float = (0.000001)  # m³/s, keeps the derivative of the links positive near zero flow
+
+# Incremental recalculation
+WARM_START_FLOW_MARGIN: float = (0.05)  # around the flow of the previous calc
+
+# Batch calculation
+CALC_BATCH_MAX_SIZE: int = (200)
+
+# Search of the worst combination of simultaneous fixtures
+SCENARIO_MAX_EVALUATIONS: int = (2000)  # combinations calculated, after the ones left out by the bounds
+SCENARIO_BATCH_SIZE: int = (4096)  # combinations of fixtures solved at once by the bounds of the search
+
+# Sizing of the diameters of the paths
+SIZING_MAX_CORRECTIONS: int = (3)  # searches again with the limits lowered by the difference of the last calc
@@ -6,7 +6,27 @@ from core.models import Signatory
 
 from shp.utils import get_unit_pressure_drop
 
-from .models import Diameter, Fitting, Fixture, Material
+from .constants import (FLOW_TOLERANCE, MAX_ITERATIONS, PREVIEW_FLOW_TOLERANCE, PREVIEW_MAX_ITERATIONS,
+                        PREVIEW_PRESSURE_TOLERANCE, PRESSURE_TOLERANCE)
+from .models import Config, Diameter, Fitting, Fixture, Material
+
+
+@dataclass(frozen=True)
+class SolverPrecision:
+    '''
+    tolerances and iteration budget of the solvers. With `best_effort` a solver
+    that runs out of iterations returns its last estimate instead of failing
+    '''
+    pressure_tolerance: float
+    flow_tolerance: float
+    max_iterations: int
+    best_effort: bool = False
+
+    @classmethod
+    def for_mode(cls, mode: str) -> 'SolverPrecision':
+        if mode == Config.PrecisionMode.PREVIEW:
+            return cls(PREVIEW_PRESSURE_TOLERANCE, PREVIEW_FLOW_TOLERANCE, PREVIEW_MAX_ITERATIONS, True)
+        return cls(PRESSURE_TOLERANCE, FLOW_TOLERANCE, MAX_ITERATIONS)
 
 
 @dataclass(kw_only=True)
@@ -167,6 +187,16 @@ class SHPCalcPump:
     NPSHd: float
 
 
+@dataclass(kw_only=True)
+class SHPCalcSizing:
+    material_id: int
+    diameters_ids: list[int] = None
+    max_head: float = None
+    max_speed: float = None
+    cost: float = None
+    evaluations: int = None
+
+
 @dataclass(kw_only=True)
 class SHPCalc:
     fileinfo: SHPCalcFileInfo
@@ -174,6 +204,10 @@ class SHPCalc:
     observation: str = None
     pressure_type: str
     calc_type: str
+    solver_type: str = Config.SolverType.ITERATIVO
+    precision: str = Config.PrecisionMode.FINAL
+    simultaneous_fixtures: int = None
+    sizing: SHPCalcSizing = None
     material_id: int
     diameter_id: int
     fixture_id: int
@@ -187,10 +221,17 @@ class SHPCalc:
     pump: SHPCalcPump = None
     error: str = None
     calculated_at: datetime
+    catalog_version: int = None
+    accuracy: float = None
+    evaluated_scenarios: int = None
+    previous_cache_key: str = None
+    previous_result: dict = None
 
     def __post_init__(self):
         self.fileinfo = SHPCalcFileInfo(**self.fileinfo)
         self.pump = SHPCalcPump(**self.pump)
+        if self.sizing:
+            self.sizing = SHPCalcSizing(**self.sizing)
         newPaths = []
         for path in self.paths:
             newPaths.append(SHPCalcPath(**path))
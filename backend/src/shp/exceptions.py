@@ -1,3 +1,5 @@
+from typing import List
+
 from rest_framework.exceptions import APIException
 from rest_framework import status
 
@@ -79,3 +81,16 @@ class CouldNotFinishCalculate(APIException):
         if detail is None:
             detail = message
         super(CouldNotFinishCalculate, self).__init__(detail, code)
+
+
+class InvalidNetwork(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = 'A rede não é válida.'
+    default_code = 'invalid'
+    problems: List[str] = None
+
+    def __init__(self, problems: List[str], detail=None, code=None):
+        self.problems = problems
+        if detail is None:
+            detail = problems
+        super(InvalidNetwork, self).__init__(detail, code)
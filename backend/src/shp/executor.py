@@ -0,0 +1,123 @@
+import logging
+import multiprocessing
+import os
+import pickle
+import sys
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, List
+
+from django.conf import settings
+
+from .catalog import CatalogSnapshot
+from .exceptions import CouldNotFinishCalculate
+from .worker import initialize_worker, run_in_worker
+
+logger = logging.getLogger(__name__)
+
+
+def get_worker_executable() -> str:
+    '''
+    interpreter of the worker processes. Under uwsgi `sys.executable` is the uwsgi
+    binary, which can't run them, the python of the same prefix is used instead,
+    or `CALC_PYTHON` when set
+    '''
+    if settings.CALC_PYTHON:
+        return settings.CALC_PYTHON
+    if os.path.basename(sys.executable).startswith('python'):
+        return sys.executable
+    (major, minor) = sys.version_info[:2]
+    for name in (f'python{major}.{minor}', f'python{major}', 'python'):
+        executable = os.path.join(sys.exec_prefix, 'bin', name)
+        if os.access(executable, os.X_OK):
+            return executable
+    return sys.executable
+
+
+class CalculationExecutor():
+    '''
+    Runs independent calcs that share one catalog snapshot in a pool of processes,
+    so large jobs use every core of the host instead of one uwsgi worker.
+
+    The catalog is pickled once and shipped to every worker when it starts, each
+    task only carries its own item. With `CALC_WORKERS` lower than 2, or a single
+    item, the calcs run in the current process.
+
+    `function(catalog, item)` must be a module level function, so the workers can import it.
+
+    Used as a context manager, the pool is started once and kept for every `map`
+    inside the block, for jobs that send their items in several rounds.
+    '''
+
+    catalog: CatalogSnapshot = None
+    workers: int = None
+    timeout: float = None
+    pool: ProcessPoolExecutor = None
+
+    def __init__(self, catalog: CatalogSnapshot, workers: int = None, timeout: float = None):
+        self.catalog = catalog
+        self.workers = settings.CALC_WORKERS if workers is None else workers
+        self.timeout = settings.CALC_TIMEOUT if timeout is None else timeout
+
+    def __enter__(self) -> 'CalculationExecutor':
+        if self.workers >= 2:
+            self.pool = self.__create_pool(self.workers)
+        return self
+
+    def __exit__(self, *args):
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def map(self, function: Callable[[CatalogSnapshot, Any], Any], items: List[Any]) -> List[Any]:
+        '''
+        returns `function(catalog, item)` for every item, in the same order.
+
+        raises CouldNotFinishCalculate if the job takes longer than `timeout` seconds,
+        or if a worker process dies
+        '''
+        if self.workers < 2 or len(items) < 2:
+            return [function(self.catalog, item) for item in items]
+
+        pool = self.pool or self.__create_pool(min(self.workers, len(items)))
+        try:
+            futures = [pool.submit(run_in_worker, function, item) for item in items]
+            _, not_done = wait(futures, timeout=self.timeout)
+            if not_done:
+                message = 'Tempo limite do cálculo excedido.'
+                logger.error(f'{message} ({self.timeout} s)')
+                self.__terminate(pool)
+                if pool is self.pool:
+                    self.pool = None
+                raise CouldNotFinishCalculate(message)
+            return [future.result() for future in futures]
+        except BrokenProcessPool as e:
+            message = 'O processo do cálculo foi interrompido.'
+            logger.error(f'{message} ({e})')
+            raise CouldNotFinishCalculate(message)
+        finally:
+            if pool is not self.pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    def __create_pool(self, workers: int) -> ProcessPoolExecutor:
+        # the uwsgi workers run threads, forking them is not safe
+        context = multiprocessing.get_context('spawn')
+        context.set_executable(get_worker_executable())
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=initialize_worker,
+            initargs=(pickle.dumps(self.catalog),),
+        )
+
+    @staticmethod
+    def __terminate(pool: ProcessPoolExecutor):
+        '''
+        shuts the pool down with the calcs already running. ProcessPoolExecutor only cancels the
+        pending ones, the running ones are stopped through its private processes, when it has them
+        '''
+        processes = getattr(pool, '_processes', None)
+        processes = list(processes.values()) if isinstance(processes, dict) else []
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
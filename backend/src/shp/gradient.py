@@ -0,0 +1,268 @@
+import logging
+from collections import deque
+from typing import Dict
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import factorized
+
+from .constants import GRADIENT_MINIMUM_FLOW
+from .dataclasses import SolverPrecision
+from .exceptions import CouldNotFinishCalculate
+from .models import Config
+from .network import SHPNetwork
+from .solvers import safeguarded_newton
+
+logger = logging.getLogger(__name__)
+
+
+class GradientSolver():
+    '''
+    Global gradient method (Todini & Pilati) for the whole SHP network.
+
+    Every path reachable from the reservoir is a link. Active fixture paths are
+    links to the atmosphere, with the hose, nozzle and emitter losses added to
+    the losses of the path. The head loss of a link is
+
+        r * |Q|^0.85 * Q + e * |Q| * Q + static
+
+    Every Newton step solves one sparse symmetric system on the pressures of the
+    nodes, so the cost of a step grows linearly with the size of the network.
+
+    The nodes are the names of the ends of the paths, so looped networks, where
+    a node is the end of more than one path, are solved the same way. Their
+    flows can go against the direction of the path, and keep their sign.
+
+    `initial_flows`, by path, are the starting point of the first solution,
+    usually the flows of a previous calc of the network.
+    '''
+
+    precision: SolverPrecision = None
+
+    links: np.ndarray = None
+    emitters: np.ndarray = None
+    parents: np.ndarray = None
+    flows: np.ndarray = None
+    pressures: np.ndarray = None
+    heads: np.ndarray = None
+    looped: bool = None
+
+    def __init__(self, network: SHPNetwork, initial_flows: np.ndarray = None, precision: SolverPrecision = None):
+        self.network = network
+        self.precision = precision or SolverPrecision.for_mode(Config.PrecisionMode.FINAL)
+        self.looped = network.looped
+        links = []
+        parents = []
+        visited = {network.reservoir}
+        queue = deque([(network.reservoir, -1)])
+        while queue:
+            index, parent = queue.popleft()
+            if network.has_fixture[index] and not network.active[index]:
+                continue
+            links.append(index)
+            parents.append(parent)
+            for path_after in network.get_paths_after(index):
+                if path_after not in visited:
+                    visited.add(path_after)
+                    queue.append((path_after, len(links) - 1))
+
+        self.links = links = np.array(links, dtype=int)
+        self.parents = np.array(parents, dtype=int)
+        self.emitters = emitters = network.active[links]
+        self.r = network.resistances[links] * network.total_length[links] + np.where(
+            emitters,
+            network.hose_resistance * network.hose_length[links] +
+            network.inlet_resistances[links] * network.fixture_total_length[links],
+            0,
+        )
+        self.e = np.where(
+            emitters,
+            np.where(network.has_inlet[links], network.nozzle_coefficient, 0) + network.emitter_coefficient,
+            0,
+        )
+        self.static = (
+            network.level_difference[links] - network.head_lift[links] +
+            np.where(emitters, network.fixture_level_difference[links], 0)
+        )
+
+        count = len(links)
+        nodes: Dict[str, int] = {}
+        rows = []
+        columns = []
+        values = []
+        self.reservoir = np.zeros(count)
+        for link, index in enumerate(links.tolist()):
+            if index == network.reservoir:
+                self.reservoir[link] = 1
+            else:
+                rows.append(link)
+                columns.append(nodes.setdefault(network.starts[index], len(nodes)))
+                values.append(1)
+            if not emitters[link]:
+                rows.append(link)
+                columns.append(nodes.setdefault(network.ends[index] or f'#{index}', len(nodes)))
+                values.append(-1)
+
+        self.incidence = sparse.csr_matrix((values, (rows, columns)), shape=(count, len(nodes)))
+        self.minimum_derivative = self.__get_derivative(np.full(count, GRADIENT_MINIMUM_FLOW))
+        self.closed = np.zeros(count, dtype=bool)
+        if initial_flows is not None:
+            self.flows = initial_flows[links]
+        else:
+            self.flows = self.__get_initial_flows(network.fixture.minimum_flow_rate_in_m3_p_s)
+        self.pressures = np.zeros(len(nodes))
+        self.heads = np.zeros(count)
+        self.conductances = np.zeros(count)
+        self.__solve_linear = None
+
+    def __get_initial_flows(self, fixture_flow: float) -> np.ndarray:
+        '''
+        every active fixture with `fixture_flow` and the paths with the sum of the flows after them,
+        in a looped network only the paths of the spanning tree of `parents` have flow
+        '''
+        flows = np.where(self.emitters, fixture_flow, 0.0)
+        for index in range(len(self.links) - 1, 0, -1):
+            flows[self.parents[index]] += flows[index]
+        return flows
+
+    def __get_loss(self, flows: np.ndarray) -> np.ndarray:
+        absolute = np.abs(flows)
+        return self.r * np.power(absolute, 0.85) * flows + self.e * absolute * flows + self.static
+
+    def __get_derivative(self, flows: np.ndarray) -> np.ndarray:
+        absolute = np.abs(flows)
+        return 1.85 * self.r * np.power(absolute, 0.85) + 2 * self.e * absolute
+
+    def get_lower_start_pressure(self, fixture_flow: float) -> float:
+        '''
+        start pressure for every active fixture to have exactly `fixture_flow`,
+        a lower bound of the start pressure that gives at least `fixture_flow` to all of them.
+
+        In a looped network the flows split between the paths of a loop, so it is only
+        the starting point of the search
+        '''
+        flows = self.__get_initial_flows(fixture_flow)
+        loss = self.__get_loss(flows)
+        # the pressure at the end of every link, the fixtures need none and the other links the most
+        # of the links after them, which can be negative below the reservoir
+        required = np.where(self.emitters, 0.0, -np.inf)
+        for index in range(len(self.links) - 1, 0, -1):
+            parent = self.parents[index]
+            required[parent] = max(required[parent], loss[index] + required[index])
+        if not np.isfinite(required[0]):
+            return float(loss[0])
+        return float(loss[0] + required[0])
+
+    def solve(self, start_pressure: float) -> int:
+        '''
+        solves the flows of every link with `start_pressure` in the reservoir,
+        starting from the flows of the last solution
+
+        returns the number of iterations
+        '''
+        fixed = self.reservoir * start_pressure
+        flows = self.flows
+        precision = self.precision
+        for iteration in range(precision.max_iterations):
+            conductances = 1 / np.maximum(self.__get_derivative(flows), self.minimum_derivative)
+            conductances[self.closed] = 0
+            loss = self.__get_loss(flows)
+
+            matrix = (self.incidence.T @ sparse.diags(conductances) @ self.incidence).tocsc()
+            self.__solve_linear = factorized(matrix)
+            self.pressures = self.__solve_linear(-(self.incidence.T @ (flows + conductances * (fixed - loss))))
+            head = self.incidence @ self.pressures + fixed
+            new_flows = flows + conductances * (head - loss)
+
+            # the fixtures don't take flow back from the atmosphere
+            closed = self.emitters & np.where(self.closed, head <= self.static, new_flows <= 0)
+            new_flows[closed] = 0
+            tolerance = precision.flow_tolerance * max(1, np.max(np.abs(new_flows)))
+            converged = np.array_equal(closed, self.closed) and np.max(np.abs(new_flows - flows)) <= tolerance
+            self.closed = closed
+            flows = new_flows
+            if converged or (precision.best_effort and iteration == precision.max_iterations - 1):
+                break
+        else:
+            message = 'Não foi possivel calcular a rede pelo método do gradiente.'
+            logger.error(message)
+            raise CouldNotFinishCalculate(message)
+
+        self.flows = flows
+        self.heads = head
+        self.conductances = conductances
+        return iteration
+
+    def get_heads_sensitivity(self) -> np.ndarray:
+        '''
+        derivative of the head (start minus end pressure) of every link by the start
+        pressure of the reservoir, in the last solution
+        '''
+        pressures = self.__solve_linear(-(self.incidence.T @ (self.conductances * self.reservoir)))
+        return self.incidence @ pressures + self.reservoir
+
+    def solve_required_pressure(self, fixture_flow: float) -> float:
+        '''
+        finds the start pressure of the reservoir where the active fixture with less flow has `fixture_flow`.
+
+        The fixtures are compared by the head left over the head they need for `fixture_flow`,
+        which keeps a derivative even for the fixtures without flow.
+
+        returns the start pressure
+        '''
+        required_heads = self.__get_loss(np.full(len(self.links), fixture_flow))
+
+        def residual(start_pressure: float):
+            self.solve(start_pressure)
+            surplus = np.where(self.emitters, self.heads - required_heads, np.inf)
+            index = int(np.argmin(surplus))
+            return surplus[index], self.get_heads_sensitivity()[index]
+
+        tolerance = self.precision.pressure_tolerance
+        pressure = self.get_lower_start_pressure(fixture_flow)
+        value, derivative = residual(pressure)
+        if abs(value) <= tolerance:
+            return pressure
+
+        # the search goes up from the lower bound, or down from it when the split of the flows
+        # of a loop, or the fixtures closed at the bound, leave head over the required
+        direction = 1 if value < 0 else -1
+        for i in range(self.precision.max_iterations):
+            # at most doubles the start pressure on every step
+            step = min(abs(value) / derivative if derivative > 0 else np.inf, max(abs(pressure), 1))
+            (last_pressure, pressure) = (pressure, pressure + 2 * step * direction)
+            value, derivative = residual(pressure)
+            if value * direction >= 0:
+                break
+        else:
+            message = 'Não foi possivel calcular a pressão necessária pelo método do gradiente.'
+            logger.error(message)
+            raise CouldNotFinishCalculate(message)
+
+        (lower, upper) = sorted((last_pressure, pressure))
+        start_pressure, iterations = safeguarded_newton(
+            residual, lower, upper, initial=last_pressure + step * direction, tolerance=tolerance,
+            max_iterations=self.precision.max_iterations, best_effort=self.precision.best_effort,
+        )
+        if start_pressure is None:
+            message = 'Não foi possivel calcular a pressão necessária pelo método do gradiente.'
+            logger.error(message)
+            raise CouldNotFinishCalculate(message)
+        logger.debug(f'Found start pressure: {start_pressure}, in the {iterations} iteration')
+        return start_pressure
+
+    def has_flow(self) -> bool:
+        return bool(np.any(self.flows[self.emitters] > 0))
+
+    def write_flows(self):
+        '''
+        flow of every link, with the sign of its direction, and of the active fixtures
+        '''
+        flows = np.where(self.emitters, np.maximum(self.flows, 0), self.flows).tolist()
+        for link, index in enumerate(self.links.tolist()):
+            self.network.flow[index] = flows[link]
+        self.write_fixtures_flow()
+
+    def write_fixtures_flow(self):
+        for link in np.flatnonzero(self.emitters).tolist():
+            self.network.fixture_flow[self.links[link]] = max(float(self.flows[link]), 0)
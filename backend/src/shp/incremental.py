@@ -0,0 +1,133 @@
+import logging
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+from core.cache import get_cached_result
+
+from .dataclasses import SHPCalc, SHPCalcPath
+
+logger = logging.getLogger(__name__)
+
+
+def get_path_key(start: str, end: Union[str, None], fixture_end: Union[str, None]) -> Tuple:
+    '''
+    identifies the same path in two calcs of a network
+    '''
+    return (start, end, fixture_end)
+
+
+def get_path_signature(path: dict, path_before: Union[dict, None], count_paths_after: int) -> Tuple:
+    '''
+    everything the equivalent length and the connections of a path depend on, besides the catalog
+    '''
+    return (
+        path.get('material_id'),
+        path.get('diameter_id'),
+        float(path.get('extra_equivalent_length') or 0),
+        tuple(path.get('fittings_ids') or []),
+        path_before.get('material_id') if path_before else None,
+        path_before.get('diameter_id') if path_before else None,
+        count_paths_after,
+    )
+
+
+class PreviousCalc():
+    '''
+    Result of an earlier calc of the same network, sent back with the new input
+    or referenced by its key in the calc cache, to recalculate only what changed.
+
+    A path keeps the equivalent length and the connections of the previous calc
+    when it was calculated with the same catalog version and nothing they depend
+    on changed: its material, diameter and fittings, the path before it and the
+    number of paths after it. The flows and the less favorable fixture of the
+    previous calc are the starting point of the solvers.
+    '''
+
+    connections: Dict[Tuple, Tuple[float, List[str]]] = None
+    flows: Dict[Tuple, float] = None
+    less_favorable: Tuple = None
+
+    def __init__(self, data: dict, catalog_version: int):
+        paths: List[dict] = data.get('paths') or []
+        paths_by_start: Dict[str, int] = {}
+        paths_by_end: Dict[str, dict] = {}
+        for path in paths:
+            paths_by_start[path['start']] = paths_by_start.get(path['start'], 0) + 1
+            if path.get('end'):
+                paths_by_end.setdefault(path['end'], path)
+
+        self.connections = {}
+        self.flows = {}
+        for path in paths:
+            fixture = (path.get('has_fixture') and path.get('fixture')) or {}
+            key = get_path_key(path['start'], path.get('end'), fixture.get('end'))
+            self.flows[key] = float(path.get('flow') or 0)
+            if data.get('catalog_version') is None or data.get('catalog_version') != catalog_version:
+                continue
+            has_active_fixture = fixture.get('active')
+            count_paths_after = paths_by_start.get(path['end'], 0) if path.get('end') and not has_active_fixture else 0
+            signature = get_path_signature(path, paths_by_end.get(path['start']), count_paths_after)
+            self.connections[signature] = (
+                float(path.get('equivalent_length') or 0), list(path.get('connection_names') or [])
+            )
+
+        index = data.get('less_favorable_path_fixture_index')
+        if index is not None and 0 <= index < len(paths):
+            fixture = (paths[index].get('has_fixture') and paths[index].get('fixture')) or {}
+            self.less_favorable = get_path_key(paths[index]['start'], paths[index].get('end'), fixture.get('end'))
+
+    @classmethod
+    def load(cls, shpCalc: SHPCalc) -> Union['PreviousCalc', None]:
+        '''
+        the previous calc of `shpCalc`, if it has one and it is usable
+        '''
+        data = None
+        if shpCalc.previous_cache_key and shpCalc.previous_cache_key.startswith('shp:'):
+            data = get_cached_result(shpCalc.previous_cache_key)
+        if data is None:
+            data = shpCalc.previous_result
+        if not data:
+            return None
+        try:
+            return cls(data, shpCalc.catalog_version)
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            logger.warning(f'Ignoring the previous calc: {e}')
+            return None
+
+    def get_connections(self,
+                        path: SHPCalcPath,
+                        path_before: Union[SHPCalcPath, None],
+                        count_paths_after: int) -> Union[Tuple[float, List[str]], None]:
+        '''
+        (equivalent_length, connection_names) of the path in the previous calc, if they are still valid
+        '''
+        signature = get_path_signature(vars(path), vars(path_before) if path_before else None, count_paths_after)
+        connections = self.connections.get(signature)
+        if connections is None:
+            return None
+        return (connections[0], list(connections[1]))
+
+    def get_flows(self, paths: List[SHPCalcPath]) -> Union[np.ndarray, None]:
+        '''
+        flow of every path in the previous calc, zero for the new ones
+        '''
+        flows = [self.flows.get(self.get_key(path)) for path in paths]
+        if all(flow is None for flow in flows):
+            return None
+        return np.array([flow or 0 for flow in flows], dtype=float)
+
+    def get_less_favorable(self, paths: List[SHPCalcPath]) -> Union[int, None]:
+        '''
+        position of the less favorable fixture of the previous calc
+        '''
+        if self.less_favorable is None:
+            return None
+        for position, path in enumerate(paths):
+            if path.has_active_fixture and self.get_key(path) == self.less_favorable:
+                return position
+        return None
+
+    @staticmethod
+    def get_key(path: SHPCalcPath) -> Tuple:
+        return get_path_key(path.start, path.end, path.fixture.end if path.has_fixture and path.fixture else None)
@@ -16,6 +16,14 @@ class Config(models.Model):
         GRAVITACIONAL = 'GR', 'Gravitacional'
         BOMBA = 'BO', 'Bomba'
 
+    class SolverType(models.TextChoices):
+        ITERATIVO = 'IT', 'Iterativo'
+        GRADIENTE = 'GG', 'Gradiente global'
+
+    class PrecisionMode(models.TextChoices):
+        FINAL = 'final', 'Final'
+        PREVIEW = 'preview', 'Prévia'
+
     material = models.ForeignKey('Material', default=None, null=True, blank=True,
                                  on_delete=models.SET_NULL, verbose_name='Material padrão')
     fixture = models.ForeignKey('Fixture', default=None, null=True, blank=True,
@@ -234,6 +242,26 @@ class Fixture(models.Model):
     def minimum_flow_rate_in_m3_p_s(self) -> float:
         return float(self.minimum_flow_rate)/float(60000)
 
+    @property
+    def emitter_coefficient(self) -> float:
+        '''
+        coefficient `c` of `flow_to_pressure`, pressure = c * flow²
+        '''
+        if self.k_factor:
+            return math.pow(float(60000)/float(self.k_factor), 2)
+        if self.outlet_diameter:
+            return 1 / (math.pow(self.area, 2) * 2 * GRAVITY * math.pow(0.97, 2))  # Cd = 0.97
+        return 0
+
+    @property
+    def nozzle_coefficient(self) -> float:
+        '''
+        coefficient `c` of `get_fixture_pressure_drop`, pressure drop = c * flow²
+        '''
+        if self.outlet_diameter:
+            return float(self.k_nozzle) / (math.pow(self.area, 2) * 2 * GRAVITY)
+        return 0
+
     def flow_to_pressure(self, flow: float) -> float:
         '''
         converts from flow in m³/s to pressure in m.c.a.
@@ -247,6 +275,15 @@ class Fixture(models.Model):
                 return math.pow(speed, 2) / (2 * GRAVITY * math.pow(0.97, 2))  # Cd = 0.97
         return None
 
+    def flow_to_pressure_derivative(self, flow: float) -> float:
+        '''
+        derivative of `flow_to_pressure` by the flow, in m.c.a./(m³/s)
+        '''
+        pressure = self.flow_to_pressure(flow)
+        if pressure:
+            return 2 * pressure / flow
+        return 0
+
     def pressure_to_flow(self, pressure: float) -> Union[float, None]:
         '''
         converts from pressure m.c.a. to flow in m³/s
@@ -0,0 +1,398 @@
+import math
+from collections import deque
+from typing import List
+
+import numpy as np
+
+from .dataclasses import SHPCalc
+from .models import Fixture
+from .topology import SHPTopology
+from .utils import get_pressure_drop_coefficient, get_speeds, get_unit_pressure_drops
+
+
+class SHPNetwork():
+    '''
+    Compiled representation of a SHPCalc, where every path is an index (its
+    position in `shpCalc.paths`).
+
+    The parameters of the paths and of the fixtures live in NumPy arrays, used by
+    the vectorized passes and by the gradient solver. The iterative solver changes
+    one path at a time, and NumPy is several times slower than lists for scalar
+    access, so the solution lives in lists of floats. The dataclasses only receive
+    the results in `write_back`, before the serialization.
+
+    A network is `looped` when a node is the end of more than one path reachable
+    from the reservoir, like a ring main. Only the gradient solver calculates it,
+    and the path before of every path is the one that reaches it first from the
+    reservoir, so the passes follow a spanning tree of the network.
+    '''
+
+    count: int = None
+    reservoir: int = None
+    pump: int = None
+    starts: List[str] = None
+    ends: List[str] = None
+    order: np.ndarray = None
+    parents: np.ndarray = None
+    child_offsets: np.ndarray = None
+    children: np.ndarray = None
+    looped: bool = None
+
+    def __init__(self, shpCalc: SHPCalc, fixture: Fixture, topology: SHPTopology):
+        paths = shpCalc.paths
+        self.shpCalc = shpCalc
+        self.fixture = fixture
+        self.count = len(paths)
+        self.reservoir = topology.position(shpCalc.reservoir_path)
+        self.pump = topology.position(shpCalc.pump_path) if shpCalc.pump_path else -1
+        self.starts = [path.start for path in paths]
+        self.ends = [path.end for path in paths]
+
+        # topology
+        children = [[topology.position(path_after) for path_after in topology.children[index]]
+                    for index in range(self.count)]
+        self.parents = np.array(
+            [topology.position(parent) if parent is not None else -1 for parent in topology.parents], dtype=int
+        )
+        self.child_offsets = np.zeros(self.count + 1, dtype=int)
+        self.child_offsets[1:] = np.cumsum([len(paths_after) for paths_after in children])
+        self.children = np.array([index for paths_after in children for index in paths_after], dtype=int)
+        order = []
+        visited = {self.reservoir}
+        inlets = {}
+        queue = deque([self.reservoir])
+        while queue:
+            index = queue.popleft()
+            order.append(index)
+            if self.ends[index] and not paths[index].has_active_fixture:
+                inlets[self.ends[index]] = inlets.get(self.ends[index], 0) + 1
+            for child in children[index]:
+                if child not in visited:
+                    visited.add(child)
+                    self.parents[child] = index
+                    queue.append(child)
+        self.order = np.array(order, dtype=int)
+        self.looped = any(count > 1 for count in inlets.values())
+
+        # paths
+        self.length = np.array([path.length for path in paths], dtype=float)
+        self.level_difference = np.array([path.level_difference for path in paths], dtype=float)
+        self.equivalent_length = np.array([path.equivalent_length for path in paths], dtype=float)
+        self.total_length = np.array([path.total_length for path in paths], dtype=float)
+        self.head_lift = np.array([path.head_lift for path in paths], dtype=float)
+        self.coefficients = np.array([path.material.hazen_williams_coefficient for path in paths], dtype=float)
+        self.diameters = np.array([path.diameter.internal_diameter for path in paths], dtype=float)
+        self.resistances = np.array([
+            get_pressure_drop_coefficient(path.material.hazen_williams_coefficient, path.diameter.internal_diameter)
+            for path in paths
+        ])
+
+        # fixtures
+        self.has_fixture = np.array([path.has_fixture for path in paths], dtype=bool)
+        self.active = np.array([path.has_active_fixture for path in paths], dtype=bool)
+        self.has_inlet = np.array([
+            bool(path.has_fixture and path.fixture.inlet_material and path.fixture.inlet_diameter) for path in paths
+        ], dtype=bool)
+        self.hose_length = np.array([path.fixture.hose_length if path.has_fixture else 0 for path in paths],
+                                    dtype=float)
+        self.fixture_level_difference = np.array(
+            [path.fixture.level_difference if path.has_fixture else 0 for path in paths], dtype=float
+        )
+        self.fixture_total_length = np.array(
+            [path.fixture.total_length if path.has_fixture else 0 for path in paths], dtype=float
+        )
+        self.inlet_coefficients = np.array([
+            path.fixture.inlet_material.hazen_williams_coefficient if self.has_inlet[index] else 0
+            for index, path in enumerate(paths)
+        ], dtype=float)
+        self.inlet_diameters = np.array([
+            path.fixture.inlet_diameter.internal_diameter if self.has_inlet[index] else 0
+            for index, path in enumerate(paths)
+        ], dtype=float)
+        self.inlet_resistances = np.array([
+            get_pressure_drop_coefficient(self.inlet_coefficients[index], self.inlet_diameters[index])
+            for index in range(self.count)
+        ])
+        if fixture.k_factor_includes_hose:
+            self.hose_resistance = 0
+        else:
+            self.hose_resistance = get_pressure_drop_coefficient(
+                fixture.hose_hazen_williams_coefficient, fixture.hose_internal_diameter
+            )
+        self.nozzle_coefficient = fixture.nozzle_coefficient
+        self.emitter_coefficient = fixture.emitter_coefficient
+        self.active_fixtures = np.flatnonzero(self.active)
+
+        # the scalar kernels read the parameters from lists
+        self.__children = children
+        self.__parents = self.parents.tolist()
+        self.__level_difference = self.level_difference.tolist()
+        self.__total_length = self.total_length.tolist()
+        self.__head_lift = self.head_lift.tolist()
+        self.__resistances = self.resistances.tolist()
+        self.__has_fixture = self.has_fixture.tolist()
+        self.__active = self.active.tolist()
+        self.__has_inlet = self.has_inlet.tolist()
+        self.__hose_length = self.hose_length.tolist()
+        self.__fixture_level_difference = self.fixture_level_difference.tolist()
+        self.__fixture_total_length = self.fixture_total_length.tolist()
+        self.__inlet_resistances = self.inlet_resistances.tolist()
+
+        # solution
+        self.flow = [path.flow for path in paths]
+        self.speed = [path.speed for path in paths]
+        self.start_pressure = [path.start_pressure for path in paths]
+        self.end_pressure = [path.end_pressure for path in paths]
+        self.pressure_drop = [path.pressure_drop for path in paths]
+        self.unit_pressure_drop = [path.unit_pressure_drop for path in paths]
+        self.fixture_flow = [path.fixture.flow if path.has_fixture else 0 for path in paths]
+        self.fixture_start_pressure = [path.fixture.start_pressure if path.has_fixture else 0 for path in paths]
+        self.fixture_middle_pressure = [path.fixture.middle_pressure if path.has_fixture else 0 for path in paths]
+        self.fixture_end_pressure = [path.fixture.end_pressure if path.has_fixture else 0 for path in paths]
+        self.fixture_hose_pressure_drop = [
+            path.fixture.hose_pressure_drop if path.has_fixture else 0 for path in paths
+        ]
+        self.fixture_unit_hose_pressure_drop = [
+            path.fixture.unit_hose_pressure_drop if path.has_fixture else 0 for path in paths
+        ]
+        self.fixture_nozzle_pressure_drop = [
+            path.fixture.nozzle_pressure_drop if path.has_fixture else 0 for path in paths
+        ]
+        self.fixture_pressure_drop = [path.fixture.pressure_drop if path.has_fixture else 0 for path in paths]
+        self.fixture_unit_pressure_drop = [
+            path.fixture.unit_pressure_drop if path.has_fixture else 0 for path in paths
+        ]
+
+    def path_name(self, index: int) -> str:
+        return str(self.shpCalc.paths[index])
+
+    def is_fixture(self, index: int) -> bool:
+        return self.__has_fixture[index]
+
+    def is_active_fixture(self, index: int) -> bool:
+        return self.__active[index]
+
+    def get_path_before(self, index: int) -> int:
+        return self.__parents[index]
+
+    def get_paths_after(self, index: int) -> List[int]:
+        return self.__children[index]
+
+    def set_level_difference(self, index: int, level_difference: float):
+        self.level_difference[index] = level_difference
+        self.__level_difference[index] = level_difference
+
+    def set_total_length(self, index: int, total_length: float):
+        self.total_length[index] = total_length
+        self.__total_length[index] = total_length
+
+    def set_head_lift(self, index: int, head_lift: float):
+        self.head_lift[index] = head_lift
+        self.__head_lift[index] = head_lift
+
+    def update_reservoir_total_length(self):
+        '''
+        the height of the reservoir is part of the length of its path
+        '''
+        self.set_total_length(self.reservoir, (
+            self.length[self.reservoir] +
+            self.equivalent_length[self.reservoir] +
+            abs(self.level_difference[self.reservoir])
+        ))
+
+    def get_fixture_demands(self, fixture_flow: float) -> np.ndarray:
+        '''
+        start pressure of the reservoir for every active fixture alone to have `fixture_flow`,
+        with the other fixtures closed, `inf` for the other paths.
+
+        The other fixtures only add flow, and pressure drop, to the paths they share,
+        so the demand of a fixture is a lower bound of the start pressure it needs in the network
+        '''
+        power = math.pow(fixture_flow, 1.85) if fixture_flow else 0
+        losses = self.resistances * power * self.total_length + self.level_difference - self.head_lift
+        demands = np.zeros(self.count)
+        for index in self.order.tolist():
+            parent = self.__parents[index]
+            demands[index] = losses[index] + (demands[parent] if index != self.reservoir else 0)
+        fixture_losses = (
+            self.hose_resistance * power * self.hose_length + self.fixture_level_difference +
+            np.where(
+                self.has_inlet,
+                self.inlet_resistances * power * self.fixture_total_length +
+                (self.nozzle_coefficient * fixture_flow * fixture_flow if fixture_flow > 0 else 0),
+                0,
+            ) +
+            (self.fixture.flow_to_pressure(fixture_flow) or 0)
+        )
+        reachable = np.zeros(self.count, dtype=bool)
+        reachable[self.order] = True
+        return np.where(self.active & reachable, demands + fixture_losses, np.inf)
+
+    # scalar kernels, the same of SHPCalcPath and SHPCalcFixture
+
+    def calculate_pressure_drop(self, index: int, flow: float):
+        self.flow[index] = flow
+        unit_pressure_drop = self.__resistances[index] * math.pow(flow, 1.85) if flow else 0
+        self.unit_pressure_drop[index] = unit_pressure_drop
+        self.pressure_drop[index] = unit_pressure_drop * self.__total_length[index]
+
+    def calculate_start_pressure(self, index: int, end_pressure: float):
+        self.end_pressure[index] = end_pressure
+        self.start_pressure[index] = (
+            end_pressure + self.pressure_drop[index] + self.__level_difference[index] - self.__head_lift[index]
+        )
+
+    def calculate_end_pressure(self, index: int, start_pressure: float):
+        self.start_pressure[index] = start_pressure
+        self.end_pressure[index] = (
+            start_pressure - self.pressure_drop[index] - self.__level_difference[index] + self.__head_lift[index]
+        )
+
+    def get_pressure_drop_derivative(self, index: int) -> float:
+        '''
+        derivative of the pressure drop of the path by the flow
+        '''
+        flow = self.flow[index]
+        if flow:
+            return 1.85 * self.pressure_drop[index] / flow
+        return 0
+
+    def calculate_fixture_pressure_drop(self, index: int, flow: float):
+        self.fixture_flow[index] = flow
+        unit_hose_pressure_drop = self.hose_resistance * math.pow(flow, 1.85) if flow else 0
+        self.fixture_unit_hose_pressure_drop[index] = unit_hose_pressure_drop
+        self.fixture_hose_pressure_drop[index] = unit_hose_pressure_drop * self.__hose_length[index]
+        if self.__has_inlet[index]:
+            unit_pressure_drop = self.__inlet_resistances[index] * math.pow(flow, 1.85) if flow else 0
+            self.fixture_unit_pressure_drop[index] = unit_pressure_drop
+            self.fixture_nozzle_pressure_drop[index] = self.nozzle_coefficient * flow * flow if flow > 0 else 0
+            self.fixture_pressure_drop[index] = unit_pressure_drop * self.__fixture_total_length[index]
+
+    def calculate_fixture_start_pressure(self, index: int, end_pressure: float):
+        self.fixture_end_pressure[index] = end_pressure
+        self.fixture_middle_pressure[index] = (
+            end_pressure +
+            self.fixture_hose_pressure_drop[index] +
+            self.fixture_nozzle_pressure_drop[index] +
+            self.__fixture_level_difference[index]
+        )
+        self.fixture_start_pressure[index] = self.fixture_middle_pressure[index] + self.fixture_pressure_drop[index]
+
+    def calculate_fixture_end_pressure(self, index: int, start_pressure: float):
+        self.fixture_start_pressure[index] = start_pressure
+        self.fixture_middle_pressure[index] = start_pressure - self.fixture_pressure_drop[index]
+        self.fixture_end_pressure[index] = (
+            self.fixture_middle_pressure[index] -
+            self.fixture_hose_pressure_drop[index] -
+            self.fixture_nozzle_pressure_drop[index] -
+            self.__fixture_level_difference[index]
+        )
+
+    def get_fixture_pressure_drop_derivative(self, index: int) -> float:
+        '''
+        derivative of the hose, nozzle and inlet pressure drops of the fixture by the flow
+        '''
+        flow = self.fixture_flow[index]
+        if not flow:
+            return 0
+        derivative = 1.85 * self.fixture_hose_pressure_drop[index] / flow
+        if self.__has_inlet[index]:
+            derivative += (
+                1.85 * self.fixture_pressure_drop[index] / flow +
+                2 * self.fixture_nozzle_pressure_drop[index] / flow
+            )
+        return derivative
+
+    # passes over the whole network
+
+    def clean(self):
+        '''
+        zeroes the pressures, flows and pressure drops of the paths and active fixtures
+        '''
+        self.start_pressure = [0.0] * self.count
+        self.end_pressure = [0.0] * self.count
+        self.flow = [0.0] * self.count
+        self.pressure_drop = [0.0] * self.count
+        for index in self.active_fixtures.tolist():
+            self.fixture_start_pressure[index] = 0
+            self.fixture_middle_pressure[index] = 0
+            self.fixture_end_pressure[index] = 0
+            self.fixture_flow[index] = 0
+            self.fixture_nozzle_pressure_drop[index] = 0
+            self.fixture_hose_pressure_drop[index] = 0
+
+    def sum_flows(self):
+        '''
+        flow of every path reachable from the reservoir, from the flows of the active fixtures,
+        in a network without loops
+        '''
+        for index in reversed(self.order.tolist()):
+            if self.__active[index]:
+                self.flow[index] = self.fixture_flow[index]
+            else:
+                self.flow[index] = sum(self.flow[path_after] for path_after in self.__children[index])
+
+    def calculate_pressure_drops(self):
+        flows = np.array(self.flow, dtype=float)
+        unit_pressure_drops = get_unit_pressure_drops(flows, self.coefficients, self.diameters)
+        self.unit_pressure_drop = unit_pressure_drops.tolist()
+        self.pressure_drop = (unit_pressure_drops * self.total_length).tolist()
+
+        flows = np.where(self.has_fixture, self.fixture_flow, 0)
+        unit_hose_pressure_drops = self.hose_resistance * np.power(flows, 1.85)
+        self.fixture_unit_hose_pressure_drop = np.where(
+            self.has_fixture, unit_hose_pressure_drops, self.fixture_unit_hose_pressure_drop
+        ).tolist()
+        self.fixture_hose_pressure_drop = np.where(
+            self.has_fixture, unit_hose_pressure_drops * self.hose_length, self.fixture_hose_pressure_drop
+        ).tolist()
+        unit_pressure_drops = get_unit_pressure_drops(flows, self.inlet_coefficients, self.inlet_diameters)
+        nozzle_pressure_drops = np.where(flows > 0, self.nozzle_coefficient * np.square(flows), 0)
+        self.fixture_unit_pressure_drop = np.where(
+            self.has_inlet, unit_pressure_drops, self.fixture_unit_pressure_drop
+        ).tolist()
+        self.fixture_nozzle_pressure_drop = np.where(
+            self.has_inlet, nozzle_pressure_drops, self.fixture_nozzle_pressure_drop
+        ).tolist()
+        self.fixture_pressure_drop = np.where(
+            self.has_inlet, unit_pressure_drops * self.fixture_total_length, self.fixture_pressure_drop
+        ).tolist()
+
+    def calculate_pressures(self):
+        '''
+        pressures of every path reachable from the reservoir, from the start pressure of the reservoir
+        '''
+        for index in self.order.tolist():
+            if index != self.reservoir:
+                self.start_pressure[index] = self.end_pressure[self.__parents[index]]
+            self.calculate_end_pressure(index, self.start_pressure[index])
+            if self.__has_fixture[index]:
+                self.calculate_fixture_end_pressure(index, self.end_pressure[index])
+
+    def calculate_speeds(self):
+        self.speed = get_speeds(self.flow, self.diameters).tolist()
+
+    def write_back(self):
+        '''
+        copies the solution to the dataclasses of the calc
+        '''
+        for index, path in enumerate(self.shpCalc.paths):
+            path.flow = self.flow[index]
+            path.speed = self.speed[index]
+            path.level_difference = float(self.level_difference[index])
+            path.total_length = float(self.total_length[index])
+            path.head_lift = float(self.head_lift[index])
+            path.start_pressure = self.start_pressure[index]
+            path.end_pressure = self.end_pressure[index]
+            path.pressure_drop = self.pressure_drop[index]
+            path.unit_pressure_drop = self.unit_pressure_drop[index]
+            if path.has_fixture:
+                path.fixture.flow = self.fixture_flow[index]
+                path.fixture.start_pressure = self.fixture_start_pressure[index]
+                path.fixture.middle_pressure = self.fixture_middle_pressure[index]
+                path.fixture.end_pressure = self.fixture_end_pressure[index]
+                path.fixture.hose_pressure_drop = self.fixture_hose_pressure_drop[index]
+                path.fixture.unit_hose_pressure_drop = self.fixture_unit_hose_pressure_drop[index]
+                path.fixture.nozzle_pressure_drop = self.fixture_nozzle_pressure_drop[index]
+                path.fixture.pressure_drop = self.fixture_pressure_drop[index]
+                path.fixture.unit_pressure_drop = self.fixture_unit_pressure_drop[index]
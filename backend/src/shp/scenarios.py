@@ -0,0 +1,461 @@
+import copy
+import logging
+import math
+from itertools import combinations
+from typing import Iterable, List, Set, Tuple
+
+import numpy as np
+from rest_framework import status
+
+from .calculate import SHP, get_batch_error
+from .catalog import CatalogSnapshot
+from .constants import (FLOW_TOLERANCE, MAX_ITERATIONS, PRESSURE_TOLERANCE, SCENARIO_BATCH_SIZE,
+                        SCENARIO_MAX_EVALUATIONS)
+from .exceptions import CouldNotFinishCalculate, NoInitialDataError
+from .executor import CalculationExecutor
+from .gradient import GradientSolver
+from .models import Config
+from .network import SHPNetwork
+from .serializers import SHPCalcSerializer
+
+logger = logging.getLogger(__name__)
+
+
+def calculate_scenario(catalog: CatalogSnapshot, data: dict) -> dict:
+    '''
+    calculates the minimum flow of one combination of active fixtures.
+
+    returns the `status` and the required `head`, or the `detail` of the error
+    '''
+    try:
+        shp = SHP(data, catalog)
+        shp.calculate()
+    except Exception as e:
+        return get_batch_error(e)
+    return {'status': status.HTTP_200_OK, 'head': shp.get_required_head()}
+
+
+class ScenarioSearch():
+    '''
+    Worst combination of `simultaneous_fixtures` fixtures working together, the one
+    that needs the highest reservoir, or pump head, for every one of them to have
+    the minimum flow. The candidates are the fixture paths without an end.
+
+    A combination needs at most the worst head already found, the threshold, when
+    every fixture of it has the minimum flow with the threshold in the reservoir.
+    In a tree closing a fixture only raises the flows of the others, so the flow of
+    a fixture with some of the others open is at most its flow with fewer of them.
+    The combinations are searched by branch and bound, in the order of the demand
+    of every fixture alone: the flows of the fixtures already in the combination,
+    with each one of the candidates left, bound the flows of the paths, and the
+    candidates that still have the minimum flow with them are left out.
+
+    The flows with the threshold in the reservoir come from small Newton solves
+    on the fixtures open only, the nodes of the search solved in batches, where the
+    losses of the links shared by the routes of every two candidates are a single
+    resistance. The combinations left are calculated in rounds, in parallel by the
+    CalculationExecutor, starting by a local search from the fixtures of highest demand.
+
+    In a looped network the flows can change direction, so every combination is calculated.
+    '''
+
+    data: dict = None
+    catalog: CatalogSnapshot = None
+    count: int = None
+    pressure_type: str = None
+    candidates: List[int] = None
+    looped: bool = None
+    minimum_flow: float = None
+
+    # static head of every candidate, and the coefficients of the losses of its path
+    fixture_heads: np.ndarray = None
+    fixture_resistances: np.ndarray = None
+    fixture_coefficients: np.ndarray = None
+    # demand of every candidate alone, and its part from the candidate path with the minimum flow
+    demands: np.ndarray = None
+    bases: np.ndarray = None
+    # 1 for the links (rows) before every candidate (columns), and the resistances of the links
+    routes: np.ndarray = None
+    resistances: np.ndarray = None
+    reservoir_resistance: float = None
+    reservoir_length: float = None
+    # resistance of the links shared by the routes of every two candidates
+    shared: np.ndarray = None
+
+    threshold: float = None
+    maximum_flows: np.ndarray = None
+    worst_head: float = None
+    worst: Tuple[int, ...] = None
+    evaluated: Set[Tuple[int, ...]] = None
+
+    def __init__(self, data, catalog: CatalogSnapshot = None):
+        if not data:
+            raise NoInitialDataError()
+        self.data = copy.deepcopy(data)
+        self.catalog = catalog
+        self.candidates = [
+            position for (position, path) in enumerate(self.data.get('paths') or [])
+            if path.get('has_fixture') and path.get('fixture')
+        ]
+
+    def calculate(self) -> SHPCalcSerializer:
+        shp = SHP(self.get_data(self.candidates), self.catalog)
+        self.count = shp.shpCalc.simultaneous_fixtures
+        self.pressure_type = shp.shpCalc.pressure_type
+        if shp.shpCalc.calc_type != Config.CalcType.VAZAO_MINIMA:
+            message = 'A busca da pior combinação de hidrantes só é feita no cálculo de vazão mínima.'
+            logger.error(message)
+            raise CouldNotFinishCalculate(message)
+        if not self.count or self.count > len(self.candidates):
+            message = f'O número de hidrantes simultâneos deve estar entre 1 e {len(self.candidates)}.'
+            logger.error(message)
+            raise CouldNotFinishCalculate(message)
+
+        network = shp.get_network()
+        self.catalog = shp.catalog
+        self.__prepare_bounds(network, shp.fixture.minimum_flow_rate_in_m3_p_s)
+        self.evaluated = set()
+
+        order = np.argsort(-self.demands, kind='stable').tolist()
+        if self.looped:
+            total = math.comb(len(order), self.count)
+            if total > SCENARIO_MAX_EVALUATIONS:
+                message = (
+                    f'Rede com malhas: {total} combinações de hidrantes para calcular, '
+                    f'o máximo é {SCENARIO_MAX_EVALUATIONS}.'
+                )
+                logger.error(message)
+                raise CouldNotFinishCalculate(message)
+
+        with CalculationExecutor(self.catalog) as executor:
+            size = max(executor.workers, 1)
+            self.__evaluate(executor, [tuple(sorted(order[:self.count]))])
+            if not self.looped:
+                self.__search_neighbors(executor, size)
+            pending = []
+            for combination in self.__get_combinations(order):
+                if combination in self.evaluated:
+                    continue
+                pending.append(combination)
+                if len(pending) >= size:
+                    self.__evaluate(executor, pending)
+                    pending = []
+            self.__evaluate(executor, pending)
+
+        logger.info(
+            f'Worst combination of {self.count} fixtures: {self.worst_head} m, '
+            f'{len(self.evaluated)} of {math.comb(len(order), self.count)} combinations calculated'
+        )
+        worst = [self.candidates[candidate] for candidate in self.worst]
+        shp = SHP(self.get_data(worst), self.catalog)
+        shp.shpCalc.evaluated_scenarios = len(self.evaluated)
+        return shp.calculate()
+
+    def get_data(self, active: Iterable[int]) -> dict:
+        '''
+        input of the calc with only the fixtures of the paths in `active` open
+        '''
+        active = set(active)
+        data = copy.deepcopy(self.data)
+        for position in self.candidates:
+            data['paths'][position]['fixture']['active'] = position in active
+        return data
+
+    def __prepare_bounds(self, network: SHPNetwork, minimum_flow: float):
+        '''
+        the static heads and the resistances of the paths to every candidate, from the links of the
+        gradient solver with every candidate open, as in the calc of the minimum flow: the reservoir
+        at the level of its path in a gravity system, where the height is the threshold, and at its
+        level before the pump, which the head of the pump includes
+        '''
+        self.looped = network.looped
+        self.minimum_flow = minimum_flow
+        if self.pressure_type == Config.PressureType.GRAVITACIONAL:
+            network.set_level_difference(network.reservoir, 0)
+        network.update_reservoir_total_length()
+        self.reservoir_resistance = float(network.resistances[network.reservoir])
+        self.reservoir_length = float(network.total_length[network.reservoir])
+        solver = GradientSolver(network)
+        parents = solver.parents.tolist()
+
+        links = np.flatnonzero(solver.emitters)
+        positions = solver.links[links].tolist()
+        # the candidates in the order of the emitters of the solver
+        links = links[[positions.index(position) for position in self.candidates]]
+
+        heads = solver.static.copy()
+        for link in range(1, len(parents)):
+            heads[link] += heads[parents[link]]
+        self.routes = np.zeros((len(parents), len(links)))
+        for (column, link) in enumerate(links.tolist()):
+            parent = parents[link]
+            while parent >= 0:
+                self.routes[parent, column] = 1
+                parent = parents[parent]
+        # the first link is the path of the reservoir
+        self.resistances = solver.r.copy()
+        self.fixture_heads = heads[links]
+        self.fixture_resistances = solver.r[links]
+        self.fixture_coefficients = solver.e[links]
+
+        power = math.pow(minimum_flow, 1.85)
+        self.bases = (
+            self.fixture_heads + self.fixture_resistances * power + self.fixture_coefficients * minimum_flow ** 2
+        )
+        self.demands = self.bases + self.routes.T @ (self.resistances * power)
+
+    def __get_maximum_flows(self) -> np.ndarray:
+        '''
+        flow of every candidate with the whole threshold at the start of its path, the most
+        it can have in any combination.
+
+        The losses are convex on the flow, so the Newton steps from the flow of the
+        largest loss alone only go down to the solution
+        '''
+        available = np.maximum(self.threshold - self.fixture_heads, 0)
+        resistances = self.fixture_resistances
+        coefficients = self.fixture_coefficients
+        with np.errstate(divide='ignore'):
+            flows = np.minimum(np.power(available / resistances, 1 / 1.85), np.sqrt(available / coefficients))
+        for _ in range(MAX_ITERATIONS):
+            powered = np.power(flows, 0.85)
+            derivatives = 1.85 * resistances * powered + 2 * coefficients * flows
+            steps = np.divide(
+                resistances * powered * flows + coefficients * flows * flows - available, derivatives,
+                out=np.zeros(len(flows)), where=derivatives > 0,
+            )
+            flows = flows - steps
+            if not (steps > FLOW_TOLERANCE).any():
+                break
+        return flows
+
+    def __solve_flows(self, fixtures: np.ndarray) -> np.ndarray:
+        '''
+        flows of the candidates of every row of `fixtures`, open together with the threshold
+        in the reservoir, `nan` in the rows without a solution.
+
+        The pressure drops of a tree only depend on the flows of the open fixtures, so every
+        row is a small Newton solve on their flows, all of them at once
+        '''
+        # a candidate without flow with the whole threshold has no solution, nor its rows
+        solvable = (self.maximum_flows[fixtures] > 0).all(axis=1)
+        solutions = np.full(fixtures.shape, np.nan)
+        if solvable.any():
+            solutions[solvable] = self.__solve_positive_flows(fixtures[solvable])
+        return solutions
+
+    def __solve_positive_flows(self, fixtures: np.ndarray) -> np.ndarray:
+        (rows, size) = fixtures.shape
+        segments = self.__get_segments(fixtures)
+        fixture_resistances = self.fixture_resistances[fixtures]
+        fixture_coefficients = self.fixture_coefficients[fixtures]
+        available = self.threshold - self.fixture_heads[fixtures]
+        maximum = self.maximum_flows[fixtures]
+        minimum = maximum * FLOW_TOLERANCE
+        flows = maximum.copy()
+        converged = np.zeros(rows, dtype=bool)
+        for _ in range(MAX_ITERATIONS):
+            (drops, jacobians) = self.__get_drops(segments, flows, True)
+            fixture_powered = np.power(flows, 0.85)
+            residuals = (
+                drops + fixture_resistances * fixture_powered * flows + fixture_coefficients * flows * flows - available
+            )
+            jacobians[:, np.arange(size), np.arange(size)] += (
+                1.85 * fixture_resistances * fixture_powered + 2 * fixture_coefficients * flows
+            )
+            steps = np.linalg.solve(jacobians, residuals[..., np.newaxis])[..., 0]
+            converged = np.abs(steps).max(axis=1) <= FLOW_TOLERANCE
+            flows = np.clip(flows - steps, minimum, maximum)
+            if converged.all():
+                break
+        return np.where(converged[:, np.newaxis], flows, np.nan)
+
+    def __get_segments(self, fixtures: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        the route of every candidate of every row of `fixtures` split where the routes of the others of
+        the row leave it, the candidates sorted by the resistance they share with it and the resistance
+        of every segment.
+
+        In a tree the links shared with another candidate are the first ones of the route, so the segment
+        of a candidate has the flows of it and of the candidates before in its order
+        '''
+        shared = self.shared[fixtures[:, :, np.newaxis], fixtures[:, np.newaxis, :]]
+        order = np.argsort(-shared, axis=2, kind='stable')
+        shared = np.take_along_axis(shared, order, axis=2)
+        resistances = shared - np.concatenate((shared[..., 1:], np.zeros(shared.shape[:-1] + (1,))), axis=2)
+        return (order, resistances)
+
+    def __get_drops(self, segments: Tuple[np.ndarray, np.ndarray], flows: np.ndarray,
+                    derivatives: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        pressure drops of the routes of the candidates with the `flows` of their rows, and their
+        derivatives by the flows of the row, when `derivatives`
+        '''
+        (order, resistances) = segments
+        sorted_flows = np.take_along_axis(np.broadcast_to(flows[:, np.newaxis, :], order.shape), order, axis=2)
+        segment_flows = np.cumsum(sorted_flows, axis=2)
+        powered = np.power(segment_flows, 0.85)
+        drops = (resistances * powered * segment_flows).sum(axis=2)
+        if not derivatives:
+            return (drops, None)
+        # the flow of a candidate passes by its segment and by the ones after it
+        weights = np.cumsum((1.85 * resistances * powered)[..., ::-1], axis=2)[..., ::-1]
+        jacobians = np.zeros(order.shape)
+        np.put_along_axis(jacobians, order, weights, axis=2)
+        return (drops, jacobians)
+
+    def __update_threshold(self):
+        '''
+        the worst head found, the start pressure that every combination left out needs at most.
+
+        The height of the reservoir is part of the length of its path, so its resistance
+        is the one of the reservoir at the threshold
+        '''
+        self.threshold = self.worst_head
+        if self.pressure_type == Config.PressureType.GRAVITACIONAL:
+            self.resistances[0] = self.reservoir_resistance * (self.reservoir_length + abs(self.threshold))
+        self.shared = self.routes.T @ (self.resistances[:, np.newaxis] * self.routes)
+        self.maximum_flows = self.__get_maximum_flows()
+
+    def __get_bounds(self, fixtures: np.ndarray, flows: np.ndarray) -> np.ndarray:
+        '''
+        start pressure enough for the candidates of every row of `fixtures` to have the minimum flow,
+        with the `flows` they have together, when it is not above the threshold
+        '''
+        (drops, _) = self.__get_drops(self.__get_segments(fixtures), np.nan_to_num(flows))
+        bounds = (self.bases[fixtures] + drops).max(axis=1)
+        return np.where(np.isnan(flows).any(axis=1), math.inf, bounds)
+
+    def __get_node_bounds(self, included: np.ndarray, nodes: np.ndarray, starts: np.ndarray,
+                          added: np.ndarray, solutions: np.ndarray) -> np.ndarray:
+        '''
+        start pressure enough for every combination of `count` candidates of every node of the search,
+        its `included` and the others from the ones left, when it is not above the threshold. The
+        `solutions` are the flows of the rows of the nodes, from `starts`, with one of the candidates left.
+
+        A candidate left has at most its flow open with only the `included`, and the `included`
+        have at most their largest flow with one of the candidates left
+        '''
+        size = included.shape[1]
+        unsolved = np.isnan(solutions).any(axis=1)
+        flows = np.tile(self.maximum_flows, (len(included), 1))
+        flows[nodes, added] = np.where(unsolved, flows[nodes, added], solutions[:, -1])
+        if size:
+            solved = np.flatnonzero(~np.logical_or.reduceat(unsolved, starts))
+            largest = np.maximum.reduceat(np.nan_to_num(solutions[:, :-1]), starts, axis=0)
+            flows[solved[:, np.newaxis], included[solved]] = largest[solved]
+        left = np.zeros(flows.shape, dtype=bool)
+        left[nodes, added] = True
+        chosen = np.zeros(flows.shape, dtype=bool)
+        chosen[np.arange(len(included))[:, np.newaxis], included] = True
+        left_flows = np.where(left, flows, 0)
+        most = np.sort(left_flows, axis=1)[:, size - self.count:].sum(axis=1)
+        path_flows = np.where(chosen, flows, 0) @ self.routes.T + np.minimum(
+            left_flows @ self.routes.T, most[:, np.newaxis]
+        )
+        drops = (self.resistances * np.power(path_flows, 1.85)) @ self.routes
+        return np.where(chosen | left, self.bases + drops, -np.inf).max(axis=1)
+
+    def __is_left_out(self, combination: Tuple[int, ...]) -> bool:
+        fixtures = np.array([combination])
+        bound = self.__get_bounds(fixtures, self.__solve_flows(fixtures))[0]
+        return bound <= self.threshold - PRESSURE_TOLERANCE
+
+    def __search_neighbors(self, executor: CalculationExecutor, size: int):
+        '''
+        local search from the worst combination found, to start the branch and bound with
+        a high threshold. The combinations with one fixture swapped that the bounds can't leave
+        out are calculated, the ones of highest bound first, while they find a worse combination
+        '''
+        while True:
+            worst = set(self.worst)
+            neighbors = []
+            for removed in self.worst:
+                for added in range(len(self.bases)):
+                    if added in worst:
+                        continue
+                    combination = tuple(sorted((worst - {removed}) | {added}))
+                    if combination not in self.evaluated:
+                        neighbors.append(combination)
+            if not neighbors:
+                return
+            fixtures = np.array(neighbors)
+            bounds = [
+                (bound, combination)
+                for (bound, combination) in zip(self.__get_bounds(fixtures, self.__solve_flows(fixtures)), neighbors)
+                if bound > self.threshold - PRESSURE_TOLERANCE
+            ]
+            if not bounds:
+                return
+            worst_head = self.worst_head
+            bounds.sort(reverse=True)
+            self.__evaluate(executor, [combination for (_, combination) in bounds[:size]])
+            if self.worst_head <= worst_head:
+                return
+
+    def __get_combinations(self, order: List[int]) -> Iterable[Tuple[int, ...]]:
+        '''
+        the combinations of `count` candidates that the bounds can't leave out, searched
+        depth first with the candidates of highest demand first.
+
+        A node of the search has the candidates included and the position in `order` after which
+        are the ones left. The nodes are bounded in batches, the flows of every node with each one
+        of the candidates left solved at once, and the rows of the nodes with all but one candidate
+        included are the combinations after them
+        '''
+        if self.looped:
+            yield from (tuple(sorted(combination)) for combination in combinations(order, self.count))
+            return
+        order = np.array(order, dtype=int)
+        stack = [(np.zeros((1, 0), dtype=int), np.zeros(1, dtype=int))]
+        while stack:
+            (included, positions) = stack.pop()
+            lefts = len(order) - positions
+            starts = np.cumsum(lefts) - lefts
+            nodes = np.repeat(np.arange(len(positions)), lefts)
+            rows = np.arange(len(nodes)) - starts[nodes] + positions[nodes]
+            fixtures = np.column_stack((included[nodes], order[rows]))
+            solutions = self.__solve_flows(fixtures)
+            if included.shape[1] == self.count - 1:
+                bounds = self.__get_bounds(fixtures, solutions)
+                for combination in fixtures[bounds > self.threshold - PRESSURE_TOLERANCE].tolist():
+                    yield tuple(sorted(combination))
+                continue
+
+            bounds = self.__get_node_bounds(included, nodes, starts, fixtures[:, -1], solutions)
+            # the nodes after the ones kept, with the candidate of the row included and enough left
+            children = np.flatnonzero(
+                (bounds[nodes] > self.threshold - PRESSURE_TOLERANCE) &
+                (len(order) - rows - 1 >= self.count - fixtures.shape[1])
+            )
+            batches = np.cumsum(len(order) - rows[children] - 1) // SCENARIO_BATCH_SIZE
+            for batch in reversed(np.unique(batches).tolist()):
+                kept = children[batches == batch]
+                stack.append((fixtures[kept], rows[kept] + 1))
+
+    def __evaluate(self, executor: CalculationExecutor, pending: List[Tuple[int, ...]]):
+        '''
+        calculates the combinations of `pending` still not left out by the bounds
+        '''
+        if not self.looped and self.worst is not None:
+            pending = [combination for combination in pending if not self.__is_left_out(combination)]
+        if not pending:
+            return
+        if len(self.evaluated) + len(pending) > SCENARIO_MAX_EVALUATIONS:
+            message = (
+                f'Mais de {SCENARIO_MAX_EVALUATIONS} combinações de hidrantes para calcular. '
+                'Diminua o número de hidrantes simultâneos.'
+            )
+            logger.error(message)
+            raise CouldNotFinishCalculate(message)
+
+        items = [self.get_data([self.candidates[candidate] for candidate in combination]) for combination in pending]
+        for (combination, result) in zip(pending, executor.map(calculate_scenario, items)):
+            self.evaluated.add(combination)
+            if result['status'] != status.HTTP_200_OK:
+                logger.error(f'Combination {combination}: {result["detail"]}')
+                raise CouldNotFinishCalculate(result['detail'])
+            if self.worst is None or result['head'] > self.worst_head:
+                (self.worst, self.worst_head) = (combination, result['head'])
+        if not self.looped:
+            self.__update_threshold()
@@ -186,6 +186,17 @@ class SHPCalcPumpSerializer(serializers.Serializer):
     NPSHd = serializers.FloatField(**custom_not_required)
 
 
+@ts_interface('shp')
+class SHPCalcSizingSerializer(serializers.Serializer):
+
+    material_id = serializers.IntegerField(required=True)
+    diameters_ids = serializers.ListField(child=serializers.IntegerField(), default=[], **custom_not_required)
+    max_head = serializers.FloatField(min_value=0, **custom_not_required)
+    max_speed = serializers.FloatField(min_value=0, **custom_not_required)
+    cost = serializers.FloatField(**custom_not_required)
+    evaluations = serializers.IntegerField(**custom_not_required)
+
+
 @ts_interface('shp')
 class SHPCalcSerializer(serializers.Serializer):
 
@@ -194,6 +205,12 @@ class SHPCalcSerializer(serializers.Serializer):
     observation = serializers.CharField(**custom_not_required_blank)
     pressure_type = serializers.ChoiceField(choices=Config.PressureType, required=True)
     calc_type = serializers.ChoiceField(choices=Config.CalcType, required=True)
+    solver_type = serializers.ChoiceField(choices=Config.SolverType, default=Config.SolverType.ITERATIVO,
+                                          **custom_not_required)
+    precision = serializers.ChoiceField(choices=Config.PrecisionMode, default=Config.PrecisionMode.FINAL,
+                                        **custom_not_required)
+    simultaneous_fixtures = serializers.IntegerField(min_value=1, **custom_not_required)
+    sizing = SHPCalcSizingSerializer(**custom_not_required)
     pump = SHPCalcPumpSerializer()
     material_id = serializers.IntegerField(required=True)
     diameter_id = serializers.IntegerField(required=True)
@@ -203,6 +220,11 @@ class SHPCalcSerializer(serializers.Serializer):
     error = serializers.CharField(default=None, **custom_not_required_blank)
     less_favorable_path_fixture_index = serializers.IntegerField(**custom_not_required)
     calculated_at = serializers.DateTimeField(**custom_not_required)
+    catalog_version = serializers.IntegerField(**custom_not_required)
+    accuracy = serializers.FloatField(**custom_not_required)
+    evaluated_scenarios = serializers.IntegerField(**custom_not_required)
+    previous_cache_key = serializers.CharField(**custom_not_required_blank)
+    previous_result = serializers.JSONField(**custom_not_required)
 
     def to_internal_value(self, data):
         if data.get('pressure_type') == 'GR':
@@ -0,0 +1,16 @@
+from django.db.models.signals import post_delete, post_save
+
+from core.cache import bump_catalog_version_on_commit
+
+from .models import Diameter, Fitting, FittingDiameter, Fixture, Material, MaterialConnection, Reduction
+
+CATALOG_MODELS = [Material, Diameter, Fitting, FittingDiameter, Reduction, MaterialConnection, Fixture]
+
+
+def bump_catalog(sender, using: str = None, **kwargs):
+    bump_catalog_version_on_commit('shp', using)
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(bump_catalog, sender=model)
+    post_delete.connect(bump_catalog, sender=model)
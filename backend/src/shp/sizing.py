@@ -0,0 +1,388 @@
+import copy
+import logging
+import math
+from typing import List, Tuple, Union
+
+import numpy as np
+
+from .calculate import SHP
+from .catalog import CatalogSnapshot
+from .constants import PRESSURE_TOLERANCE, SIZING_MAX_CORRECTIONS
+from .dataclasses import SHPCalcSizing
+from .exceptions import CouldNotFinishCalculate, NoInitialDataError
+from .gradient import GradientSolver
+from .models import Config, Diameter
+from .serializers import SHPCalcSerializer
+from .utils import get_pressure_drop_coefficient, get_speeds
+
+logger = logging.getLogger(__name__)
+
+# (start pressure, fraction of the height of the reservoir left after the losses of its path,
+#  flows of the sized paths, head over the head of the minimum flow of every active fixture)
+Solution = Tuple[float, float, np.ndarray, np.ndarray]
+
+
+class DiameterSizing():
+    '''
+    Cheapest diameters, from the diameters of the `sizing` material, for the paths
+    of that material, with the minimum flow calc needing at most `max_head` of
+    reservoir height, or pump head, and no path above `max_speed`. The cost of a
+    path is its length by its internal diameter.
+
+    Every path starts with the largest diameter and goes down one diameter at a
+    time, the ones that save the most cost for the pressure they add first. With
+    the flows of the last solution held, a smaller diameter adds its pressure drop
+    to every fixture after the path, and the fixtures with more than the minimum
+    flow take it from their surplus. Every round of changes is solved by the same
+    gradient solver, that starts from the flows of the last solve, and a round that
+    goes over the limits is undone by halves. Then a local search enlarges one path
+    of the less favorable fixture at a time, and keeps it when the pressure it gives
+    back lets the other paths go down by more cost.
+
+    The fittings and the connections to the paths after follow the diameter of the
+    path. The reductions and the connections to the path before are the ones of the
+    diameters sent, the final calc has the right ones, and when they take the
+    network over the limits the search runs again with the limits lowered by the
+    difference, until it repeats an assignment. When no assignment of the search
+    fits, the largest diameters and the diameters sent are the last tries, the
+    cheapest of them inside the limits is kept.
+    '''
+
+    data: dict = None
+    catalog: CatalogSnapshot = None
+    sizing: SHPCalcSizing = None
+    pressure_type: str = None
+    minimum_flow: float = None
+    diameters: List[Diameter] = None
+    sizes: np.ndarray = None
+    evaluations: int = None
+    head_limit: float = None
+    speed_limit: float = None
+
+    solver: GradientSolver = None
+    # positions of the sized paths, and their links in the solver
+    positions: List[int] = None
+    links: np.ndarray = None
+    # by sized path (rows) and diameter (columns), the resistance of the path, the coefficient
+    # of its unit pressure drop and its cost
+    resistances: np.ndarray = None
+    units: np.ndarray = None
+    costs: np.ndarray = None
+    # resistance of the hose and of the inlet of the sized fixture paths
+    others: np.ndarray = None
+    # 1 for the sized paths (rows) before every active fixture (columns), the fixture path included
+    routes: np.ndarray = None
+    reservoir_row: int = None
+    reservoir_unit: float = None
+    solution: Solution = None
+
+    def __init__(self, data, catalog: CatalogSnapshot = None):
+        if not data:
+            raise NoInitialDataError()
+        self.data = copy.deepcopy(data)
+        self.catalog = catalog
+
+    def calculate(self) -> SHPCalcSerializer:
+        shp = SHP(copy.deepcopy(self.data), self.catalog)
+        self.sizing = shp.shpCalc.sizing
+        self.pressure_type = shp.shpCalc.pressure_type
+        if shp.shpCalc.calc_type != Config.CalcType.VAZAO_MINIMA:
+            message = 'O dimensionamento dos diâmetros só é feito no cálculo de vazão mínima.'
+            logger.error(message)
+            raise CouldNotFinishCalculate(message)
+        if self.sizing.max_head is None and self.sizing.max_speed is None:
+            message = 'Informe a altura máxima ou a velocidade máxima para o dimensionamento dos diâmetros.'
+            logger.error(message)
+            raise CouldNotFinishCalculate(message)
+
+        shp.get_network()
+        self.catalog = shp.catalog
+        self.minimum_flow = shp.fixture.minimum_flow_rate_in_m3_p_s
+        self.diameters = sorted(
+            (
+                diameter for diameter in self.catalog.diameters.values()
+                if diameter.material_id == self.sizing.material_id
+                and (not self.sizing.diameters_ids or diameter.id in self.sizing.diameters_ids)
+            ),
+            key=lambda diameter: diameter.internal_diameter,
+        )
+        if not self.diameters:
+            message = 'Nenhum diâmetro do material escolhido para o dimensionamento.'
+            logger.error(message)
+            raise CouldNotFinishCalculate(message)
+        self.__prepare(shp)
+        if not self.positions:
+            message = 'Nenhum trecho com vazão do material escolhido para o dimensionamento.'
+            logger.error(message)
+            raise CouldNotFinishCalculate(message)
+        self.evaluations = 0
+
+        (max_head, max_speed) = (self.sizing.max_head, self.sizing.max_speed)
+        (self.head_limit, self.speed_limit) = (max_head, max_speed)
+        calculated = set()
+        sized: SHP = None
+        sized_cost: float = None
+        for _ in range(SIZING_MAX_CORRECTIONS + 1):
+            choice = self.__search()
+            if tuple(choice.tolist()) in calculated:
+                break
+            calculated.add(tuple(choice.tolist()))
+            (shp, head, speed) = self.__calculate(choice)
+            over_head = max_head is not None and head > max_head + PRESSURE_TOLERANCE
+            over_speed = max_speed is not None and speed > max_speed
+            if not over_head and not over_speed:
+                (sized, sized_cost) = (shp, self.__get_cost(choice))
+                break
+            if over_head:
+                self.head_limit -= head - max_head
+            if over_speed:
+                self.speed_limit *= max_speed / speed
+
+        if sized is None:
+            # the corrections ran out, the largest diameters and the diameters sent are the last tries
+            columns = {diameter.id: column for (column, diameter) in enumerate(self.diameters)}
+            paths = self.data['paths']
+            choices = [np.full(len(self.positions), len(self.diameters) - 1)]
+            if all(paths[position]['diameter_id'] in columns for position in self.positions):
+                choices.append(np.array([columns[paths[position]['diameter_id']] for position in self.positions]))
+            for choice in choices:
+                if tuple(choice.tolist()) in calculated:
+                    continue
+                calculated.add(tuple(choice.tolist()))
+                (shp, head, speed) = self.__calculate(choice)
+                if max_head is not None and head > max_head + PRESSURE_TOLERANCE:
+                    continue
+                if max_speed is not None and speed > max_speed:
+                    continue
+                if sized is None or self.__get_cost(choice) < sized_cost:
+                    (sized, sized_cost) = (shp, self.__get_cost(choice))
+        if sized is None:
+            message = 'Nem com o maior diâmetro em todos os trechos a rede fica dentro dos limites.'
+            logger.error(message)
+            raise CouldNotFinishCalculate(message)
+
+        sized.shpCalc.sizing.cost = sized_cost
+        sized.shpCalc.sizing.evaluations = self.evaluations
+        return sized.get_serializer()
+
+    def get_data(self, choice: np.ndarray) -> dict:
+        '''
+        input of the calc with the diameters of `choice` in the sized paths
+        '''
+        data = copy.deepcopy(self.data)
+        for (position, column) in zip(self.positions, choice.tolist()):
+            data['paths'][position]['diameter_id'] = self.diameters[column].id
+        return data
+
+    def __prepare(self, shp: SHP):
+        '''
+        the resistances of the sized paths with every diameter, and the solver of the network as in
+        the calc of the minimum flow, with the reservoir at the level of its path in a gravity system
+        and at its level before the pump, which the head of the pump includes
+        '''
+        network = shp.network
+        paths = shp.shpCalc.paths
+        if self.pressure_type == Config.PressureType.GRAVITACIONAL:
+            network.set_level_difference(network.reservoir, 0)
+        network.update_reservoir_total_length()
+        self.solver = solver = GradientSolver(network, precision=shp.precision)
+
+        rows = {}
+        for (link, position) in enumerate(solver.links.tolist()):
+            if paths[position].material_id == self.sizing.material_id:
+                rows[link] = len(rows)
+        self.links = np.array(list(rows.keys()), dtype=int)
+        self.positions = solver.links[self.links].tolist()
+
+        self.sizes = sizes = np.array([diameter.internal_diameter for diameter in self.diameters], dtype=float)
+        coefficient = self.catalog.get_material(self.sizing.material_id).hazen_williams_coefficient
+        units = np.array([get_pressure_drop_coefficient(coefficient, size) for size in sizes])
+        equivalent_lengths = np.array([
+            [
+                network.equivalent_length[position] + self.__get_fittings_length(shp, paths[position], diameter.id) -
+                self.__get_fittings_length(shp, paths[position], paths[position].diameter_id)
+                for diameter in self.diameters
+            ]
+            for position in self.positions
+        ])
+        lengths = network.length[self.positions][:, np.newaxis]
+        self.units = np.tile(units, (len(self.positions), 1))
+        self.resistances = self.units * (lengths + equivalent_lengths)
+        self.costs = lengths * sizes
+        self.others = solver.r[self.links] - network.resistances[self.positions] * network.total_length[self.positions]
+
+        emitters = np.flatnonzero(solver.emitters).tolist()
+        parents = solver.parents.tolist()
+        self.routes = np.zeros((len(self.positions), len(emitters)))
+        for (column, link) in enumerate(emitters):
+            while link >= 0:
+                if link in rows:
+                    self.routes[rows[link], column] = 1
+                link = parents[link]
+        self.reservoir_row = rows.get(0)
+        self.reservoir_unit = float(network.resistances[network.reservoir])
+
+    def __get_fittings_length(self, shp: SHP, path, diameter_id: int) -> float:
+        '''
+        equivalent length of the fittings of the path and of the connection to the paths after, with `diameter_id`
+        '''
+        fittings_ids = list(path.fittings_ids or [])
+        connection_fitting_id = {
+            1: path.material.one_outlet_connection_id,
+            2: path.material.two_outlet_connection_id,
+            3: path.material.three_outlet_connection_id,
+        }.get(len(shp.get_paths_after(path)))
+        if connection_fitting_id:
+            fittings_ids.append(connection_fitting_id)
+        length = 0
+        for fitting_id in fittings_ids:
+            fitting_diameter = self.catalog.get_fitting_diameter(diameter_id, fitting_id)
+            if fitting_diameter and fitting_diameter.equivalent_length:
+                length += float(fitting_diameter.equivalent_length)
+        return length
+
+    def __calculate(self, choice: np.ndarray) -> Tuple[SHP, float, float]:
+        '''
+        calc with the diameters of `choice`, with its required head and the highest speed of the sized paths
+        '''
+        shp = SHP(self.get_data(choice), self.catalog)
+        shp.solve()
+        head = shp.get_required_head()
+        speed = max(abs(shp.network.speed[position]) for position in self.positions)
+        logger.info(
+            f'Sized {len(self.positions)} paths: head {head} m, speed {speed} m/s, cost {self.__get_cost(choice)}'
+        )
+        return (shp, head, speed)
+
+    def __get_cost(self, choice: np.ndarray) -> float:
+        return float(self.costs[np.arange(len(choice)), choice].sum())
+
+    def __evaluate(self, choice: np.ndarray) -> Union[Solution, None]:
+        '''
+        solves the network with the diameters of `choice`, from the flows of the last solve,
+        `None` when it goes over the limits
+        '''
+        solver = self.solver
+        rows = np.arange(len(choice))
+        solver.r[self.links] = self.others + self.resistances[rows, choice]
+        self.evaluations += 1
+        flows = solver.flows
+        try:
+            pressure = solver.solve_required_pressure(self.minimum_flow)
+        except CouldNotFinishCalculate:
+            solver.flows = flows
+            return None
+
+        factor = 1
+        if self.pressure_type == Config.PressureType.GRAVITACIONAL:
+            unit = self.reservoir_unit
+            if self.reservoir_row is not None:
+                unit = self.units[self.reservoir_row, choice[self.reservoir_row]]
+            factor = 1 - unit * math.pow(abs(solver.flows[0]), 1.85)
+            if factor <= 0:
+                return None
+        if self.head_limit is not None and pressure / factor > self.head_limit + PRESSURE_TOLERANCE:
+            return None
+        flows = np.abs(solver.flows[self.links])
+        if self.speed_limit is not None and (get_speeds(flows, self.sizes[choice]) > self.speed_limit).any():
+            return None
+
+        emitters = solver.emitters
+        losses = (
+            solver.r[emitters] * math.pow(self.minimum_flow, 1.85) +
+            solver.e[emitters] * self.minimum_flow ** 2 + solver.static[emitters]
+        )
+        return (pressure, factor, flows, solver.heads[emitters] - losses)
+
+    def __search(self) -> np.ndarray:
+        '''
+        diameters of the sized paths inside the limits, from the largest ones
+        '''
+        choice = np.full(len(self.positions), len(self.diameters) - 1)
+        self.solution = self.__evaluate(choice)
+        if self.solution is None:
+            # the calc decides if the largest diameters are inside the limits
+            return choice
+        choice = self.__reduce(choice, np.zeros(len(choice), dtype=bool))
+        if self.head_limit is not None:
+            choice = self.__exchange(choice)
+        return choice
+
+    def __reduce(self, choice: np.ndarray, blocked: np.ndarray) -> np.ndarray:
+        '''
+        goes down one diameter at a time in the paths not `blocked`, the ones that save the most cost
+        for the pressure they add first, while the solves stay inside the limits
+        '''
+        rows = np.arange(len(choice))
+        blocked = blocked.copy()
+        while True:
+            (pressure, factor, flows, surplus) = self.solution
+            smaller = np.maximum(choice - 1, 0)
+            candidates = (choice > 0) & ~blocked
+            if self.speed_limit is not None:
+                candidates &= get_speeds(flows, self.sizes[smaller]) <= self.speed_limit
+            if not candidates.any():
+                return choice
+            added = (self.resistances[rows, smaller] - self.resistances[rows, choice]) * np.power(flows, 1.85)
+            savings = self.costs[rows, choice] - self.costs[rows, smaller]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ratios = np.where(added > 0, savings / added, np.inf)
+            budget = math.inf if self.head_limit is None else self.head_limit * factor - pressure
+
+            # the changes that fit the budget with the flows held, in the order of their ratio
+            accepted = []
+            for row in sorted(np.flatnonzero(candidates).tolist(), key=lambda row: -ratios[row]):
+                left = surplus - added[row] * self.routes[row]
+                if left.min() >= -budget:
+                    (surplus, accepted) = (left, accepted + [row])
+            if not accepted:
+                return choice
+
+            while accepted:
+                trial = choice.copy()
+                trial[accepted] -= 1
+                solution = self.__evaluate(trial)
+                if solution is not None:
+                    (choice, self.solution) = (trial, solution)
+                    break
+                if len(accepted) == 1:
+                    blocked[accepted[0]] = True
+                accepted = accepted[:len(accepted) // 2]
+
+    def __exchange(self, choice: np.ndarray) -> np.ndarray:
+        '''
+        enlarges one path before the less favorable fixture at a time, to any larger diameter, the changes
+        that give back the most pressure for their cost first, and reduces the others again, while it lowers
+        the cost
+        '''
+        rows = np.arange(len(choice))
+        columns = np.arange(len(self.diameters))
+        cost = self.__get_cost(choice)
+        improved = True
+        while improved:
+            improved = False
+            (_, _, flows, surplus) = self.solution
+            route = self.routes[:, int(np.argmin(surplus))] > 0
+            # by row and larger diameter
+            powers = np.power(flows, 1.85)[:, np.newaxis]
+            given = (self.resistances[rows, choice][:, np.newaxis] - self.resistances) * powers
+            added = self.costs - self.costs[rows, choice][:, np.newaxis]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ratios = np.where(added > 0, given / added, np.inf)
+            changes = np.argwhere(route[:, np.newaxis] & (columns > choice[:, np.newaxis]))
+            solution = self.solution
+            for (row, column) in sorted(changes.tolist(), key=lambda change: -ratios[change[0], change[1]]):
+                trial = choice.copy()
+                trial[row] = column
+                self.solution = self.__evaluate(trial)
+                if self.solution is None:
+                    self.solution = solution
+                    continue
+                blocked = np.zeros(len(choice), dtype=bool)
+                blocked[row] = True
+                trial = self.__reduce(trial, blocked)
+                if self.__get_cost(trial) < cost:
+                    (choice, cost, improved) = (trial, self.__get_cost(trial), True)
+                    break
+                self.solution = solution
+        return choice
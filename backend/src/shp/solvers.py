@@ -0,0 +1,142 @@
+import math
+from typing import Callable, Generator, Tuple, Union
+
+from .constants import MAX_ITERATIONS, PRESSURE_TOLERANCE
+
+
+def newton_steps(lower: float,
+                 upper: float,
+                 initial: float = None,
+                 tolerance: float = PRESSURE_TOLERANCE,
+                 max_iterations: int = MAX_ITERATIONS,
+                 best_effort: bool = False) -> Generator[float, Tuple[float, float], Tuple[Union[float, None], int]]:
+    '''
+    Steps of `safeguarded_newton`, for callers that can't evaluate the function
+    in a single call, like a solve that waits for the solves of other branches.
+
+    Yields the next x and receives the value and the derivative at it, returns
+    (root, iterations) as the value of the StopIteration.
+    '''
+    x = upper
+    if initial is not None and lower < initial < upper:
+        x = initial
+    elif math.isinf(upper):
+        # without a guess inside the bracket, the search of the upper bound starts one unit above the lower
+        x = lower + 1
+    for i in range(max_iterations):
+        value, derivative = yield x
+        if abs(value) < tolerance:
+            return x, i
+        if value > 0:
+            upper = x
+        else:
+            lower = x
+        if upper - lower <= 1e-15 * max(1, abs(x)) or (best_effort and i == max_iterations - 1):
+            return x, i
+        candidate = None
+        if derivative > 0:
+            candidate = x - value / derivative
+        if candidate is None or not lower < candidate < upper:
+            candidate = (lower + upper) * 0.5 if not math.isinf(upper) else 2 * x
+        x = candidate
+    return None, max_iterations
+
+
+def safeguarded_newton(function: Callable[[float], Tuple[float, float]],
+                       lower: float,
+                       upper: float,
+                       initial: float = None,
+                       tolerance: float = PRESSURE_TOLERANCE,
+                       max_iterations: int = MAX_ITERATIONS,
+                       best_effort: bool = False) -> Tuple[Union[float, None], int]:
+    '''
+    Finds the root of an increasing function inside [lower, upper].
+
+    `function(x)` must return the value and the derivative at x, with
+    value(lower) <= 0 <= value(upper). Newton steps that leave the bracket
+    fall back to bisection, and the bracket shrinks on every evaluation.
+    The last evaluation is always at the returned root, so any state the
+    function sets is left consistent with it.
+
+    `upper` can be infinite when a good `initial` guess is known, like the last
+    solution of the same problem, the bracket then closes on the first positive
+    value, and doubles x while there is none. A guess outside the bracket is
+    ignored, and x starts one unit above `lower`.
+
+    returns (root, iterations), root is None if it did not converge, or the last
+    evaluated x with `best_effort`
+    '''
+    steps = newton_steps(lower, upper, initial, tolerance, max_iterations, best_effort)
+    try:
+        x = next(steps)
+        while True:
+            x = steps.send(function(x))
+    except StopIteration as stop:
+        return stop.value
+
+
+def brent(function: Callable[[float], float],
+          lower: float,
+          upper: float,
+          lower_value: float = None,
+          upper_value: float = None,
+          tolerance: float = PRESSURE_TOLERANCE,
+          max_iterations: int = MAX_ITERATIONS,
+          best_effort: bool = False) -> Tuple[Union[float, None], int]:
+    '''
+    Finds the root of `function` inside [lower, upper] with the Brent method,
+    mixing bisection, secant and inverse quadratic interpolation steps.
+
+    value(lower) and value(upper) must have opposite signs. Values already known,
+    from the search of the bracket, can be passed to save evaluations. As in
+    `safeguarded_newton` the last evaluation is always at the returned root.
+
+    returns (root, iterations), root is None if it did not converge, or the best
+    estimate with `best_effort`
+    '''
+    (a, b) = (lower, upper)
+    fa = function(a) if lower_value is None else lower_value
+    fb = function(b) if upper_value is None else upper_value
+    last = b if upper_value is None else None
+    if (fa > 0 and fb > 0) or (fa < 0 and fb < 0):
+        return None, 0
+    (c, fc) = (a, fa)
+    d = e = b - a
+    for i in range(max_iterations):
+        if (fb > 0 and fc > 0) or (fb < 0 and fc < 0):
+            (c, fc) = (a, fa)
+            d = e = b - a
+        if abs(fc) < abs(fb):
+            (a, b, c) = (b, c, b)
+            (fa, fb, fc) = (fb, fc, fb)
+        step_tolerance = 2 * 2.220446049250313e-16 * abs(b)
+        middle = 0.5 * (c - b)
+        if (abs(fb) < tolerance or abs(middle) <= step_tolerance or fb == 0 or
+                (best_effort and i == max_iterations - 1)):
+            if last != b:
+                function(b)
+            return b, i
+        if abs(e) >= step_tolerance and abs(fa) > abs(fb):
+            s = fb / fa
+            if a == c:
+                p = 2 * middle * s
+                q = 1 - s
+            else:
+                q = fa / fc
+                r = fb / fc
+                p = s * (2 * middle * q * (q - r) - (b - a) * (r - 1))
+                q = (q - 1) * (r - 1) * (s - 1)
+            if p > 0:
+                q = -q
+            p = abs(p)
+            if 2 * p < min(3 * middle * q - abs(step_tolerance * q), abs(e * q)):
+                (e, d) = (d, p / q)
+            else:
+                d = e = middle
+        else:
+            d = e = middle
+        (a, fa) = (b, fb)
+        b += d if abs(d) > step_tolerance else math.copysign(step_tolerance, middle)
+        fb = function(b)
+        last = b
+    return None, max_iterations
@@ -0,0 +1,423 @@
+import copy
+import math
+import os
+import time
+from itertools import combinations
+from unittest import mock
+
+from core.cache import set_cached_result
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from .calculate import SHP
+from .catalog import CatalogSnapshot
+from .constants import PRESSURE_TOLERANCE
+from .exceptions import CouldNotFinishCalculate
+from .executor import CalculationExecutor, get_worker_executable
+from .models import Config, Diameter, Fitting, FittingDiameter, Fixture, Material
+from .scenarios import ScenarioSearch
+from .sizing import DiameterSizing
+from .solvers import safeguarded_newton
+
+FLOOR_HEIGHT = 3
+
+
+def sleep_item(catalog: CatalogSnapshot, seconds: float) -> float:
+    time.sleep(seconds)
+    return seconds
+
+
+class CalculationExecutorTest(TestCase):
+
+    def test_worker_executable(self):
+        with mock.patch('sys.executable', '/usr/local/bin/uwsgi'):
+            self.assertTrue(os.path.basename(get_worker_executable()).startswith('python'))
+            with override_settings(CALC_PYTHON='/opt/venv/bin/python'):
+                self.assertEqual(get_worker_executable(), '/opt/venv/bin/python')
+
+    def test_timeout(self):
+        catalog = CatalogSnapshot([])
+        with CalculationExecutor(catalog, workers=2, timeout=60) as executor:
+            self.assertEqual(executor.map(sleep_item, [0.2, 0, 0.1]), [0.2, 0, 0.1])
+        executor = CalculationExecutor(catalog, workers=2, timeout=1)
+        start = time.monotonic()
+        with self.assertRaises(CouldNotFinishCalculate):
+            executor.map(sleep_item, [0, 60])
+        self.assertLess(time.monotonic() - start, 30)
+
+
+class SafeguardedNewtonTest(SimpleTestCase):
+
+    def test_initial_outside_bracket(self):
+        '''
+        a guess outside the bracket, like the negative flow of a link of a looped network,
+        is ignored, with an upper bound or without one
+        '''
+        def function(flow: float) -> tuple:
+            return (flow * abs(flow) - 0.002 ** 2, 2 * abs(flow))
+
+        for (upper, initial) in ((0.01, -0.0006), (math.inf, -0.0006), (math.inf, math.nan), (math.inf, None)):
+            with self.subTest(upper=upper, initial=initial):
+                (flow, _) = safeguarded_newton(function, 0, upper, initial=initial, tolerance=1e-12)
+                self.assertAlmostEqual(flow, 0.002, places=9)
+
+
+class SHPCalcTestCase(TestCase):
+    '''
+    catalog of one material and one fixture, and the calc of a building, a riser
+    from the reservoir with one fixture on every floor
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        # the catalog version is bumped on commit
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.create_catalog()
+
+    @classmethod
+    def create_catalog(cls):
+        tee = Fitting.objects.create(name='Te')
+        cls.material = Material.objects.create(name='Aço galvanizado', hazen_williams_coefficient=120)
+        cls.diameters = [
+            Diameter.objects.create(material=cls.material, name=name, internal_diameter=internal_diameter)
+            for (name, internal_diameter) in (('1 1/2"', 40), ('2"', 52), ('2 1/2"', 65))
+        ]
+        for (diameter, equivalent_length) in zip(cls.diameters, (2.5, 3.5, 4.2)):
+            FittingDiameter.objects.create(fitting=tee, diameter=diameter, equivalent_length=equivalent_length)
+        cls.material.two_outlet_connection = tee
+        cls.material.save()
+        cls.fixture = Fixture.objects.create(
+            name='Hidrante', nozzle_type=Fixture.FixtureType.TRONCO_CONICO, inlet_diameter=cls.diameters[-1],
+            hose_hazen_williams_coefficient=140, hose_internal_diameter=38, k_factor=0,
+            outlet_diameter=13, minimum_flow_rate=130,
+        )
+
+    def get_calc(self, floors: int, active: list[int], pressure_type: str = Config.PressureType.GRAVITACIONAL,
+                 calc_type: str = Config.CalcType.VAZAO_MINIMA, solver_type: str = Config.SolverType.ITERATIVO,
+                 level: float = -5, head_lift: float = None, diameter: Diameter = None) -> dict:
+        '''
+        input of a building with `floors` floors below the reservoir, with the fixtures of
+        the floors in `active` (from 0, the top floor) active. The pump is right after the reservoir
+        '''
+        diameter = diameter or self.diameters[-1]
+
+        def get_path(start: str, end: str, length: float, level_difference: float, fixture: dict = None) -> dict:
+            return {
+                'start': start, 'end': end, 'fixture': fixture, 'has_fixture': fixture is not None,
+                'material_id': self.material.id, 'diameter_id': diameter.id, 'length': length,
+                'level_difference': level_difference, 'fittings_ids': [],
+            }
+
+        paths = [get_path('RES', 'BOM', 2, level), get_path('BOM', 'F0', 3, 0)]
+        for floor in range(floors):
+            fixture = {'active': floor in active, 'end': f'H{floor}', 'hose_length': 30, 'level_difference': 1}
+            paths.append(get_path(f'F{floor}', None, 1, 0, fixture))
+            if floor < floors - 1:
+                paths.append(get_path(f'F{floor}', f'F{floor + 1}', FLOOR_HEIGHT, -FLOOR_HEIGHT))
+        return {
+            'fileinfo': {'type': 'shp_calc', 'version': '1.0.0', 'created': '2022-08-21T18:39:21Z',
+                         'updated': '2022-08-29 20:16:10-03:00'},
+            'name': '', 'pressure_type': pressure_type, 'calc_type': calc_type, 'solver_type': solver_type,
+            'pump': {'node': 'BOM', 'head_lift': head_lift} if pressure_type == Config.PressureType.BOMBA else {},
+            'material_id': self.material.id, 'diameter_id': diameter.id, 'fixture_id': self.fixture.id,
+            'paths': paths,
+        }
+
+
+class GradientSolverTest(SHPCalcTestCase):
+
+    def assertSameCalc(self, data: dict):
+        iterative = SHP(dict(data, solver_type=Config.SolverType.ITERATIVO))
+        iterative.calculate()
+        gradient = SHP(dict(data, solver_type=Config.SolverType.GRADIENTE))
+        gradient.calculate()
+        self.assertAlmostEqual(iterative.get_required_head(), gradient.get_required_head(), places=2)
+        for (path, other) in zip(iterative.shpCalc.paths, gradient.shpCalc.paths):
+            if path.has_active_fixture:
+                self.assertAlmostEqual(path.fixture.flow * 60000, other.fixture.flow * 60000, places=1)
+
+    def test_minimum_flow(self):
+        for pressure_type in Config.PressureType.values:
+            with self.subTest(pressure_type=pressure_type):
+                self.assertSameCalc(self.get_calc(6, [0, 1], pressure_type, Config.CalcType.VAZAO_MINIMA))
+
+    def test_residual_flow(self):
+        for pressure_type in Config.PressureType.values:
+            with self.subTest(pressure_type=pressure_type):
+                self.assertSameCalc(self.get_calc(6, [0, 1], pressure_type, Config.CalcType.VAZAO_RESIDUAL,
+                                                  level=-12, head_lift=12))
+
+    def test_negative_required_pressure(self):
+        '''
+        the fixtures far below the reservoir need less than nothing in the reservoir
+        '''
+        for pressure_type in Config.PressureType.values:
+            with self.subTest(pressure_type=pressure_type):
+                data = self.get_calc(35, [33, 34], pressure_type, Config.CalcType.VAZAO_MINIMA, level=0)
+                self.assertSameCalc(data)
+                gradient = SHP(dict(data, solver_type=Config.SolverType.GRADIENTE))
+                gradient.calculate()
+                self.assertLess(gradient.get_required_head(), 0)
+
+
+class CacheKeyTest(SHPCalcTestCase):
+
+    def test_input_unchanged(self):
+        data = self.get_calc(3, [0], Config.PressureType.GRAVITACIONAL)
+        data['pump'] = {'node': 'BOM', 'head_lift': 10}
+        for path in data['paths']:
+            if path['has_fixture']:
+                path['end'] = f'X{path["start"]}'
+        sent = copy.deepcopy(data)
+        SHP.get_cache_key(data)
+        self.assertEqual(data, sent)
+
+
+class LoopedNetworkTest(SHPCalcTestCase):
+
+    def get_ring_calc(self, calc_type: str = Config.CalcType.VAZAO_MINIMA, level: float = -5,
+                      closing: tuple = ('B', 'C')) -> dict:
+        '''
+        ring main A - B - C - A after the reservoir, with the closing link `closing`,
+        and an active fixture on B and on C
+        '''
+        data = self.get_calc(1, [0], calc_type=calc_type, level=level)
+
+        def get_path(start: str, end: str, length: float, fixture: dict = None) -> dict:
+            return {
+                'start': start, 'end': end, 'fixture': fixture, 'has_fixture': fixture is not None,
+                'material_id': self.material.id, 'diameter_id': self.diameters[1].id, 'length': length,
+                'level_difference': 0, 'fittings_ids': [],
+            }
+
+        data['paths'] = [
+            dict(get_path('RES', 'A', 2), level_difference=level),
+            get_path('A', 'B', 20), get_path('A', 'C', 5), get_path(*closing, 10),
+        ]
+        for node in ('B', 'C'):
+            fixture = {'active': True, 'end': f'H{node}', 'hose_length': 30, 'level_difference': 1}
+            data['paths'].append(get_path(node, None, 1, fixture))
+        return data
+
+    def assertContinuity(self, result: dict):
+        for node in ('A', 'B', 'C'):
+            inflow = sum(path['flow'] for path in result['paths'] if path['end'] == node)
+            outflow = sum(path['flow'] for path in result['paths'] if path['start'] == node)
+            self.assertAlmostEqual(inflow, outflow, places=7)
+
+    def test_minimum_and_residual_flow(self):
+        '''
+        the residual flow with the height found by the minimum flow gives the minimum flow back
+        '''
+        minimum_flow = self.fixture.minimum_flow_rate_in_m3_p_s
+        minimum = SHP(self.get_ring_calc())
+        serializer = minimum.calculate()
+        self.assertTrue(serializer.is_valid())
+        # the iterative solver only follows trees
+        self.assertEqual(serializer.data['solver_type'], Config.SolverType.GRADIENTE)
+        self.assertContinuity(serializer.data)
+        flows = [path['fixture']['flow'] for path in serializer.data['paths'] if path['has_fixture']]
+        self.assertAlmostEqual(min(flows), minimum_flow, places=6)
+
+        residual = SHP(self.get_ring_calc(Config.CalcType.VAZAO_RESIDUAL, level=-minimum.get_required_head()))
+        serializer = residual.calculate()
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.data['solver_type'], Config.SolverType.GRADIENTE)
+        self.assertContinuity(serializer.data)
+        residual_flows = [path['fixture']['flow'] for path in serializer.data['paths'] if path['has_fixture']]
+        for (flow, residual_flow) in zip(flows, residual_flows):
+            self.assertAlmostEqual(flow, residual_flow, places=5)
+
+    def test_ring_to_tree(self):
+        '''
+        the flow against the direction of a link of the ring is the start of the same
+        link, in the tree left when another link is removed
+        '''
+        data = self.get_ring_calc()
+        serializer = SHP(copy.deepcopy(data)).calculate()
+        self.assertTrue(serializer.is_valid())
+        closing = [path for path in serializer.data['paths'] if (path['start'], path['end']) == ('B', 'C')]
+        self.assertLess(closing[0]['flow'], 0)
+
+        tree = dict(data, paths=[path for path in data['paths'] if (path['start'], path['end']) != ('A', 'C')])
+        cold = SHP(copy.deepcopy(tree))
+        cold.calculate()
+        warm = SHP(dict(copy.deepcopy(tree), previous_result=serializer.data))
+        warm.calculate()
+        self.assertAlmostEqual(warm.get_required_head(), cold.get_required_head(), places=4)
+
+
+class PreviousCalcTest(SHPCalcTestCase):
+
+    @staticmethod
+    def get_connections(result: dict) -> list:
+        return [(path['equivalent_length'], path['connection_names']) for path in result['paths']]
+
+    def get_previous_result(self, data: dict) -> dict:
+        '''
+        result of `data`, with the connections of every path changed, to tell when they are reused
+        '''
+        serializer = SHP(copy.deepcopy(data)).calculate()
+        self.assertTrue(serializer.is_valid())
+        result = copy.deepcopy(serializer.data)
+        for path in result['paths']:
+            path['equivalent_length'] += 100
+            path['connection_names'] = ['Anterior']
+        return result
+
+    def test_edited_length(self):
+        data = self.get_calc(4, [0, 1])
+        previous = SHP(copy.deepcopy(data)).calculate()
+        self.assertTrue(previous.is_valid())
+        data['paths'][3]['length'] += 2
+        cold = SHP(copy.deepcopy(data)).calculate()
+        warm = SHP(dict(copy.deepcopy(data), previous_result=previous.data)).calculate()
+        self.assertTrue(cold.is_valid())
+        self.assertTrue(warm.is_valid())
+        self.assertEqual(self.get_connections(warm.data), self.get_connections(cold.data))
+        for (path, other) in zip(warm.data['paths'], cold.data['paths']):
+            self.assertAlmostEqual(path['flow'], other['flow'], places=7)
+
+    def test_catalog_version(self):
+        data = self.get_calc(4, [0, 1])
+        result = self.get_previous_result(data)
+        cold = SHP(copy.deepcopy(data)).calculate()
+        self.assertTrue(cold.is_valid())
+
+        # with the catalog of the previous calc its connections are reused
+        warm = SHP(dict(copy.deepcopy(data), previous_result=result)).calculate()
+        self.assertTrue(warm.is_valid())
+        self.assertTrue(all(path['connection_names'] == ['Anterior'] for path in warm.data['paths']))
+
+        # after a change of the catalog they are calculated again
+        result['catalog_version'] -= 1
+        stale = SHP(dict(copy.deepcopy(data), previous_result=result)).calculate()
+        self.assertTrue(stale.is_valid())
+        self.assertEqual(self.get_connections(stale.data), self.get_connections(cold.data))
+
+    def test_previous_cache_key(self):
+        data = self.get_calc(4, [0, 1])
+        key = SHP.get_cache_key(data)
+        set_cached_result(key, self.get_previous_result(data))
+        warm = SHP(dict(copy.deepcopy(data), previous_cache_key=key)).calculate()
+        self.assertTrue(warm.is_valid())
+        self.assertTrue(all(path['connection_names'] == ['Anterior'] for path in warm.data['paths']))
+        self.assertIsNone(warm.data['previous_cache_key'])
+
+
+class ScenarioSearchTest(SHPCalcTestCase):
+
+    def get_scenarios_calc(self, pressure_type: str, level: float, count: int) -> dict:
+        '''
+        building of 8 floors where the fixtures have paths and hoses of different lengths
+        '''
+        data = self.get_calc(8, [], pressure_type, level=level, diameter=self.diameters[1])
+        for (position, path) in enumerate(data['paths']):
+            if path['has_fixture']:
+                path['length'] = 1 + 9 * ((position * 7) % 4)
+                path['fixture']['hose_length'] = 15 + 15 * ((position * 5) % 2)
+        data['simultaneous_fixtures'] = count
+        data['solver_type'] = Config.SolverType.GRADIENTE
+        return data
+
+    def get_worst_head(self, data: dict) -> float:
+        '''
+        highest head of every combination of the fixtures, calculated one by one
+        '''
+        search = ScenarioSearch(data)
+        worst_head = None
+        for combination in combinations(search.candidates, data['simultaneous_fixtures']):
+            shp = SHP(search.get_data(combination))
+            shp.calculate()
+            if worst_head is None or shp.get_required_head() > worst_head:
+                worst_head = shp.get_required_head()
+        return worst_head
+
+    def test_worst_combination(self):
+        cases = (
+            (Config.PressureType.GRAVITACIONAL, 0, 2),
+            (Config.PressureType.GRAVITACIONAL, 0, 3),
+            (Config.PressureType.BOMBA, -10, 2),
+            (Config.PressureType.BOMBA, 6, 2),
+            (Config.PressureType.BOMBA, 8, 3),
+        )
+        for (pressure_type, level, count) in cases:
+            with self.subTest(pressure_type=pressure_type, level=level, count=count):
+                data = self.get_scenarios_calc(pressure_type, level, count)
+                search = ScenarioSearch(data)
+                serializer = search.calculate()
+                self.assertAlmostEqual(search.worst_head, self.get_worst_head(data), places=3)
+                self.assertTrue(serializer.is_valid())
+                self.assertEqual(serializer.data['evaluated_scenarios'], len(search.evaluated))
+
+    def test_inactive_fixtures(self):
+        '''
+        the fixture paths sent by the frontend have an end, and every fixture is a
+        candidate, active or not
+        '''
+        data = self.get_scenarios_calc(Config.PressureType.GRAVITACIONAL, 0, 2)
+        for (position, path) in enumerate(data['paths']):
+            if path['has_fixture']:
+                path['end'] = f'X{position}'
+        search = ScenarioSearch(data)
+        self.assertEqual(len(search.candidates), 8)
+        search.calculate()
+        self.assertAlmostEqual(search.worst_head, self.get_worst_head(data), places=3)
+
+
+class DiameterSizingTest(SHPCalcTestCase):
+
+    def test_head_limit(self):
+        cases = (
+            (Config.PressureType.GRAVITACIONAL, 0, 25),
+            (Config.PressureType.BOMBA, -6, 20),
+            (Config.PressureType.BOMBA, 6, 30),
+        )
+        for (pressure_type, level, max_head) in cases:
+            with self.subTest(pressure_type=pressure_type, level=level, max_head=max_head):
+                data = self.get_calc(4, [0, 1], pressure_type, level=level)
+                data['sizing'] = {'material_id': self.material.id, 'max_head': max_head}
+                serializer = DiameterSizing(data).calculate()
+                self.assertTrue(serializer.is_valid())
+                sized = SHP(serializer.data)
+                sized.calculate()
+                self.assertLessEqual(sized.get_required_head(), max_head)
+                self.assertGreater(serializer.data['sizing']['cost'], 0)
+                self.assertGreater(serializer.data['sizing']['evaluations'], 0)
+
+    def test_smallest_diameters(self):
+        '''
+        the suction level is part of the head of the pump, so with a pump below the reservoir
+        the smallest diameters fit
+        '''
+        data = self.get_calc(4, [0, 1], Config.PressureType.BOMBA, level=-6, diameter=self.diameters[0])
+        smallest = SHP(data)
+        smallest.calculate()
+        data['sizing'] = {'material_id': self.material.id, 'max_head': smallest.get_required_head() + 1}
+        data['paths'] = self.get_calc(4, [0, 1], Config.PressureType.BOMBA, level=-6)['paths']
+        serializer = DiameterSizing(data).calculate()
+        self.assertTrue(serializer.is_valid())
+        for path in serializer.data['paths']:
+            if path['flow']:
+                self.assertEqual(path['diameter_id'], self.diameters[0].id)
+
+    def test_tight_head_limit(self):
+        '''
+        with the limit close to the head of the diameters sent, the sizing has a result
+        '''
+        cases = (
+            (Config.PressureType.GRAVITACIONAL, 5),
+            (Config.PressureType.BOMBA, 0.1),
+            (Config.PressureType.BOMBA, 2),
+        )
+        for (pressure_type, margin) in cases:
+            with self.subTest(pressure_type=pressure_type, margin=margin):
+                data = self.get_calc(20, [0, 1], pressure_type, diameter=self.diameters[1])
+                current = SHP(copy.deepcopy(data))
+                current.calculate()
+                max_head = current.get_required_head() + margin
+                data['sizing'] = {'material_id': self.material.id, 'max_head': max_head}
+                serializer = DiameterSizing(data).calculate()
+                self.assertTrue(serializer.is_valid())
+                sized = SHP(serializer.data)
+                sized.calculate()
+                self.assertLessEqual(sized.get_required_head(), max_head + PRESSURE_TOLERANCE)
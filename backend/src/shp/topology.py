@@ -0,0 +1,54 @@
+from typing import Dict, List, Union
+
+from .dataclasses import SHPCalcPath
+
+
+class SHPTopology():
+    '''
+    Index of the network, built once per calculation.
+
+    Maps every node to the paths that start and end on it, and keeps the list of
+    paths after (children) and the path before (parent) of every path, so the
+    traversals don't need to scan all the paths of the calc on every step.
+    '''
+
+    paths: List[SHPCalcPath] = None
+    paths_by_start: Dict[str, List[SHPCalcPath]] = None
+    paths_by_end: Dict[str, List[SHPCalcPath]] = None
+    children: List[List[SHPCalcPath]] = None
+    parents: List[Union[SHPCalcPath, None]] = None
+
+    def __init__(self, paths: List[SHPCalcPath]):
+        self.paths = paths
+        self.__positions: Dict[int, int] = {}
+        self.paths_by_start = {}
+        self.paths_by_end = {}
+        for position, path in enumerate(paths):
+            self.__positions[id(path)] = position
+            self.paths_by_start.setdefault(path.start, []).append(path)
+            if path.end:
+                self.paths_by_end.setdefault(path.end, []).append(path)
+
+        self.children = []
+        self.parents = []
+        for path in paths:
+            if path.end and not path.has_active_fixture:
+                self.children.append(self.paths_by_start.get(path.end, []))
+            else:
+                self.children.append([])
+            paths_before = self.paths_by_end.get(path.start)
+            self.parents.append(paths_before[0] if paths_before else None)
+
+    def position(self, path: SHPCalcPath) -> int:
+        return self.__positions[id(path)]
+
+    def get_path_before(self, actual_path: SHPCalcPath) -> Union[SHPCalcPath, None]:
+        return self.parents[self.position(actual_path)]
+
+    def get_paths_after(self, actual_path: SHPCalcPath, exclude_path: SHPCalcPath = None) -> List[SHPCalcPath]:
+        if not actual_path:
+            return []
+        paths = self.children[self.position(actual_path)]
+        if exclude_path is None:
+            return paths
+        return [path for path in paths if path is not exclude_path]
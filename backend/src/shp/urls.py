@@ -1,7 +1,7 @@
 from django.urls import path
 from rest_framework import routers
 
-from .views import (Calculate, ConfigViewSet, DiameterViewSet,
+from .views import (Calculate, CalculateBatch, ConfigViewSet, DiameterViewSet,
                     FittingDiameterViewSet, FittingViewSet, FixtureViewSet,
                     LoadMaterialBackup, MaterialConnectionViewSet,
                     MaterialViewSet, ReductionViewSet, test)
@@ -21,6 +21,7 @@ router.register(r'fixtures', FixtureViewSet, 'fixtures')
 urlpatterns = [
     path(r'loadmaterialbackup/', LoadMaterialBackup.as_view(), name='loadmaterialbackup'),
     path(r'calculate/', Calculate.as_view(), name='calculate'),
+    path(r'calculate/batch/', CalculateBatch.as_view(), name='calculate-batch'),
     # path(r'test/', test, name='test'),
 ]
 
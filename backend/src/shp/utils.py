@@ -1,7 +1,7 @@
 import math
-from typing import Union, List
+from typing import Union
 
-from .models import Diameter, Reduction
+import numpy as np
 
 
 def sortByEndPressure(path_with_fixture):
@@ -24,53 +24,64 @@ def get_unit_pressure_drop(flow: float, coefficient: int, diameter: float) -> fl
     return 0
 
 
+def get_unit_pressure_drops(flows: np.ndarray, coefficients: np.ndarray, diameters: np.ndarray) -> np.ndarray:
+    '''
+    vectorized `get_unit_pressure_drop`, returns unit pressure drops in m/m,
+    with the sign of the flow
+    args={
+        flows: flows in m³/s
+        coefficients: Hazen-Williams coefficients
+        diameters: internal diameters in mm
+    }
+    '''
+    flows = np.asarray(flows, dtype=float)
+    coefficients = np.asarray(coefficients, dtype=float)
+    diameters = np.asarray(diameters, dtype=float)
+    unit_pressure_drops = np.zeros(np.broadcast(flows, coefficients, diameters).shape)
+    valid = np.broadcast_to((flows != 0) & (coefficients != 0) & (diameters != 0), unit_pressure_drops.shape)
+    numerator = 10.641*np.sign(flows)*np.power(np.abs(flows), 1.85)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = np.power(coefficients, 1.85)*np.power(diameters/1000, 4.87)
+        np.divide(np.broadcast_to(numerator, valid.shape), np.broadcast_to(denominator, valid.shape),
+                  out=unit_pressure_drops, where=valid)
+    return unit_pressure_drops
+
+
+def get_speeds(flows: np.ndarray, diameters: np.ndarray) -> np.ndarray:
+    '''
+    vectorized speed of the flows, returns speeds in m/s
+    args={
+        flows: flows in m³/s
+        diameters: internal diameters in mm
+    }
+    '''
+    flows = np.asarray(flows, dtype=float)
+    areas = (math.pi * np.power(np.asarray(diameters, dtype=float)/1000, 2)) / 4
+    speeds = np.zeros(np.broadcast(flows, areas).shape)
+    valid = np.broadcast_to((flows != 0) & (areas != 0), speeds.shape)
+    np.divide(np.broadcast_to(flows, valid.shape), np.broadcast_to(areas, valid.shape), out=speeds, where=valid)
+    return speeds
+
+
+def get_pressure_drop_coefficient(coefficient: int, diameter: float) -> float:
+    '''
+    returns the coefficient `r` of the unit pressure drop, unit pressure drop = r * flow^1.85
+    args={
+        coefficient: Hazen-Williams coefficient
+        diameter: internal diameter in mm
+    }
+    '''
+    if (coefficient and diameter):
+        return 10.641/(math.pow(float(coefficient), 1.85)*math.pow(float(diameter)/float(1000), 4.87))
+    return 0
+
+
 def format_decimal(number: Union[int, float], decimals=2):
     if number:
         return '{:.{decimals}f}'.format(number, decimals=decimals).replace('.', ',')
     return '0,00'
 
 
-def get_reduction_path(inlet_diameter: Diameter, final_diameter_id: int, reduce: bool) -> List[List[Reduction]]:
-    reduction_paths = []
-    queryset = inlet_diameter.inlet_reductions
-    if reduce:
-        queryset = queryset.filter(outlet_diameter__internal_diameter__lt=inlet_diameter.internal_diameter)
-    else:
-        queryset = queryset.filter(outlet_diameter__internal_diameter__gt=inlet_diameter.internal_diameter)
-    for reduction in queryset.all():
-        if reduction.outlet_diameter_id == final_diameter_id:
-            reduction_paths.append([reduction])
-        else:
-            reduction_paths = get_reduction_path(reduction.outlet_diameter, final_diameter_id, reduce)
-            for reduction_path in reduction_paths:
-                if len(reduction_path):
-                    reduction_path.append(reduction)
-    return reduction_paths
-
-
-def get_best_reduction(inlet_diameter_id: int, outlet_diameter_id: int) -> List[Reduction]:
-    reduction: Reduction = (
-        Reduction.objects.filter(
-            inlet_diameter=inlet_diameter_id,
-            outlet_diameter=outlet_diameter_id
-        )
-        .first())
-    if reduction:
-        return [reduction]
-    inlet_diameter: Diameter = Diameter.objects.get(id=inlet_diameter_id)
-    outlet_diameter: Diameter = Diameter.objects.get(id=outlet_diameter_id)
-    reduce = True
-    if inlet_diameter.internal_diameter < outlet_diameter.internal_diameter:
-        reduce = False
-    reduction_paths = get_reduction_path(inlet_diameter, outlet_diameter_id, reduce)
-    reductions = []
-    for reduction_path in reduction_paths:
-        if len(reductions) == 0 or len(reduction_path) < len(reductions):
-            reductions = reduction_path
-    reductions.reverse()
-    return reductions
-
-
 def flow_to_l_p_min(flow: float) -> float:
     if isinstance(flow, float):
         return flow * 60000
@@ -0,0 +1,117 @@
+import logging
+from collections import deque
+from typing import Dict, List
+
+from .dataclasses import SHPCalc, SHPCalcPath
+from .exceptions import (BifurcationBeforePump, InvalidNetwork, MoreThenOnePump, MoreThenOneReservoir,
+                         NoActiveFixtureFound, NoPumpFound, NoReservoir)
+from .models import Config
+
+logger = logging.getLogger(__name__)
+
+# most paths listed in a message, a malformed network can have thousands of them
+MAX_NAMES = 10
+
+
+def get_path_name(path: SHPCalcPath) -> str:
+    if path.has_fixture and path.fixture:
+        return f'{path.start} - {path.fixture.end}'
+    return f'{path.start} - {path.end or ""}'
+
+
+def get_names(paths: List[SHPCalcPath]) -> str:
+    names = ', '.join(get_path_name(path) for path in paths[:MAX_NAMES])
+    if len(paths) > MAX_NAMES:
+        names += f' e mais {len(paths) - MAX_NAMES}'
+    return names
+
+
+def get_network_problems(shpCalc: SHPCalc) -> List[str]:
+    '''
+    Every problem of the topology of the network, in a single pass over the paths.
+
+    The paths reachable from the reservoir are found by a breadth first search,
+    the paths left out don't lead to it. A node can be the end of more than one
+    path, a loop of the network calculated by the gradient solver.
+    '''
+    paths = shpCalc.paths
+    problems = []
+
+    reservoir_paths = [path for path in paths if path.start == 'RES']
+    if not reservoir_paths:
+        problems.append(NoReservoir.default_detail)
+    elif len(reservoir_paths) > 1:
+        problems.append(MoreThenOneReservoir.default_detail)
+
+    paths_by_start: Dict[str, List[SHPCalcPath]] = {}
+    paths_by_end: Dict[str, List[SHPCalcPath]] = {}
+    for path in paths:
+        paths_by_start.setdefault(path.start, []).append(path)
+        if path.end:
+            paths_by_end.setdefault(path.end, []).append(path)
+
+    if 'RES' in paths_by_end:
+        problems.append(f'O reservatório não pode ser o fim de um trecho: {get_names(paths_by_end["RES"])}.')
+
+    fixtures_by_end: Dict[str, List[SHPCalcPath]] = {}
+    for path in paths:
+        if path.has_fixture and path.fixture:
+            fixtures_by_end.setdefault(path.fixture.end, []).append(path)
+    for (name, fixture_paths) in fixtures_by_end.items():
+        if len(fixture_paths) > 1:
+            problems.append(f'O nome {name} é usado por mais de um hidrante: {get_names(fixture_paths)}.')
+        elif name in paths_by_start or name in paths_by_end:
+            problems.append(f'O nome do hidrante {name} também é o nome de um nó da rede.')
+
+    # the paths after, as in SHPTopology, nothing flows after an active fixture
+    reachable = {id(path) for path in reservoir_paths}
+    queue = deque(reservoir_paths)
+    while queue:
+        path = queue.popleft()
+        if not path.end or path.has_active_fixture:
+            continue
+        for path_after in paths_by_start.get(path.end, []):
+            if id(path_after) not in reachable:
+                reachable.add(id(path_after))
+                queue.append(path_after)
+
+    if reservoir_paths:
+        not_reaching = [path for path in paths if id(path) not in reachable and not path.has_active_fixture]
+        if not_reaching:
+            problems.append(f'Os trechos {get_names(not_reaching)} não levam ao reservatório.')
+        unreachable_fixtures = [path for path in paths if id(path) not in reachable and path.has_active_fixture]
+        if unreachable_fixtures:
+            problems.append(f'Os hidrantes {get_names(unreachable_fixtures)} não estão ligados ao reservatório.')
+
+    if not any(path.has_active_fixture for path in paths):
+        problems.append(NoActiveFixtureFound.default_detail)
+
+    if shpCalc.pressure_type == Config.PressureType.BOMBA:
+        pump_paths = paths_by_end.get(shpCalc.pump.node) if shpCalc.pump and shpCalc.pump.node else None
+        if not pump_paths:
+            problems.append(NoPumpFound.default_detail)
+        elif len(pump_paths) > 1:
+            problems.append(MoreThenOnePump.default_detail)
+        elif id(pump_paths[0]) not in reachable:
+            problems.append(f'O ponto de bomba {shpCalc.pump.node} não está ligado ao reservatório.')
+        else:
+            # a single line of paths, without bifurcations or loops, from the reservoir to the pump
+            path = pump_paths[0]
+            while path.start != 'RES':
+                paths_before = paths_by_end.get(path.start, [])
+                if len(paths_before) > 1 or len(paths_by_start.get(path.start, [])) > 1:
+                    problems.append(BifurcationBeforePump.default_detail)
+                    break
+                path = paths_before[0]
+
+    return problems
+
+
+def validate_network(shpCalc: SHPCalc):
+    '''
+    raises InvalidNetwork with every problem of the topology of the network, if it has any
+    '''
+    problems = get_network_problems(shpCalc)
+    if problems:
+        logger.error(f'Invalid network: {problems}')
+        raise InvalidNetwork(problems)
@@ -10,17 +10,21 @@ from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from weasyprint import CSS, HTML
 
+from core.cache import get_cached_result, set_cached_result
 from core.models import Signatory
 
-from .calculate import SHP
+from .calculate import SHP, calculate_batch
+from .constants import CALC_BATCH_MAX_SIZE
 from .models import (Config, Diameter, Fitting, FittingDiameter, Fixture,
                      Material, MaterialConnection, Reduction)
+from .scenarios import ScenarioSearch
 from .serializers import (ConfigSerializer, DiameterSerializer,
                           FittingDiameterResponseSerializer,
                           FittingDiameterSerializer, FittingSerializer,
                           FixtureSerializer, MaterialConnectionSerializer,
                           MaterialFileSerializer, MaterialSerializer,
                           ReductionSerializer, SHPCalcSerializer)
+from .sizing import DiameterSizing
 
 
 logger = logging.getLogger(__name__)
@@ -110,19 +114,21 @@ class FittingDiameterViewSet(viewsets.ViewSet):
         if len(errors):
             raise ValidationError(errors)
 
-        for item in fitting_diameter_array:
-            id = item.pop('id', None)
-            instance = None
-            if id:
-                instance = FittingDiameter.objects.filter(id=id).first()
-                if instance:
-                    serializer = FittingDiameterSerializer(instance, data=item, partial=True)
+        # one transaction, the catalog version is bumped once for the whole array
+        with transaction.atomic():
+            for item in fitting_diameter_array:
+                id = item.pop('id', None)
+                instance = None
+                if id:
+                    instance = FittingDiameter.objects.filter(id=id).first()
+                    if instance:
+                        serializer = FittingDiameterSerializer(instance, data=item, partial=True)
+                        serializer.is_valid(raise_exception=True)
+                        serializer.save()
+                else:
+                    serializer = FittingDiameterSerializer(data=item)
                     serializer.is_valid(raise_exception=True)
                     serializer.save()
-            else:
-                serializer = FittingDiameterSerializer(data=item)
-                serializer.is_valid(raise_exception=True)
-                serializer.save()
         serializer = FittingDiameterResponseSerializer(self.get_object_by_material_id(material))
         return Response(serializer.data)
 
@@ -244,6 +250,11 @@ class Calculate(views.APIView):
                     {'detail': 'Só é possivel imprimir sistemas cálculados'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
+            if serializer.data.get('precision') != Config.PrecisionMode.FINAL:
+                return Response(
+                    {'detail': 'Só é possivel imprimir sistemas cálculados com a precisão final'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             try:
                 context = {
                     'calculated_at': parse_datetime(calculated_at),
@@ -277,16 +288,41 @@ class Calculate(views.APIView):
                     {'detail': 'Problemas ao imprimir o cálculo enviado'},
                     status=status.HTTP_400_BAD_REQUEST)
         else:
-            serializer = SHP(request.data).calculate()
+            cache_key = SHP.get_cache_key(request.data)
+            result = get_cached_result(cache_key, request.data.get('fileinfo'))
+            if result is not None:
+                return Response(result, headers={'X-Calc-Cache': 'HIT', 'X-Calc-Cache-Key': cache_key})
+            if request.data.get('sizing'):
+                serializer = DiameterSizing(request.data).calculate()
+            elif request.data.get('simultaneous_fixtures'):
+                serializer = ScenarioSearch(request.data).calculate()
+            else:
+                serializer = SHP(request.data).calculate()
             if serializer.is_valid():
                 error = serializer.data.pop('error', None)
                 if error:
                     return Response({'detail': error}, status=status.HTTP_400_BAD_REQUEST)
                 else:
-                    return Response(serializer.data)
+                    set_cached_result(cache_key, serializer.data)
+                    return Response(serializer.data, headers={'X-Calc-Cache': 'MISS', 'X-Calc-Cache-Key': cache_key})
             return Response({'detail': 'Problemas ao calcular os dados enviados'}, status=status.HTTP_400_BAD_REQUEST)
 
 
+class CalculateBatch(views.APIView):
+
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request, format=None) -> Response:
+        if not isinstance(request.data, list) or not request.data:
+            return Response({'detail': 'Envie uma lista de cálculos.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(request.data) > CALC_BATCH_MAX_SIZE:
+            return Response(
+                {'detail': f'Envie no máximo {CALC_BATCH_MAX_SIZE} cálculos por vez.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(calculate_batch(request.data))
+
+
 def test(request):
     from django.shortcuts import render
 
@@ -0,0 +1,21 @@
+import pickle
+from typing import Any, Callable
+
+# catalog shipped to the worker process by `initialize_worker`
+_catalog = None
+
+
+def initialize_worker(catalog: bytes):
+    '''
+    runs once in every worker process of `CalculationExecutor`. A spawned process
+    imports this module before django is ready, so it imports nothing of the apps,
+    and the catalog is unpickled only after the setup, since it holds model instances
+    '''
+    global _catalog
+    import django
+    django.setup()
+    _catalog = pickle.loads(catalog)
+
+
+def run_in_worker(function: Callable[[Any, Any], Any], item: Any) -> Any:
+    return function(_catalog, item)
@@ -87,6 +87,9 @@ export const loadMaterialBackup = (object: MaterialFileSerializer) => {
   };
 };
 
+// key of the last result, lets the server recalculate only what changed
+let previousCacheKey: string | null = null;
+
 export const calculateSHP = (object: SHPCalcSerializer) => {
   return (dispatch: Dispatch, getState: () => RootState): Promise<SHPCalcSerializer> => {
     const token = getState().auth.token;
@@ -99,8 +102,9 @@ export const calculateSHP = (object: SHPCalcSerializer) => {
     dispatch(startFetching());
     let url = new URL("shp/calculate/", import.meta.env.VITE_APP_API_URL);
     return axios
-      .post(url.toString(), object, config)
+      .post(url.toString(), { ...object, previous_cache_key: previousCacheKey }, config)
       .then((res) => {
+        previousCacheKey = res.headers["x-calc-cache-key"] ?? null;
         // dispatch(setCalc(res.data));
         dispatch(createMessage({ SUCCESS: "Cálculado com sucesso" }));
         dispatch(finishFetching());
@@ -102,6 +102,15 @@ export interface MaterialFileSerializer {
   fittingdiameters?: FittingDiameterResponseSerializer;
 }
 
+export interface IGCCalcPathAlternativeSerializer {
+  diameter_id: number | null;
+  pressure_drop?: number | null;
+  end_pressure?: number | null;
+  speed?: number | null;
+  pressure_drop_accumulated?: number | null;
+  fail?: boolean | null;
+}
+
 export interface IGCCalcPathSerializer {
   start: string;
   end: string;
@@ -129,6 +138,15 @@ export interface IGCCalcPathSerializer {
   pressure_drop_accumulated_color?: string | null;
   fail?: boolean | null;
   fail_level?: number | null;
+  diameter_alternatives?: IGCCalcPathAlternativeSerializer[] | null;
+}
+
+export interface IGCCalcSizingSerializer {
+  material_id: number | null;
+  diameters_ids?: number[] | null;
+  pressure_drop_margin?: number | null;
+  speed_margin?: number | null;
+  evaluations?: number | null;
 }
 
 export interface IGCCalcSerializer {
@@ -141,8 +159,28 @@ export interface IGCCalcSerializer {
   gas_id: number | null;
   start_pressure: number | null;
   signatory_id: number | null;
+  diameter_alternatives?: boolean | null;
+  sizing?: IGCCalcSizingSerializer | null;
   paths: IGCCalcPathSerializer[];
   error?: string | null;
   calculated_at?: string | null;
   max_fail_level?: number | null;
 }
+
+export interface IGCCalcMatrixSerializer {
+  calc: IGCCalcSerializer;
+  gas_ids: number[];
+  start_pressures: number[];
+  calc_types: string[];
+}
+
+export interface IGCCalcMatrixResultSerializer {
+  gas_id: number;
+  start_pressure: number;
+  calc_type: string;
+  pressure_drop_margin: number;
+  speed_margin: number;
+  min_end_pressure: number;
+  max_fail_level: number;
+  accepted: boolean;
+}
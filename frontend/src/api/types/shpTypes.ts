@@ -11,6 +11,13 @@ export const PressureType = {
 };
 
 export const PressureTypes = [PressureType.GRAVITACIONAL, PressureType.BOMBA];
+
+export const SolverType = {
+  ITERATIVO: { value: "IT", name: "Iterativo" },
+  GRADIENTE: { value: "GG", name: "Gradiente global" },
+};
+
+export const SolverTypes = [SolverType.ITERATIVO, SolverType.GRADIENTE];
 export interface ConfigSerializer {
   id: 1;
   calc_type: "VM" | "VR";
@@ -163,12 +170,25 @@ export interface SHPCalcPumpSerializer {
   NPSHd?: number | null;
 }
 
+export interface SHPCalcSizingSerializer {
+  material_id: number | null;
+  diameters_ids?: number[] | null;
+  max_head?: number | null;
+  max_speed?: number | null;
+  cost?: number | null;
+  evaluations?: number | null;
+}
+
 export interface SHPCalcSerializer {
   fileinfo: FileInfoSerializer;
   name: string | null;
   observation: string | null;
   calc_type: string | null;
   pressure_type: string | null;
+  solver_type?: string | null;
+  precision?: string | null;
+  simultaneous_fixtures?: number | null;
+  sizing?: SHPCalcSizingSerializer | null;
   pump: SHPCalcPumpSerializer;
   material_id: number | null;
   diameter_id: number | null;
@@ -178,4 +198,9 @@ export interface SHPCalcSerializer {
   error?: string | null;
   less_favorable_path_fixture_index?: number | null;
   calculated_at?: string | null;
+  catalog_version?: number | null;
+  accuracy?: number | null;
+  evaluated_scenarios?: number | null;
+  previous_cache_key?: string | null;
+  previous_result?: any | null;
 }